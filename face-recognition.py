@@ -1,7 +1,21 @@
+import os
+import sys
 import cv2
 import face_recognition
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'my_flask_app'))
+from face_gallery import FACE_MATCH_THRESHOLD  # noqa: E402
+from face_index import create_index  # noqa: E402
+from face_recognition_utils import detect_faces  # noqa: E402
+from face_tracker import FaceTracker  # noqa: E402
+from frame_source import open_frame_source  # noqa: E402
+
+# 追跡モード（顔検出は数フレームに1回だけ行い、その間は追跡した顔の名前を使い回す）
+TRACKING = os.environ.get('FACE_TRACKING', '1') != '0'
+# 追跡モードで顔検出を行う間隔（フレーム数）
+DETECT_INTERVAL = int(os.environ.get('FACE_DETECT_INTERVAL', '10'))
+
 # 学習データの顔画像（ここでは顔画像 'face.jpg' と 'face1.jpg' を使用）
 train_imgs = [face_recognition.load_image_file("face.jpg"), face_recognition.load_image_file("face1.jpg")]
 train_img_encodings = [face_recognition.face_encodings(img)[0] for img in train_imgs]
@@ -9,43 +23,60 @@ train_img_encodings = [face_recognition.face_encodings(img)[0] for img in train_
 # 学習データの名前
 known_face_names = ["Person 1", "Person 2"]
 
-# Webカメラのキャプチャを開始
-cap = cv2.VideoCapture(0)  # OpenCVでWebカメラをキャプチャ
+# 学習データの顔特徴量をインデックスに登録（人数が多い場合は 'ivf' を指定する）
+face_index = create_index(os.environ.get('FACE_INDEX', 'brute'))
+face_index.load((i, name, encoding) for i, (name, encoding) in enumerate(zip(known_face_names, train_img_encodings)))
 
-while True:
-    # 映像のフレームをキャプチャ
-    ret, frame = cap.read()
 
-    # キャプチャしたフレームをRGB形式に変換（face_recognitionはRGBを使用）
-    rgb_frame = np.ascontiguousarray(frame[:, :, ::-1])
 
-    # 映像内の顔を検出
-    face_locations = face_recognition.face_locations(rgb_frame)
+def identify_faces(rgb_frame, face_locations):
+    """
+    検出した顔ごとに名前を求める（一致しない顔は None）。
+    """
+    # 顔の特徴量（エンコーディング）を取得
+    face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+    # 検出したすべての顔と学習データとのユークリッド距離を1回の行列演算で求め、0.40未満であれば一致と判定
+    return [matched_name for _, matched_name, _ in face_index.match_batch(face_encodings, FACE_MATCH_THRESHOLD)]
+
+
+def draw_face(frame, location, name):
+    top, right, bottom, left = location
+    # 顔の周りに四角形を描画
+    cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
 
-    # 顔が検出された場合にのみ処理を行う
-    if face_locations:
-        # 顔の特徴量（エンコーディング）を取得
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+    # 名前を顔の上に表示
+    font = cv2.FONT_HERSHEY_DUPLEX
+    cv2.putText(frame, name if name is not None else "Unknown", (left + 6, top - 6), font, 0.5, (255, 255, 255), 1)
 
-        # 検出した顔ごとに認証を行う
-        for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-            # 学習データとのユークリッド距離を計算
-            dists = face_recognition.face_distance(train_img_encodings, face_encoding)
 
-            # 類似度が0.40以下であれば一致と判定
-            name = "Unknown"
-            min_dist = min(dists)
+tracker = FaceTracker(detect_faces, identify_faces, detect_interval=DETECT_INTERVAL)
 
-            if min_dist < 0.40:  # 類似度が0.40以下の場合に一致と判定
-                match_index = np.argmin(dists)  # 最小距離のインデックスを取得
-                name = known_face_names[match_index]
+# キャプチャを開始（引数で動画ファイルや画像ディレクトリも指定できる。省略時は FRAME_SOURCE）
+# カメラの場合は別スレッドで取り込み、常に最新のフレームを処理する
+cap = open_frame_source(sys.argv[1] if len(sys.argv) > 1 else None)
+
+while True:
+    # 最新のフレームを取得
+    ret, frame = cap.read()
+    if not ret:
+        break
+
+    # キャプチャしたフレームをRGB形式に変換（face_recognitionはRGBを使用）
+    rgb_frame = np.ascontiguousarray(frame[:, :, ::-1])
 
-            # 顔の周りに四角形を描画
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+    if TRACKING:
+        # 追跡中の顔は名前を保持しているので、新しく現れた顔だけ特徴量を計算する
+        for track in tracker.update(rgb_frame):
+            draw_face(frame, track.box, track.name)
+    else:
+        # 映像内の顔を検出（FACE_DETECTION_SCALE などの設定に従い、縮小したフレームで検出する）
+        face_locations = detect_faces(rgb_frame)
 
-            # 名前を顔の上に表示
-            font = cv2.FONT_HERSHEY_DUPLEX
-            cv2.putText(frame, name, (left + 6, top - 6), font, 0.5, (255, 255, 255), 1)
+        # 顔が検出された場合にのみ処理を行う
+        if face_locations:
+            # 検出した顔ごとに認証を行う
+            for location, name in zip(face_locations, identify_faces(rgb_frame, face_locations)):
+                draw_face(frame, location, name)
 
     # フレームを表示
     cv2.imshow('Face Recognition', frame)
@@ -54,6 +85,7 @@ while True:
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
-# Webカメラを解放
+# 入力元を解放
 cap.release()
 cv2.destroyAllWindows()
+print(f"Dropped frames: {cap.dropped_frames}/{cap.captured_frames}")
@@ -1,6 +1,6 @@
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, render_template, redirect, url_for, request, flash, session, jsonify, g, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from gaze_recognition_utils import perform_gaze_recognition
+from gaze_recognition_utils import process_gaze_frame, get_eye_patterns, GazeSequenceMatcher, static_face_mesh_pool, FACE_MESH_POOL_TIMEOUT, GAZE_TIMEOUT
 from sqlalchemy import JSON
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
@@ -10,13 +10,45 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf.file import FileField, FileAllowed
 from werkzeug.utils import secure_filename
 from flask_migrate import Migrate
-from face_recognition_utils import recognize_face_from_camera
+from face_recognition_utils import recognize_face_in_frame, decode_frame, compute_face_encoding, compute_enrollment_encoding, encoding_to_bytes, bytes_to_encoding, identify_encodings, identify_faces_in_image, ENROLLMENT_ERRORS
+from face_gallery import FACE_MATCH_THRESHOLD
+from face_index import create_index, ARRAY_INDEX_TYPES
+from gallery_snapshot import open_snapshot_gallery, iter_snapshot_rows, write_snapshot, append_to_snapshot, compact_snapshot
+from bulk_enrollment import (list_enrollment_jobs, validate_enrollment_jobs, encode_enrollment_job,
+                             USERNAME_MIN_LENGTH, USERNAME_MAX_LENGTH, PASSWORD_MIN_LENGTH, PASSWORD_MAX_LENGTH)
+from stream_recognition import StreamRecognitionServer
+from batch_verification import create_executor, list_images, verify_images, WORKERS as BATCH_VERIFY_WORKERS
+from login_session import LoginSession, FACE_TIMEOUT
+from model_loader import warm_up
+from metrics import LOGIN_OUTCOMES, REQUEST_SECONDS, GALLERY_LOAD_SECONDS
+import metrics
+import click
+import csv
+import fcntl
+import cv2
+import json
+import multiprocessing
+import numpy as np
 import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
+# 顔特徴量のインデックス（'brute': 総当たり、'ivf': 大規模ギャラリー向けの近似探索、'int8' / 'float16': 量子化した行列で絞り込んでから厳密に判定）
+app.config['FACE_INDEX'] = os.environ.get('FACE_INDEX', 'brute')
+# ギャラリーのスナップショットファイル（flask export-gallery で作成すると、DBの代わりにここから読み込む）
+app.config['GALLERY_SNAPSHOT'] = os.environ.get('FACE_GALLERY_SNAPSHOT',
+                                                os.path.join(app.instance_path, 'gallery.snapshot'))
+# スナップショットに追記したレコードがこの数を超えたら compaction する
+app.config['GALLERY_SNAPSHOT_COMPACT_EVERY'] = int(os.environ.get('FACE_GALLERY_SNAPSHOT_COMPACT_EVERY', '256'))
+# /identify で1つの顔について返せる候補の数の上限
+app.config['IDENTIFY_MAX_K'] = int(os.environ.get('FACE_IDENTIFY_MAX_K', '20'))
 db = SQLAlchemy(app)
 
 migrate = Migrate(app, db)  # Flask-Migrateの設定
@@ -31,12 +63,30 @@ class User(db.Model, UserMixin):
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
     face_image = db.Column(db.String(150), nullable=True)
+    # 顔写真から計算した128次元の顔特徴量（float64のバイト列）
+    face_encoding = db.Column(db.LargeBinary, nullable=True)
 
     # 目線パターンを4つのカラムとして保存
     eye_pattern_1 = db.Column(db.String, nullable=True)
     eye_pattern_2 = db.Column(db.String, nullable=True)
     eye_pattern_3 = db.Column(db.String, nullable=True)
     eye_pattern_4 = db.Column(db.String, nullable=True)
+
+
+class FaceLoginAttempt(db.Model):
+    """ブラウザから送るフレームでのログインの途中状態。Cookieにはランダムな nonce だけを保存する。"""
+    nonce = db.Column(db.String(64), primary_key=True)
+    # 'face'（顔認証中）または 'gaze'（目線認証中）
+    stage = db.Column(db.String(16), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    gaze = db.Column(JSON, nullable=True)
+    eye_open = db.Column(db.Boolean, nullable=False, default=True)
+    face_box = db.Column(JSON, nullable=True)
+    # ログインを始めた時刻と、今の段階を始めた時刻（time.time()）
+    started_at = db.Column(db.Float, nullable=False)
+    stage_started_at = db.Column(db.Float, nullable=False)
+
+
 class FaceRecognitionForm(FlaskForm):
     face_image = FileField('Face Image', validators=[
         FileAllowed(['jpg', 'png'], 'Images only!')
@@ -72,6 +122,133 @@ class FaceRecognitionForm(FlaskForm):
     ])
 
 
+# ワーカープロセスごとに1つだけ保持する顔特徴量のギャラリー
+face_gallery = create_index(app.config['FACE_INDEX'])
+
+
+def gallery_version_path():
+    # 顔特徴量が更新されるたびに1ずつ増やすバージョン番号のファイル（ワーカー間での無効化に使う）
+    return os.path.join(app.instance_path, 'gallery.version')
+
+
+def touch_gallery_version():
+    """
+    他のワーカープロセスのギャラリーを無効化するためにバージョン番号を1つ増やす。
+
+    更新時刻ではなく番号を使うため、更新時刻の精度が粗いファイルシステムで続けて登録しても必ず値が変わる。
+    一時ファイルに書いてから os.replace で置き換えるため、読む側が書きかけの値を読むことはない。
+
+    Returns:
+        int: 増やした後のバージョン番号。
+    """
+    os.makedirs(app.instance_path, exist_ok=True)
+    path = gallery_version_path()
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            version = (current_gallery_version() or 0) + 1
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(str(version))
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return version
+
+
+def current_gallery_version():
+    try:
+        with open(gallery_version_path()) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def get_face_gallery():
+    """
+    顔特徴量のギャラリーを返す。初回呼び出し時と、他のワーカーで顔が登録された後にのみ読み込む。
+
+    スナップショットファイルがある場合はそこから読み込む（総当たり・量子化の場合は memmap で開くため、
+    全ワーカーで同じページキャッシュを共有する）。ない場合はDBから読み込む。
+    """
+    global face_gallery
+    version = current_gallery_version()
+    if not face_gallery.loaded or face_gallery.version != version:
+        snapshot = app.config['GALLERY_SNAPSHOT']
+        with GALLERY_LOAD_SECONDS.time():
+            if os.path.exists(snapshot) and app.config['FACE_INDEX'] in ARRAY_INDEX_TYPES:
+                face_gallery = open_snapshot_gallery(snapshot, version=version, index=app.config['FACE_INDEX'])
+            elif os.path.exists(snapshot):
+                face_gallery.load(iter_snapshot_rows(snapshot), version=version)
+            else:
+                face_gallery.load(enrolled_encodings(), version=version)
+    return face_gallery
+
+
+def enrolled_encodings():
+    """
+    顔特徴量が登録されているユーザーの (user_id, username, encoding) をDBから読み込む。
+    """
+    users = User.query.filter(User.face_encoding.isnot(None)).all()
+    return [(user.id, user.username, bytes_to_encoding(user.face_encoding)) for user in users]
+
+
+def append_gallery_snapshot(user_id, username, encoding):
+    """
+    スナップショットファイルがある場合、登録した顔特徴量を追記する。追記が溜まったら compaction する。
+    """
+    snapshot = app.config['GALLERY_SNAPSHOT']
+    if not os.path.exists(snapshot):
+        return
+    if append_to_snapshot(snapshot, user_id, username, encoding) >= app.config['GALLERY_SNAPSHOT_COMPACT_EVERY']:
+        compact_snapshot(snapshot)
+
+
+def refresh_gallery_snapshot():
+    """
+    スナップショットファイルがある場合、DBの内容で作り直す（一括での更新の後に使う）。
+    """
+    snapshot = app.config['GALLERY_SNAPSHOT']
+    if os.path.exists(snapshot):
+        write_snapshot(snapshot, enrolled_encodings())
+
+
+def should_warm_up(debug):
+    """
+    このプロセスでモデルの読み込みとウォームアップを行うかを返す。
+
+    デバッグモードのリローダーでは、ファイルを監視するだけのプロセスと、リクエストを受け付ける子プロセス
+    （WERKZEUG_RUN_MAIN=true）の両方で app.py が読み込まれるため、子プロセスでだけ行う。
+    """
+    return not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+
+# WSGI サーバーのワーカーとして起動する場合は WARM_UP=1 にすると、リクエストを受け付ける前に
+# モデルを読み込む（flask db などのコマンドではモデルを読み込まないよう、既定では行わない）。
+# python app.py で起動した場合は下の __main__ で行う
+if os.environ.get('WARM_UP', '0') == '1' and __name__ != '__main__' and should_warm_up(app.debug):
+    warm_up()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None and request.endpoint is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started_at, endpoint=request.endpoint)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus から取得する計測値（段階ごとの処理時間、検出数、認証結果、FaceMesh のプールの状態）
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -82,8 +259,10 @@ class LoginForm(FlaskForm):
     remember = BooleanField('Remember me')
 
 class RegisterForm(FlaskForm):
-    username = StringField('Username', validators=[InputRequired(), Length(min=4, max=15)])
-    password = PasswordField('Password', validators=[InputRequired(), Length(min=8, max=80)])
+    username = StringField('Username', validators=[
+        InputRequired(), Length(min=USERNAME_MIN_LENGTH, max=USERNAME_MAX_LENGTH)])
+    password = PasswordField('Password', validators=[
+        InputRequired(), Length(min=PASSWORD_MIN_LENGTH, max=PASSWORD_MAX_LENGTH)])
     confirm_password = PasswordField('Confirm Password', validators=[
         InputRequired(), EqualTo('password', message='Passwords must match')])
 
@@ -98,33 +277,301 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user and check_password_hash(user.password, form.password.data):
             login_user(user, remember=form.remember.data)
+            LOGIN_OUTCOMES.inc(method='password', outcome='success')
             return redirect(url_for('dashboard'))
+        LOGIN_OUTCOMES.inc(method='password', outcome='failure')
         flash('Invalid username or password')
     return render_template('login.html', form=form)
 
 
 @app.route('/face_login', methods=['GET', 'POST'])
 def face_login():
-    # DBからユーザー情報を取得して辞書形式で格納
-    users = [{'name': user.username, 'face_image': user.face_image} for user in User.query.all()]
-
-    # 顔認証を実行
-    recognized_user = recognize_face_from_camera(users)
-
-    if recognized_user:
-        user = User.query.filter_by(username=recognized_user).first()
-        if user:
-            # 目線認証を行う
-            if perform_gaze_recognition(user):
-                login_user(user)
-                return redirect(url_for('dashboard'))
-            else:
-                flash('Gaze recognition failed. Please try again.')
-                return redirect(url_for('face_login'))
+    # ブラウザからフレームを送る方式ではページを表示するだけ
+    if request.args.get('mode') != 'camera':
+        return render_template('face_login.html')
+
+    # サーバーのカメラを使う方式（ローカル環境向け）
+    # カメラを1回だけ開き、メモリ上のギャラリーでの顔認証に続けて同じフレームで目線認証を行う
+    login_session = LoginSession(get_face_gallery(),
+                                 lambda username: User.query.filter_by(username=username).first())
+    user = login_session.run()
+    app.logger.info('Face login decided as %s in %.2fs (%d frames)', login_session.stage,
+                    login_session.time_to_decision or 0.0, login_session.frames)
 
+    if user:
+        login_user(user)
+        LOGIN_OUTCOMES.inc(method='face_camera', outcome='success')
+        return redirect(url_for('dashboard'))
+    if login_session.failed_stage == LoginSession.BUSY:
+        LOGIN_OUTCOMES.inc(method='face_camera', outcome='busy')
+        flash('The server is busy with other logins. Please try again in a moment.')
+        return redirect(url_for('face_login'))
+    if login_session.failed_stage == LoginSession.GAZE:
+        LOGIN_OUTCOMES.inc(method='face_camera', outcome='gaze_failed')
+        flash('Gaze recognition failed. Please try again.')
+        return redirect(url_for('face_login'))
+
+    LOGIN_OUTCOMES.inc(method='face_camera', outcome='face_failed')
     flash('Face recognition failed. Please try again.')
     return render_template('face_login.html')
 
+
+# ブラウザから送られてくるフレームで顔・目線認証を行うAPI。
+# 認証の途中状態は FaceLoginAttempt としてDBに保存し、セッションCookieにはその nonce だけを保存する。
+# どのワーカーがフレームを受け取っても同じように処理でき、ユーザーIDなどの途中状態はクライアントから見えない。
+# 成功・失敗が決まった時点で状態を削除するため、同じCookieを送り直しても再利用できない。
+def face_login_attempt():
+    nonce = session.get('face_login')
+    if not isinstance(nonce, str):
+        return None
+    return FaceLoginAttempt.query.get(nonce)
+
+
+def face_login_verdict(attempt, stage=None, failed_stage=None):
+    match_count = attempt.gaze['match_count'] if attempt.gaze else 0
+    verdict = {'stage': stage or attempt.stage, 'match_count': match_count}
+    if failed_stage:
+        verdict['failed_stage'] = failed_stage
+    if verdict['stage'] == 'success':
+        verdict['redirect'] = url_for('dashboard')
+    return verdict
+
+
+def finish_face_login(attempt, stage, failed_stage=None):
+    """成功・失敗が決まったログインの状態を削除し、最後の結果を返す。"""
+    verdict = face_login_verdict(attempt, stage, failed_stage)
+    db.session.delete(attempt)
+    db.session.commit()
+    session.pop('face_login', None)
+    return jsonify(verdict)
+
+
+def face_login_timed_out(attempt, now):
+    """今の段階の制限時間（顔認証は FACE_TIMEOUT、目線認証は GAZE_TIMEOUT）を過ぎていれば True を返す。"""
+    timeout = FACE_TIMEOUT if attempt.stage == 'face' else GAZE_TIMEOUT
+    return now - attempt.stage_started_at > timeout
+
+
+def fail_face_login(attempt):
+    LOGIN_OUTCOMES.inc(method='face_frames', outcome=f"{attempt.stage}_failed")
+    return finish_face_login(attempt, 'failed', failed_stage=attempt.stage)
+
+
+@app.route('/face_login/session', methods=['POST'])
+def start_face_login_session():
+    now = time.time()
+    # 前のログインの状態と、途中で放棄されて制限時間を過ぎた状態を削除する
+    previous = face_login_attempt()
+    if previous is not None:
+        db.session.delete(previous)
+    FaceLoginAttempt.query.filter(FaceLoginAttempt.started_at < now - FACE_TIMEOUT - GAZE_TIMEOUT).delete()
+    attempt = FaceLoginAttempt(nonce=secrets.token_urlsafe(32), stage='face', eye_open=True,
+                               started_at=now, stage_started_at=now)
+    db.session.add(attempt)
+    db.session.commit()
+    session['face_login'] = attempt.nonce
+    return jsonify(face_login_verdict(attempt))
+
+
+@app.route('/face_login/session', methods=['GET'])
+def get_face_login_verdict():
+    attempt = face_login_attempt()
+    if attempt is None:
+        return jsonify({'error': 'No face login session. Start one first.'}), 404
+    if face_login_timed_out(attempt, time.time()):
+        return fail_face_login(attempt)
+    return jsonify(face_login_verdict(attempt))
+
+
+@app.route('/face_login/session/frame', methods=['POST'])
+def post_face_login_frame():
+    attempt = face_login_attempt()
+    if attempt is None:
+        return jsonify({'error': 'No face login session. Start one first.'}), 404
+    now = time.time()
+    if face_login_timed_out(attempt, now):
+        return fail_face_login(attempt)
+
+    # JPEGは multipart の 'frame' フィールドか、リクエストボディそのもので受け取る
+    upload = request.files.get('frame')
+    frame = decode_frame(upload.read() if upload else request.get_data())
+    if frame is None:
+        return jsonify({'error': 'Could not decode frame.'}), 400
+
+    if attempt.stage == 'face':
+        overlay = []
+        recognized_user = recognize_face_in_frame(frame, get_face_gallery(), overlay)
+        if recognized_user:
+            user = User.query.filter_by(username=recognized_user).first()
+            if user:
+                matcher = GazeSequenceMatcher(get_eye_patterns(user))
+                # 目線認証では、顔が見つかった位置の周りだけを FaceMesh に渡す
+                face_box = next(location for location, name in overlay if name == recognized_user)
+                attempt.stage = 'gaze'
+                attempt.stage_started_at = matcher.started_at
+                attempt.user_id = user.id
+                attempt.gaze = matcher.state()
+                attempt.eye_open = True
+                attempt.face_box = list(face_box)
+    else:
+        user = User.query.get(attempt.user_id)
+        if user is None:
+            db.session.delete(attempt)
+            db.session.commit()
+            session.pop('face_login', None)
+            return jsonify({'error': 'User no longer exists.'}), 404
+        matcher = GazeSequenceMatcher.from_state(get_eye_patterns(user), attempt.gaze)
+        try:
+            with static_face_mesh_pool.checkout(FACE_MESH_POOL_TIMEOUT) as face_mesh:
+                eye_direction, attempt.eye_open, overlay = process_gaze_frame(
+                    frame, attempt.eye_open, face_mesh, face_box=attempt.face_box)
+        except TimeoutError:
+            # 状態は進めずに、少し待ってから同じ段階のフレームを送り直してもらう
+            LOGIN_OUTCOMES.inc(method='face_frames', outcome='busy')
+            response = jsonify({'error': 'The server is busy. Please retry shortly.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        face_box = overlay.get('face_box')
+        attempt.face_box = list(face_box) if face_box is not None else None
+        status = matcher.update(eye_direction)
+        attempt.gaze = matcher.state()
+        if status == GazeSequenceMatcher.SUCCESS:
+            login_user(user)
+            LOGIN_OUTCOMES.inc(method='face_frames', outcome='success')
+            return finish_face_login(attempt, 'success')
+        if status == GazeSequenceMatcher.TIMEOUT:
+            return fail_face_login(attempt)
+
+    db.session.commit()
+    return jsonify(face_login_verdict(attempt))
+
+
+def parse_threshold(value):
+    """
+    リクエストで指定された閾値（数値または数値の配列）を検証する。0 以上の有限の値でない場合は ValueError を送出する。
+    """
+    if value is None:
+        raise ValueError("'threshold' must be a number or a list of numbers.")
+    threshold = np.asarray(value, dtype=np.float64)
+    if threshold.ndim > 1 or threshold.size == 0 or not np.all(np.isfinite(threshold)) or np.any(threshold < 0):
+        raise ValueError("'threshold' must be a non-negative finite number or a list of them.")
+    return threshold
+
+
+def parse_identify_request():
+    """
+    /identify のリクエストから (顔特徴量の行列または None, RGB 画像または None, k, 閾値) を取り出す。
+    不正な値の場合は ValueError を送出する。
+    """
+    upload = request.files.get('image')
+    params = request.form if upload else (request.get_json(silent=True) or {})
+    k = int(params.get('k', 1))
+    if not 1 <= k <= app.config['IDENTIFY_MAX_K']:
+        raise ValueError(f"k must be between 1 and {app.config['IDENTIFY_MAX_K']}.")
+    threshold = params.get('threshold', FACE_MATCH_THRESHOLD)
+    if isinstance(threshold, str):
+        # multipart では顔ごとの閾値をカンマ区切りで受け取る
+        threshold = [float(value) for value in threshold.split(',')]
+        threshold = threshold[0] if len(threshold) == 1 else threshold
+    threshold = parse_threshold(threshold)
+
+    if upload:
+        frame = decode_frame(upload.read())
+        if frame is None:
+            raise ValueError('Could not decode image.')
+        return None, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), k, threshold
+
+    encodings = np.asarray(params.get('encodings', []), dtype=np.float64)
+    if encodings.ndim != 2 or encodings.shape[0] == 0 or encodings.shape[1] != 128:
+        raise ValueError("'encodings' must be a non-empty list of 128-dimensional face encodings.")
+    if threshold.ndim > 0 and threshold.shape != (len(encodings),):
+        raise ValueError("'threshold' must be a number or a list with one value per encoding.")
+    return encodings, None, k, threshold
+
+
+@app.route('/identify', methods=['POST'])
+@login_required
+def identify():
+    """
+    複数の顔を一度に照合し、顔ごとに近い順の候補 k 人と距離を返すAPI。
+
+    JSON の {"encodings": [[...128個...], ...], "k": 5, "threshold": 0.4 または顔ごとの配列} か、
+    multipart の 'image'（写っているすべての顔を検出して照合する）と 'k'、'threshold' を受け取る。
+    """
+    try:
+        encodings, rgb_image, k, threshold = parse_identify_request()
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    gallery = get_face_gallery()
+    if rgb_image is not None:
+        faces = identify_faces_in_image(rgb_image, gallery, k=k, threshold=threshold)
+        if threshold.ndim > 0 and threshold.shape != (len(faces),):
+            return jsonify({'error': f"'threshold' has {threshold.size} values but {len(faces)} faces were found."}), 400
+    else:
+        faces = identify_encodings(encodings, gallery, k=k, threshold=threshold)
+    return jsonify({'gallery_size': len(gallery), 'faces': faces})
+
+
+# /verify_images で使うプール（初回のリクエストで作成し、以降のリクエストで使い回す）
+verification_pool = None
+# 同時に来た最初のリクエストがそれぞれプールを作らないようにするロック
+verification_pool_lock = threading.Lock()
+
+
+def get_verification_pool():
+    global verification_pool
+    if verification_pool is None:
+        with verification_pool_lock:
+            if verification_pool is None:
+                verification_pool = create_executor()
+    return verification_pool
+
+
+@app.route('/verify_images', methods=['POST'])
+@login_required
+def verify_images_endpoint():
+    """
+    multipart の 'images' で送られた多数の画像を登録済みユーザーと照合し、
+    画像ごとの結果を処理が終わった順に NDJSON（1行に1つの JSON）で返すAPI。
+
+    'k' と 'threshold' で顔ごとの候補の数と閾値を指定できる。
+    """
+    uploads = request.files.getlist('images')
+    if not uploads:
+        return jsonify({'error': "No images. Send them as multipart 'images' fields."}), 400
+    try:
+        k = int(request.form.get('k', 1))
+        threshold = float(parse_threshold(float(request.form.get('threshold', FACE_MATCH_THRESHOLD))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not 1 <= k <= app.config['IDENTIFY_MAX_K']:
+        return jsonify({'error': f"k must be between 1 and {app.config['IDENTIFY_MAX_K']}."}), 400
+
+    gallery = get_face_gallery()
+    # アップロードされた画像はリクエストの終了時に閉じられるため、一時ディレクトリに保存してから
+    # ワーカーにパスを渡す（画像データをメモリに置くのは処理中の画像だけになる）
+    tmp_dir = tempfile.mkdtemp(prefix='verify-images-')
+    images = []
+    try:
+        for i, upload in enumerate(uploads):
+            path = os.path.join(tmp_dir, f"{i}{os.path.splitext(secure_filename(upload.filename or ''))[1]}")
+            upload.save(path)
+            images.append((upload.filename, path))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    def generate():
+        for result in verify_images(images, gallery, get_verification_pool(), k=k, threshold=threshold):
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # 一時ディレクトリはレスポンスを閉じるときに削除する（ストリームが始まる前にクライアントが切断した場合も含む）
+    response.call_on_close(lambda: shutil.rmtree(tmp_dir, ignore_errors=True))
+    return response
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
@@ -171,8 +618,26 @@ def face_recognition():
         if form.face_image.data:
             filename = secure_filename(form.face_image.data.filename)
             filepath = os.path.join(upload_folder, filename)
-            form.face_image.data.save(filepath)
+            # 受け付けなかった顔写真を残さないよう（同じ名前の登録済みの顔写真も上書きしないよう）、
+            # 一時ファイルに保存して顔特徴量を計算し、受け付けた場合だけ保存先に移す
+            fd, tmp_path = tempfile.mkstemp(dir=upload_folder, suffix=os.path.splitext(filename)[1])
+            os.close(fd)
+            try:
+                form.face_image.data.save(tmp_path)
+                # 登録時に一度だけ顔特徴量を計算して保存する（小さい・ぼやけた・横を向いた顔は受け付けない）
+                encoding, reason = compute_enrollment_encoding(tmp_path)
+                if encoding is not None:
+                    os.replace(tmp_path, filepath)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            if encoding is None:
+                flash(f'{ENROLLMENT_ERRORS[reason]} Please try another photo.', 'error')
+                return render_template('face_recognition.html', form=form)
             current_user.face_image = filepath
+            current_user.face_encoding = encoding_to_bytes(encoding)
+        else:
+            encoding = None
 
         # 目線パターンを4つのカラムに格納
         current_user.eye_pattern_1 = form.eye_pattern_1.data
@@ -181,6 +646,17 @@ def face_recognition():
         current_user.eye_pattern_4 = form.eye_pattern_4.data
 
         db.session.commit()
+        # 新しい顔特徴量を自分のギャラリーにはその場で反映し、他のワーカーには無効化を通知する
+        # （目線パターンだけを変更した場合はギャラリーを変えない）
+        if encoding is not None:
+            append_gallery_snapshot(current_user.id, current_user.username, encoding)
+            version = touch_gallery_version()
+            if face_gallery.loaded:
+                face_gallery.upsert(current_user.id, current_user.username, encoding)
+                # 直前のバージョンまで読み込み済みの場合だけ、新しいバージョンを付ける
+                # （他のワーカーの更新を読み込んでいない場合は、次の照合で読み込み直す）
+                if (face_gallery.version or 0) == version - 1:
+                    face_gallery.version = version
         flash('Face and eye patterns registered successfully.', 'success')
         return redirect(url_for('dashboard'))
     else:
@@ -195,8 +671,226 @@ def face_recognition():
 
 
 
+@app.cli.command('backfill-encodings')
+def backfill_encodings():
+    """
+    顔写真は登録済みだが顔特徴量が保存されていないユーザーの特徴量を計算して保存する。
+
+    登録済みのユーザーがログインできなくならないよう、品質の判定（face_quality）は行わない。
+    """
+    users = User.query.filter(User.face_image.isnot(None), User.face_encoding.is_(None)).all()
+    updated = 0
+    for user in users:
+        try:
+            encoding = compute_face_encoding(user.face_image)
+        except Exception as e:
+            click.echo(f"Error processing image for {user.username}: {e}")
+            continue
+        if encoding is None:
+            click.echo(f"No face found in image for {user.username}: {user.face_image}")
+            continue
+        user.face_encoding = encoding_to_bytes(encoding)
+        updated += 1
+    db.session.commit()
+    refresh_gallery_snapshot()
+    touch_gallery_version()
+    click.echo(f"Backfilled face encodings for {updated}/{len(users)} users.")
+
+
+def save_enrollment_batch(batch, upload_folder):
+    """
+    一括登録で顔特徴量を計算できたユーザーを1回のトランザクションで保存する。
+
+    既に存在するユーザーは顔写真と顔特徴量だけを更新する。パスワードが指定されていない
+    新規ユーザーにはランダムなパスワードを設定する（顔・目線認証でログインする）。
+    顔写真はコミットできた後にアップロード先へコピーする（コミットに失敗した場合にファイルを残さない）。
+    """
+    usernames = [job['username'] for job, _ in batch]
+    users = {user.username: user for user in User.query.filter(User.username.in_(usernames))}
+    copies = []
+    for job, encoding in batch:
+        user = users.get(job['username'])
+        if user is None:
+            password = job['password'] or secrets.token_urlsafe(16)
+            user = User(username=job['username'], password=generate_password_hash(password))
+            db.session.add(user)
+            users[user.username] = user
+
+        filename = secure_filename(f"{job['username']}_{os.path.basename(job['face_image'])}")
+        filepath = os.path.join(upload_folder, filename)
+        copies.append((job['face_image'], filepath))
+        user.face_image = filepath
+        user.face_encoding = encoding
+        if job['eye_patterns']:
+            user.eye_pattern_1, user.eye_pattern_2, user.eye_pattern_3, user.eye_pattern_4 = job['eye_patterns']
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    for source, filepath in copies:
+        shutil.copyfile(source, filepath)
+    return len(batch)
+
+
+@app.cli.command('bulk-enroll')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True, help='顔特徴量を計算するプロセス数')
+@click.option('--batch-size', type=int, default=100, show_default=True, help='1回のトランザクションで保存する人数')
+@click.option('--failures', type=click.Path(), help='登録できなかった画像の一覧を書き出すCSVファイル')
+def bulk_enroll(source, workers, batch_size, failures):
+    """画像ディレクトリまたはCSVファイルから顔写真を一括登録する。
+
+    顔特徴量の計算はプロセスプールで並列に行い、batch-size 人ごとにコミットする。
+    既に顔特徴量が登録されているユーザーはスキップするため、中断しても同じコマンドで再開できる。
+    """
+    jobs = list_enrollment_jobs(source)
+    # ユーザー登録のフォームと同じ条件を満たさないユーザー名・パスワードは登録しない
+    jobs, invalid = validate_enrollment_jobs(jobs, [username for (username,) in db.session.query(User.username)])
+    enrolled_usernames = {username for (username,) in
+                          db.session.query(User.username).filter(User.face_encoding.isnot(None))}
+    pending = [job for job in jobs if job['username'] not in enrolled_usernames]
+    click.echo(f"{len(jobs) + len(invalid)} images found, {len(invalid)} invalid, "
+               f"{len(jobs) - len(pending)} already enrolled, {len(pending)} to process.")
+
+    upload_folder = os.path.join('static', 'uploads', 'faces')
+    os.makedirs(upload_folder, exist_ok=True)
+
+    start = time.monotonic()
+    enrolled = 0
+    failed = []
+    batch = []
+    with multiprocessing.Pool(workers) as pool:
+        for job, encoding, error in pool.imap_unordered(encode_enrollment_job, pending, chunksize=4):
+            if error:
+                failed.append((job, error))
+                continue
+            batch.append((job, encoding))
+            if len(batch) >= batch_size:
+                enrolled += save_enrollment_batch(batch, upload_folder)
+                batch = []
+                elapsed = time.monotonic() - start
+                click.echo(f"  {enrolled + len(failed)}/{len(pending)} processed ({(enrolled + len(failed)) / elapsed:.1f} images/s)")
+        if batch:
+            enrolled += save_enrollment_batch(batch, upload_folder)
+    refresh_gallery_snapshot()
+    touch_gallery_version()
+
+    elapsed = time.monotonic() - start
+    processed = enrolled + len(failed)
+    failed = invalid + failed
+    click.echo(f"Enrolled {enrolled} users, {len(failed)} failed in {elapsed:.1f}s "
+               f"({processed / elapsed if elapsed > 0 else 0.0:.1f} images/s).")
+    for job, error in failed[:10]:
+        click.echo(f"  {job['username']}: {error} ({job['face_image']})")
+    if failures and failed:
+        with open(failures, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['username', 'face_image', 'error'])
+            for job, error in failed:
+                writer.writerow([job['username'], job['face_image'], error])
+        click.echo(f"Wrote {len(failed)} failures to {failures}.")
+
+
+@app.cli.command('export-gallery')
+@click.option('--output', type=click.Path(), help='書き出すファイル（省略時は FACE_GALLERY_SNAPSHOT）')
+def export_gallery(output):
+    """User テーブルの顔特徴量をギャラリーのスナップショットファイルに書き出す。
+
+    書き出した後は、各ワーカーがDBの代わりにスナップショットからギャラリーを読み込む。
+    """
+    output = output or app.config['GALLERY_SNAPSHOT']
+    start = time.monotonic()
+    count = write_snapshot(output, enrolled_encodings())
+    if output == app.config['GALLERY_SNAPSHOT']:
+        touch_gallery_version()
+    click.echo(f"Exported {count} face encodings to {output} in {time.monotonic() - start:.2f}s.")
+
+
+@app.cli.command('compact-gallery')
+def compact_gallery():
+    """スナップショットに追記された顔特徴量を1つの行列にまとめ直す。"""
+    snapshot = app.config['GALLERY_SNAPSHOT']
+    if not os.path.exists(snapshot):
+        raise click.ClickException(f"No gallery snapshot at {snapshot}. Run 'flask export-gallery' first.")
+    count = compact_snapshot(snapshot)
+    touch_gallery_version()
+    click.echo(f"Compacted {snapshot} ({count} face encodings).")
+
+
+@app.cli.command('recognize-streams')
+@click.argument('sources', nargs=-1, required=True)
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True, help='顔認証を行うプロセス数')
+@click.option('--max-in-flight', type=int, default=2, show_default=True,
+              help='入力元ごとに同時に処理するフレーム数の上限')
+@click.option('--report-interval', type=float, default=10.0, show_default=True, help='処理速度を表示する間隔（秒）')
+def recognize_streams(sources, workers, max_in_flight, report_interval):
+    """複数のカメラ・動画ファイルで同時に顔認証を行い、認識したユーザーを表示する。
+
+    SOURCES にはカメラ番号、動画ファイル、画像ディレクトリ、ストリームのURLを指定する。
+    Ctrl+C で停止する。
+    """
+    gallery = get_face_gallery()
+    click.echo(f"Loaded {len(gallery)} face encodings. Starting {workers} workers for {len(sources)} streams.")
+    # 入力元ごとに、映っているユーザーが変わったときだけ表示する
+    last_names = {}
+
+    def on_result(stream_name, frame_index, faces):
+        names = sorted({name for _, _, name, _ in faces if name is not None})
+        if names != last_names.get(stream_name, []):
+            last_names[stream_name] = names
+            click.echo(f"[{stream_name}] frame {frame_index}: {', '.join(names) if names else '-'}")
+
+    def report(stats):
+        click.echo(f"{stats['frames_processed']} frames, {stats['fps']:.1f} fps total")
+        for stream in stats['streams']:
+            click.echo(f"  {stream['name']}: {stream['fps']:.1f} fps, {stream['frames_dropped']} dropped, "
+                       f"{stream['latency_seconds_mean'] * 1000:.0f} ms latency, {stream['errors']} errors, "
+                       f"{stream['stalls']} stalls, {stream['reconnects']} reconnects")
+
+    server = StreamRecognitionServer(gallery, sources, workers=workers, max_in_flight=max_in_flight,
+                                     on_result=on_result)
+    report(server.run(report_interval=report_interval, report=report))
+
+
+@app.cli.command('verify-images')
+@click.argument('sources', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--workers', type=int, default=None, help='デコード・検出・エンコードを行うワーカー数（省略時は BATCH_VERIFY_WORKERS）')
+@click.option('--executor', type=click.Choice(['process', 'thread']), default=None,
+              help='ワーカーの種類（省略時は BATCH_VERIFY_EXECUTOR）')
+@click.option('--max-in-flight', type=int, default=None, help='同時に処理中にする画像の数の上限（省略時はワーカー数の2倍）')
+@click.option('-k', type=int, default=1, show_default=True, help='顔ごとに出力する候補の数')
+@click.option('--threshold', type=float, default=FACE_MATCH_THRESHOLD, show_default=True, help='一致とみなす距離の閾値')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='NDJSON の出力先（省略時は標準出力）')
+def verify_images_command(sources, workers, executor, max_in_flight, k, threshold, output):
+    """画像ファイル・ディレクトリの画像を登録済みユーザーと照合し、結果を NDJSON で出力する。
+
+    結果は画像の処理が終わった順に1行ずつ出力する。集計は標準エラー出力に表示する。
+    """
+    gallery = get_face_gallery()
+    images = list_images(sources)
+    workers = workers or BATCH_VERIFY_WORKERS
+    click.echo(f"Verifying {len(images)} images against {len(gallery)} face encodings with {workers} workers.", err=True)
+    start = time.monotonic()
+    counts = {'matched': 0, 'unmatched': 0, 'no_face': 0, 'low_quality': 0, 'error': 0}
+    with create_executor(workers, executor) as pool:
+        for result in verify_images(images, gallery, pool, max_in_flight=max_in_flight or 2 * workers,
+                                    k=k, threshold=threshold):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            counts[result['outcome']] += 1
+    elapsed = time.monotonic() - start
+    click.echo(f"{len(images)} images in {elapsed:.1f}s ({len(images) / elapsed if elapsed > 0 else 0.0:.1f} images/s): "
+               f"{counts['matched']} matched, {counts['unmatched']} unmatched, {counts['no_face']} without faces, "
+               f"{counts['low_quality']} low quality, "
+               f"{counts['error']} errors.", err=True)
+
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+    debug = True
+    # リクエストを受け付ける前にモデルを読み込み、ダミーのフレームを1回処理しておく（リローダーの子プロセスだけ）
+    if should_warm_up(debug):
+        warm_up()
+    app.run(debug=debug)
\ No newline at end of file
@@ -0,0 +1,171 @@
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import cv2
+import numpy as np
+from face_gallery import FACE_MATCH_THRESHOLD
+from face_quality import count_rejections, partition_face_locations
+from face_recognition_utils import detect_faces, identify_encodings
+from frame_source import IMAGE_EXTENSIONS
+from metrics import Counter, FACES_DETECTED
+from model_loader import face_recognition
+
+# 一括照合の設定（環境変数で変更できる）
+# 'process': プロセスプール（CPU のコア数に比例して速くなる）、'thread': スレッドプール（起動が速く、メモリを共有する）
+EXECUTOR = os.environ.get('BATCH_VERIFY_EXECUTOR', 'process')
+# 画像のデコード・検出・エンコードを行うワーカー数
+WORKERS = int(os.environ.get('BATCH_VERIFY_WORKERS', str(os.cpu_count() or 1)))
+# 同時に処理中にする画像の数の上限（メモリに置く画像の数の上限になる）。省略時はワーカー数の2倍
+MAX_IN_FLIGHT = int(os.environ.get('BATCH_VERIFY_MAX_IN_FLIGHT', '0')) or None
+
+# 顔が見つからなかった画像のエラーメッセージ
+NO_FACE = 'No face found'
+# 見つかった顔がすべて品質の判定で除外された画像のエラーメッセージ
+LOW_QUALITY = 'No face passed the quality check'
+
+BATCH_IMAGES = Counter(
+    'face_login_batch_images_total', 'Images processed by batch verification.', ['outcome'])
+
+
+def _init_worker():
+    # Ctrl+C は親プロセスで受ける。最初の画像を待たせないよう、dlib のモデルはワーカーの起動時に読み込む
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    face_recognition()
+
+
+def encode_image(name, image):
+    """
+    1枚の画像をデコードし、写っているすべての顔を検出・エンコードする（プールのワーカーで実行する）。
+
+    品質の判定（face_quality）を通らない顔はエンコードしない。エンコードは1枚の画像の残りのすべての顔について
+    face_encodings を1回だけ呼ぶ。ワーカーのプロセスで記録した計測値は親プロセスの /metrics に届かないため、
+    検出した顔の数と除外した理由は結果として返し、親プロセスで記録する。
+
+    Args:
+        name (str): 結果に付ける画像の名前。
+        image (str or bytes): 画像ファイルのパス、または JPEG などの画像データ。
+
+    Returns:
+        dict: {'name', 'locations', 'encodings', 'error', 'seconds', 'detected', 'rejections'}。
+            encodings は M×128 の float32 の行列。顔が見つからない場合、すべて除外された場合、読み込めない場合は
+            None になり、error にエラーメッセージが入る。
+    """
+    start = time.perf_counter()
+    result = {'name': name, 'locations': [], 'encodings': None, 'error': None, 'detected': 0, 'rejections': []}
+    try:
+        if isinstance(image, str):
+            frame = cv2.imread(image, cv2.IMREAD_COLOR)
+        else:
+            frame = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            result['error'] = 'Could not decode image'
+        else:
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_locations = detect_faces(rgb_frame)
+            result['detected'] = len(face_locations)
+            face_locations, result['rejections'] = partition_face_locations(rgb_frame, face_locations)
+            if not result['detected']:
+                result['error'] = NO_FACE
+            elif not face_locations:
+                result['error'] = LOW_QUALITY
+            else:
+                result['locations'] = [list(location) for location in face_locations]
+                result['encodings'] = np.asarray(face_recognition().face_encodings(rgb_frame, face_locations),
+                                                 dtype=np.float32)
+    except Exception as e:
+        result['error'] = f"Error processing image: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def list_images(sources):
+    """
+    画像ファイルとディレクトリ（直下の画像ファイル）の一覧から、(名前, パス) のリストを作る。
+    """
+    images = []
+    for source in sources:
+        if os.path.isdir(source):
+            for filename in sorted(os.listdir(source)):
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                    images.append((os.path.join(source, filename), os.path.join(source, filename)))
+        else:
+            images.append((source, source))
+    return images
+
+
+def create_executor(workers=None, executor=None):
+    """
+    verify_images() で使うプールを作る。リクエストごとに作り直さずに使い回す場合に使う。
+
+    Args:
+        workers (int): ワーカー数（省略時は BATCH_VERIFY_WORKERS）。
+        executor (str): 'process' または 'thread'（省略時は BATCH_VERIFY_EXECUTOR）。
+    """
+    workers = workers or WORKERS
+    executor = executor or EXECUTOR
+    if executor == 'process':
+        return ProcessPoolExecutor(workers, initializer=_init_worker)
+    if executor == 'thread':
+        return ThreadPoolExecutor(workers, thread_name_prefix='batch-verify')
+    raise ValueError(f"Unknown executor: {executor}")
+
+
+def verify_images(images, gallery, pool, max_in_flight=None, k=1, threshold=FACE_MATCH_THRESHOLD):
+    """
+    多数の画像を登録済みユーザーと照合し、画像ごとの結果を処理が終わった順に返すジェネレーター。
+
+    デコード・検出・エンコードはプールのワーカーで行い、照合は終わった画像ごとに
+    identify_encodings() で写っているすべての顔をまとめて行う。処理中の画像は max_in_flight 枚までにするため、
+    画像の一覧がどれだけ長くても、メモリに置く画像（と画像データ）はその枚数分だけになる。
+
+    Args:
+        images (iterable): (名前, 画像ファイルのパスまたは画像データ) の列。必要になったときに1つずつ読む。
+        gallery (FaceGallery): 登録済みユーザーの顔特徴量を保持したギャラリー。
+        pool (Executor): create_executor() で作ったプール。
+        max_in_flight (int): 同時に処理中にする画像の数の上限（省略時は BATCH_VERIFY_MAX_IN_FLIGHT、
+            未設定なら BATCH_VERIFY_WORKERS の2倍）。
+        k (int): 顔ごとに返す候補の数。
+        threshold (float): 一致とみなす距離の閾値。
+
+    Yields:
+        dict: {'image', 'outcome', 'faces', 'error', 'seconds'}。outcome は 'matched'（一致した顔がある）、
+            'unmatched'、'no_face'、'low_quality'（見つかった顔がすべて品質の判定で除外された）、'error' のいずれか。
+            faces は identify_encodings() の結果に 'location' を加えたもの。
+    """
+    max_in_flight = max_in_flight or MAX_IN_FLIGHT or 2 * WORKERS
+    images = iter(images)
+    in_flight = set()
+    exhausted = False
+    try:
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                item = next(images, None)
+                if item is None:
+                    exhausted = True
+                    break
+                in_flight.add(pool.submit(encode_image, *item))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                encoded = future.result()
+                FACES_DETECTED.inc(encoded['detected'], pipeline='batch')
+                count_rejections(encoded['rejections'], 'batch')
+                faces = []
+                if encoded['encodings'] is not None:
+                    faces = identify_encodings(encoded['encodings'], gallery, k=k, threshold=threshold)
+                    for location, face in zip(encoded['locations'], faces):
+                        face['location'] = location
+                error = encoded['error']
+                if error:
+                    outcome = {NO_FACE: 'no_face', LOW_QUALITY: 'low_quality'}.get(error, 'error')
+                else:
+                    outcome = 'matched' if any(face['match'] for face in faces) else 'unmatched'
+                BATCH_IMAGES.inc(outcome=outcome)
+                yield {'image': encoded['name'], 'outcome': outcome, 'faces': faces, 'error': error,
+                       'seconds': encoded['seconds']}
+    finally:
+        # 途中で止められた場合（クライアントの切断など）は、まだ始まっていない画像を取り消す
+        for future in in_flight:
+            future.cancel()
@@ -0,0 +1,92 @@
+"""
+顔検出の縮小倍率ごとの処理速度（fps）と検出率を計測するベンチマーク。
+
+録画した動画ファイルか画像ディレクトリを入力にするため、カメラは不要。
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_detection.py --video recorded.mp4 --scales 1.0 0.5 0.25
+    python benchmarks/bench_detection.py --images frames/ --model hog --upsample 0 1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from face_recognition_utils import detect_faces  # noqa: E402
+from frame_source import VideoFileSource, ImageDirectorySource  # noqa: E402
+
+
+def load_frames(video=None, images=None, max_frames=300):
+    """
+    動画ファイルまたは画像ディレクトリから RGB 形式のフレームを読み込む。
+    """
+    frames = []
+    with (VideoFileSource(video) if video else ImageDirectorySource(images)) as source:
+        while len(frames) < max_frames:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frames.append(np.ascontiguousarray(frame[:, :, ::-1]))
+    return frames
+
+
+def run(frames, scale, upsample, model):
+    latencies = []
+    detected = 0
+    for rgb_frame in frames:
+        start = time.perf_counter()
+        face_locations = detect_faces(rgb_frame, scale=scale, number_of_times_to_upsample=upsample, model=model)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        if face_locations:
+            detected += 1
+    latencies = np.array(latencies)
+    return {
+        'scale': scale,
+        'upsample': upsample,
+        'model': model,
+        'fps': 1000.0 / latencies.mean(),
+        'detection_rate': detected / len(frames),
+        'mean_ms': float(latencies.mean()),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video', help='録画した動画ファイル')
+    source.add_argument('--images', help='画像ファイルが入ったディレクトリ')
+    parser.add_argument('--frames', type=int, default=300, help='計測に使う最大フレーム数')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5, 0.25])
+    parser.add_argument('--upsample', type=int, nargs='+', default=[1])
+    parser.add_argument('--model', default='hog', choices=['hog', 'cnn'])
+    parser.add_argument('--json', help='結果を書き出す JSON ファイル')
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.images, args.frames)
+    if not frames:
+        sys.exit('No frames could be read from the input.')
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames at {width}x{height}")
+
+    report = []
+    print(f"{'scale':>6}{'upsample':>10}{'fps':>10}{'detected':>10}{'mean ms':>10}{'p95 ms':>10}")
+    for scale in args.scales:
+        for upsample in args.upsample:
+            row = run(frames, scale, upsample, args.model)
+            report.append(row)
+            print(f"{scale:>6.2f}{upsample:>10d}{row['fps']:>10.1f}{row['detection_rate']:>10.3f}"
+                  f"{row['mean_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+顔特徴量インデックスの再現率と照合時間を総当たり探索と比較するベンチマーク。
+
+実際の顔特徴量の代わりに、人物ごとの中心ベクトルにノイズを加えた合成データを使う。
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_index.py --size 100000 --queries 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from face_gallery import FaceGallery, ENCODING_DIM, FACE_MATCH_THRESHOLD  # noqa: E402
+from face_index import IVFIndex  # noqa: E402
+
+
+def make_dataset(size, queries, groups, seed):
+    """
+    合成の登録データと照合用データを作る。
+
+    照合用データの半分は登録済みの人物にノイズを加えたもの、残りは未登録の人物。
+    """
+    rng = np.random.default_rng(seed)
+    group_centers = rng.normal(0.0, 0.08, (groups, ENCODING_DIM))
+    group_of = rng.integers(0, groups, size)
+    gallery = (group_centers[group_of] + rng.normal(0.0, 0.06, (size, ENCODING_DIM))).astype(np.float32)
+
+    known = queries // 2
+    known_ids = rng.integers(0, size, known)
+    known_probes = gallery[known_ids] + rng.normal(0.0, 0.02, (known, ENCODING_DIM))
+    unknown_groups = rng.integers(0, groups, queries - known)
+    unknown_probes = group_centers[unknown_groups] + rng.normal(0.0, 0.06, (queries - known, ENCODING_DIM))
+    probes = np.vstack([known_probes, unknown_probes]).astype(np.float32)
+    return gallery, probes
+
+
+def time_queries(index, probes, **kwargs):
+    results = []
+    latencies = []
+    for probe in probes:
+        start = time.perf_counter()
+        results.append(index.match(probe, FACE_MATCH_THRESHOLD, **kwargs))
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return results, np.array(latencies)
+
+
+def summarize(name, results, latencies, baseline):
+    # 総当たりで最近傍が一致した件数（再現率）と、閾値判定の結果が一致した件数を数える
+    nearest_hits = sum(1 for r, b in zip(results, baseline) if r[2] is not None and abs(r[2] - b[2]) < 1e-5)
+    decision_hits = sum(1 for r, b in zip(results, baseline) if r[0] == b[0])
+    return {
+        'name': name,
+        'recall_at_1': nearest_hits / len(baseline),
+        'decision_agreement': decision_hits / len(baseline),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='登録人数')
+    parser.add_argument('--queries', type=int, default=500, help='照合回数')
+    parser.add_argument('--groups', type=int, default=256, help='合成データの人物グループ数')
+    parser.add_argument('--nlist', type=int, default=None, help='IVF のクラスタ数（省略時は sqrt(size)）')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32], help='IVF で探索するクラスタ数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='結果を書き出す JSON ファイル')
+    args = parser.parse_args()
+
+    gallery_vectors, probes = make_dataset(args.size, args.queries, args.groups, args.seed)
+    rows = [(i, f'user{i}', vector) for i, vector in enumerate(gallery_vectors)]
+
+    start = time.perf_counter()
+    brute = FaceGallery()
+    brute.load(rows)
+    brute_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist, min_train_size=1)
+    ivf.load(rows)
+    ivf_build = time.perf_counter() - start
+    print(f"build: brute={brute_build:.2f}s ivf={ivf_build:.2f}s (nlist={len(ivf._lists)})")
+
+    baseline, latencies = time_queries(brute, probes)
+    report = [summarize('brute', baseline, latencies, baseline)]
+    for nprobe in args.nprobe:
+        results, latencies = time_queries(ivf, probes, nprobe=nprobe)
+        report.append(summarize(f'ivf nprobe={nprobe}', results, latencies, baseline))
+
+    # 追加・削除のコスト
+    extra = gallery_vectors[:100] + 0.01
+    start = time.perf_counter()
+    for i, vector in enumerate(extra):
+        ivf.upsert(args.size + i, f'extra{i}', vector)
+    insert_ms = (time.perf_counter() - start) * 1000.0 / len(extra)
+    start = time.perf_counter()
+    for i in range(len(extra)):
+        ivf.remove(args.size + i)
+    delete_ms = (time.perf_counter() - start) * 1000.0 / len(extra)
+
+    print(f"{'index':<16}{'recall@1':>10}{'decision':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in report:
+        print(f"{row['name']:<16}{row['recall_at_1']:>10.3f}{row['decision_agreement']:>10.3f}"
+              f"{row['mean_ms']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+    print(f"ivf insert: {insert_ms:.3f} ms/op, delete: {delete_ms:.3f} ms/op")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': report,
+                       'ivf_insert_ms': insert_ms, 'ivf_delete_ms': delete_ms}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+目線認証のランドマーク処理1フレーム分の時間を、ランドマークを毎回ループで読む従来の方法と
+(478, 3) の配列に1回だけ変換する方法とで比較するマイクロベンチマーク。
+
+FaceMesh の推論は含めず、その後のランドマーク処理（EAR、虹彩の外接円、目線方向、描画）だけを計測する。
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_landmarks.py --iterations 2000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gaze_recognition_utils as gaze  # noqa: E402
+
+
+def make_landmarks(seed=0):
+    rng = np.random.default_rng(seed)
+    face_landmarks = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z in rng.uniform(0.2, 0.8, (478, 3)):
+        face_landmarks.landmark.add(x=x, y=y, z=z)
+    return face_landmarks
+
+
+def legacy_points(landmarks, image_width, image_height):
+    landmark_point = []
+    for landmark in landmarks.landmark:
+        landmark_x = min(int(landmark.x * image_width), image_width - 1)
+        landmark_y = min(int(landmark.y * image_height), image_height - 1)
+        landmark_point.append((landmark_x, landmark_y))
+    return landmark_point
+
+
+def legacy_eye_ratio(face_landmarks, eye_landmarks):
+    eye_points = np.array([[face_landmarks.landmark[i].x, face_landmarks.landmark[i].y] for i in eye_landmarks])
+    A = np.linalg.norm(eye_points[1] - eye_points[5])
+    B = np.linalg.norm(eye_points[2] - eye_points[4])
+    C = np.linalg.norm(eye_points[0] - eye_points[3])
+    return (A + B) / (2.0 * C)
+
+
+def legacy_direction(eye_start, eye_end, iris_center):
+    eye_width = np.abs(eye_end[0] - eye_start[0])
+    if eye_width < 1:
+        return 'center'
+    relative_position = (iris_center[0] - eye_start[0]) / eye_width
+    if relative_position < 0.4:
+        return 'left'
+    elif relative_position > 0.6:
+        return 'right'
+    return 'center'
+
+
+def legacy_frame(face_landmarks, image):
+    """変更前の処理: ランドマークを3回ループで変換し、EAR の計算でもう一度読む。"""
+    image_height, image_width = image.shape[:2]
+    legacy_points(face_landmarks, image_width, image_height)  # draw_eye_lines
+    left_ratio = legacy_eye_ratio(face_landmarks, gaze.EYE_RATIO_LANDMARKS[0])
+    right_ratio = legacy_eye_ratio(face_landmarks, gaze.EYE_RATIO_LANDMARKS[1])
+    landmark_point = legacy_points(face_landmarks, image_width, image_height)  # calc_iris_min_enc_losingCircle
+    left_eye = gaze.calc_min_enc_losingCircle([landmark_point[i] for i in range(468, 473)])
+    right_eye = gaze.calc_min_enc_losingCircle([landmark_point[i] for i in range(473, 478)])
+    landmark_point = legacy_points(face_landmarks, image_width, image_height)  # draw_landmarks
+    left_direction = legacy_direction(landmark_point[130], landmark_point[244], left_eye[0])
+    right_direction = legacy_direction(landmark_point[463], landmark_point[359], right_eye[0])
+    return (left_ratio, right_ratio), (left_eye, right_eye), (left_direction, right_direction)
+
+
+def array_frame(face_landmarks, image):
+    """変更後の処理: 配列に1回だけ変換し、両目をまとめて計算する。"""
+    image_height, image_width = image.shape[:2]
+    landmark_array = gaze.landmarks_to_array(face_landmarks)
+    landmark_point = gaze.to_pixel_points(landmark_array, image_width, image_height)
+    ratios = gaze.calculate_eye_ratios(landmark_array)
+    left_eye, right_eye = gaze.calc_iris_min_enc_losingCircle(landmark_point)
+    directions = gaze.get_eye_directions(
+        landmark_point[gaze.EYE_START_LANDMARKS],
+        landmark_point[gaze.EYE_END_LANDMARKS],
+        np.array([left_eye[0], right_eye[0]]),
+    )
+    return tuple(ratios), (left_eye, right_eye), tuple(directions)
+
+
+def measure(func, face_landmarks, image, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(face_landmarks, image)
+    return (time.perf_counter() - start) * 1e6 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    args = parser.parse_args()
+
+    face_landmarks = make_landmarks()
+    image = np.zeros((args.height, args.width, 3), dtype=np.uint8)
+
+    # 両方の方法で同じ結果になることを確認する
+    legacy = legacy_frame(face_landmarks, image)
+    vectorized = array_frame(face_landmarks, image)
+    assert np.allclose(legacy[0], vectorized[0], rtol=1e-4), (legacy[0], vectorized[0])
+    assert legacy[1] == vectorized[1], (legacy[1], vectorized[1])
+    assert legacy[2] == vectorized[2], (legacy[2], vectorized[2])
+
+    legacy_us = measure(legacy_frame, face_landmarks, image, args.iterations)
+    array_us = measure(array_frame, face_landmarks, image, args.iterations)
+    print(f"legacy loops : {legacy_us:8.1f} us/frame")
+    print(f"landmark array: {array_us:8.1f} us/frame")
+    print(f"saved        : {legacy_us - array_us:8.1f} us/frame ({legacy_us / array_us:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
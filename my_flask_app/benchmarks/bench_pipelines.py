@@ -0,0 +1,232 @@
+"""
+録画した動画や画像の連番を顔認証・目線認証の処理に流し、段階ごとの処理時間を計測するベンチマーク。
+
+カメラは使わないため、GPU やカメラのない CPU だけのマシンでも実行できる。
+
+計測するパイプライン:
+    face_loop   face-recognition.py のループと同じ処理（検出した全員をエンコードして照合）
+    face_login  LoginSession の顔認証の1フレーム分の処理（recognize_face_in_frame）
+    gaze        LoginSession の目線認証の1フレーム分の処理（FaceMesh、EAR・目線方向、パターン照合）
+    gaze_roi    gaze と同じ処理を ROI モードで行う（前のフレームで見つかった顔の周りだけを FaceMesh に渡す）
+
+段階ごとの平均・p50・p95・p99 と fps を表示し、--json で結果を書き出す。
+--compare に以前の結果を渡すと、コミット間の差分を表示する。
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_pipelines.py --video fixtures/login.mp4 --json results/$(git rev-parse --short HEAD).json
+    python benchmarks/bench_pipelines.py --images fixtures/frames --pipelines gaze --compare results/base.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from frame_source import VideoFileSource, ImageDirectorySource  # noqa: E402
+from stage_timer import StageTimings  # noqa: E402
+
+PIPELINES = ('face_loop', 'face_login', 'gaze', 'gaze_roi')
+
+
+def iter_frames(video=None, images=None, max_frames=None):
+    """
+    動画ファイルまたは画像ディレクトリから BGR 形式のフレームを1枚ずつ読み込む（フレームは捨てない）。
+
+    Yields:
+        tuple: (frame, デコードにかかった秒数)
+    """
+    count = 0
+    with (VideoFileSource(video) if video else ImageDirectorySource(images)) as source:
+        while max_frames is None or count < max_frames:
+            start = time.perf_counter()
+            ret, frame = source.read()
+            decode = time.perf_counter() - start
+            if not ret:
+                break
+            count += 1
+            yield frame, decode
+
+
+def build_gallery(gallery_dir, gallery_size, seed=0):
+    """
+    照合に使うギャラリーを作る。gallery_dir があればその顔写真を登録し、なければ合成データを使う。
+    """
+    from face_gallery import FaceGallery, ENCODING_DIM
+
+    gallery = FaceGallery()
+    if gallery_dir:
+        from face_recognition_utils import compute_face_encoding
+
+        rows = []
+        for i, filename in enumerate(sorted(os.listdir(gallery_dir))):
+            encoding = compute_face_encoding(os.path.join(gallery_dir, filename))
+            if encoding is not None:
+                rows.append((i, os.path.splitext(filename)[0], encoding))
+        gallery.load(rows)
+    else:
+        rng = np.random.default_rng(seed)
+        vectors = rng.normal(0.0, 0.09, (gallery_size, ENCODING_DIM))
+        gallery.load((i, f'user{i}', vector) for i, vector in enumerate(vectors))
+    return gallery
+
+
+def make_face_loop(gallery):
+    import face_recognition
+    from face_gallery import FACE_MATCH_THRESHOLD
+    from face_recognition_utils import detect_faces
+
+    def step(frame, timings):
+        with timings.stage('bgr_to_rgb'):
+            rgb_frame = np.ascontiguousarray(frame[:, :, ::-1])
+        with timings.stage('detect'):
+            face_locations = detect_faces(rgb_frame)
+        if not face_locations:
+            return
+        with timings.stage('encode'):
+            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        with timings.stage('match'):
+            for face_encoding in face_encodings:
+                gallery.match(face_encoding, FACE_MATCH_THRESHOLD)
+    return step
+
+
+def make_face_login(gallery):
+    from face_recognition_utils import recognize_face_in_frame
+
+    def step(frame, timings):
+        recognize_face_in_frame(frame, gallery, timings=timings)
+    return step
+
+
+def make_gaze(roi=False):
+    from gaze_recognition_utils import create_face_mesh, process_gaze_frame, GazeSequenceMatcher
+
+    face_mesh = create_face_mesh()
+    state = {'eye_open': True, 'face_box': None}
+    # 実際のパターンとは関係なく、毎フレームパターン照合まで行う（時間切れにならないよう制限時間は長くする）
+    matcher = GazeSequenceMatcher(['left', 'right', 'center', 'blink'], timeout=1e9)
+
+    def step(frame, timings):
+        eye_direction, state['eye_open'], overlay = process_gaze_frame(
+            frame, state['eye_open'], face_mesh, timings, face_box=state['face_box'])
+        if roi:
+            state['face_box'] = overlay.get('face_box')
+        with timings.stage('sequence'):
+            matcher.update(eye_direction)
+    return step
+
+
+def summarize(samples):
+    samples = np.array(samples) * 1000.0
+    return {
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+    }
+
+
+def run_pipeline(step, frames_args):
+    """
+    フレームを1枚ずつ読み込んで step に渡し、段階ごとの処理時間を集計する。
+    """
+    stages = {'decode': []}
+    totals = []
+    for frame, decode in iter_frames(**frames_args):
+        timings = StageTimings()
+        start = time.perf_counter()
+        step(frame, timings)
+        total = decode + time.perf_counter() - start
+        stages['decode'].append(decode)
+        for name, duration in timings.durations.items():
+            stages.setdefault(name, []).append(duration)
+        totals.append(total)
+    if not totals:
+        sys.exit('No frames could be read from the input.')
+    return {
+        'frames': len(totals),
+        'fps': len(totals) / sum(totals),
+        # 検出されなかったフレームでは実行されない段階があるため、段階ごとの回数も記録する
+        'stages': {name: dict(summarize(values), count=len(values)) for name, values in stages.items()},
+        'total': summarize(totals),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(name, result, baseline=None):
+    print(f"\n[{name}] {result['frames']} frames, {result['fps']:.1f} fps")
+    print(f"  {'stage':<14}{'count':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(result['stages'].items()) + [('total', dict(result['total'], count=result['frames']))]
+    for stage, stats in rows:
+        line = (f"  {stage:<14}{stats['count']:>7}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+                f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+        if baseline:
+            previous = baseline['total'] if stage == 'total' else baseline['stages'].get(stage)
+            if previous:
+                line += f"   p50 {stats['p50_ms'] - previous['p50_ms']:+.2f} ms"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video', help='録画した動画ファイル')
+    source.add_argument('--images', help='連番の画像ファイルが入ったディレクトリ')
+    parser.add_argument('--frames', type=int, default=None, help='計測に使う最大フレーム数')
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument('--gallery-dir', help='照合に使う顔写真のディレクトリ（省略時は合成データ）')
+    parser.add_argument('--gallery-size', type=int, default=1000, help='合成データの登録人数')
+    parser.add_argument('--json', help='結果を書き出す JSON ファイル')
+    parser.add_argument('--compare', help='比較する以前の結果の JSON ファイル')
+    args = parser.parse_args()
+
+    frames_args = {'video': args.video, 'images': args.images, 'max_frames': args.frames}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Comparing against {args.compare} (commit {baseline.get('commit')})")
+
+    gallery = None
+    if {'face_loop', 'face_login'} & set(args.pipelines):
+        gallery = build_gallery(args.gallery_dir, args.gallery_size)
+
+    results = {}
+    for name in args.pipelines:
+        if name == 'face_loop':
+            step = make_face_loop(gallery)
+        elif name == 'face_login':
+            step = make_face_login(gallery)
+        else:
+            step = make_gaze(roi=name == 'gaze_roi')
+        results[name] = run_pipeline(step, frames_args)
+        print_report(name, results[name], baseline and baseline['pipelines'].get(name))
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'args': vars(args),
+                'pipelines': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
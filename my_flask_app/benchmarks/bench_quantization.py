@@ -0,0 +1,126 @@
+"""
+量子化したギャラリー（QuantizedGallery）のメモリ使用量・照合時間・判定結果を、
+face_recognition.face_distance による厳密な照合（float64）と比較するベンチマーク。
+
+実際の顔特徴量の代わりに、bench_index.py と同じ合成データを使う。
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_quantization.py --size 100000 --queries 500 --rerank-k 8 32 128
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_index import make_dataset  # noqa: E402
+from face_gallery import FaceGallery, FACE_MATCH_THRESHOLD  # noqa: E402
+from face_index import QuantizedGallery  # noqa: E402
+from model_loader import face_recognition  # noqa: E402
+
+
+def exact_matches(gallery_vectors, probes):
+    """
+    現在の照合と同じく face_distance（float64）で全員との距離を求め、閾値で判定する。
+    """
+    known = gallery_vectors.astype(np.float64)
+    results, latencies = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        dists = face_recognition().face_distance(known, probe.astype(np.float64))
+        index = int(np.argmin(dists))
+        results.append((index if dists[index] < FACE_MATCH_THRESHOLD else None, float(dists[index])))
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return results, np.array(latencies), known.nbytes
+
+
+def gallery_matches(gallery, probes, **kwargs):
+    results, latencies = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        user_id, _, distance = gallery.match(probe, FACE_MATCH_THRESHOLD, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        results.append((user_id, distance))
+    return results, np.array(latencies)
+
+
+def scan_latency(gallery, probes):
+    # 1段階目（量子化した行列での近似距離）だけの時間
+    latencies = []
+    for probe in probes:
+        start = time.perf_counter()
+        gallery.approximate_distances(probe)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return np.array(latencies)
+
+
+def summarize(name, results, latencies, baseline, scan_bytes, resident_bytes, scan=None):
+    decision_changes = sum(1 for r, b in zip(results, baseline) if r[0] != b[0])
+    # 判定に使う距離の誤差（float64 の face_distance との差の最大）
+    max_error = max(abs(r[1] - b[1]) for r, b in zip(results, baseline))
+    row = {
+        'name': name,
+        'scan_mb': scan_bytes / 1e6,
+        'resident_mb': resident_bytes / 1e6,
+        'decision_changes': decision_changes,
+        'max_distance_error': float(max_error),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+    if scan is not None:
+        row['scan_p50_ms'] = float(np.percentile(scan, 50))
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='登録人数')
+    parser.add_argument('--queries', type=int, default=500, help='照合回数')
+    parser.add_argument('--groups', type=int, default=256, help='合成データの人物グループ数')
+    parser.add_argument('--rerank-k', type=int, nargs='+', default=[8, 32, 128], help='厳密な距離で並べ直す候補の数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='結果を書き出す JSON ファイル')
+    args = parser.parse_args()
+
+    gallery_vectors, probes = make_dataset(args.size, args.queries, args.groups, args.seed)
+    rows = [(i, f'user{i}', vector) for i, vector in enumerate(gallery_vectors)]
+
+    baseline, latencies, baseline_bytes = exact_matches(gallery_vectors, probes)
+    report = [summarize('face_distance', baseline, latencies, baseline, baseline_bytes, baseline_bytes)]
+
+    brute = FaceGallery()
+    brute.load(rows)
+    results, latencies = gallery_matches(brute, probes)
+    report.append(summarize('brute float32', results, latencies, baseline,
+                            brute.encodings.nbytes, brute.encodings.nbytes))
+
+    for dtype in ('int8', 'float16'):
+        gallery = QuantizedGallery(dtype=dtype)
+        gallery.load(rows)
+        scan = scan_latency(gallery, probes)
+        # 常駐するのは量子化した行列と float32 の行列（スナップショットの memmap では float32 は候補の行だけ読む）
+        resident = gallery.codes.nbytes + gallery.encodings.nbytes
+        for rerank_k in args.rerank_k:
+            results, latencies = gallery_matches(gallery, probes, rerank_k=rerank_k)
+            report.append(summarize(f'{dtype} k={rerank_k}', results, latencies, baseline,
+                                    gallery.codes.nbytes, resident, scan))
+
+    print(f"{'gallery':<16}{'scan MB':>9}{'total MB':>10}{'changed':>9}{'max err':>10}"
+          f"{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}")
+    for row in report:
+        print(f"{row['name']:<16}{row['scan_mb']:>9.1f}{row['resident_mb']:>10.1f}{row['decision_changes']:>9d}"
+              f"{row['max_distance_error']:>10.2e}{row['mean_ms']:>9.3f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+ワーカーの起動にかかる時間を計測するベンチマーク。
+
+計測ごとに新しい Python プロセスを起動し、以下の時間を計測する。
+
+    import_app         app.py の import（モデルは読み込まない）
+    load_face          face_recognition（dlib のモデル）の読み込み
+    load_mediapipe     mediapipe の読み込み
+    warm_up            model_loader.warm_up()（ダミーのフレームを検出・エンコード・FaceMesh に通す）
+    first_frame_cold   ウォームアップせずに最初のフレームを顔認証・目線認証に通す時間
+    first_frame_warm   ウォームアップ後に最初のフレームを顔認証・目線認証に通す時間
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_startup.py --runs 5 --json results/startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# 子プロセスで実行するコード。計測結果を JSON で標準出力の最後の行に書き出す
+CHILD = r'''
+import json, sys, time
+import numpy as np
+warm = sys.argv[1] == 'warm'
+results = {}
+start = time.perf_counter()
+import app
+results['import_app'] = time.perf_counter() - start
+import model_loader
+start = time.perf_counter()
+model_loader.face_recognition()
+results['load_face'] = time.perf_counter() - start
+start = time.perf_counter()
+model_loader.mediapipe_face_mesh()
+results['load_mediapipe'] = time.perf_counter() - start
+if warm:
+    results['warm_up'] = model_loader.warm_up()
+from face_gallery import FaceGallery
+from face_recognition_utils import recognize_face_in_frame
+from gaze_recognition_utils import face_mesh_pool, process_gaze_frame
+frame = np.zeros((480, 640, 3), dtype=np.uint8)
+gallery = FaceGallery()
+gallery.load([(1, 'user', np.zeros(128))])
+start = time.perf_counter()
+recognize_face_in_frame(frame, gallery)
+with face_mesh_pool.checkout() as face_mesh:
+    process_gaze_frame(frame, True, face_mesh)
+results['first_frame_warm' if warm else 'first_frame_cold'] = time.perf_counter() - start
+print(json.dumps(results))
+'''
+
+
+def run_child(mode):
+    output = subprocess.check_output([sys.executable, '-c', CHILD, mode], cwd=APP_DIR, text=True,
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='計測の回数（それぞれ新しいプロセスで行う）')
+    parser.add_argument('--json', help='結果を書き出す JSON ファイル')
+    args = parser.parse_args()
+
+    samples = {}
+    for _ in range(args.runs):
+        for mode in ('cold', 'warm'):
+            for name, seconds in run_child(mode).items():
+                samples.setdefault(name, []).append(seconds)
+
+    results = {}
+    print(f"  {'phase':<18}{'p50 ms':>10}{'max ms':>10}")
+    for name, values in samples.items():
+        values = np.array(values) * 1000.0
+        results[name] = {'p50_ms': float(np.percentile(values, 50)), 'max_ms': float(values.max()),
+                         'runs': len(values)}
+        print(f"  {name:<18}{results[name]['p50_ms']:>10.1f}{results[name]['max_ms']:>10.1f}")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+recognize-streams（StreamRecognitionServer）のワーカー数ごとの処理速度を計測するベンチマーク。
+
+同じ動画ファイルか画像ディレクトリを --streams 個の入力元として同時に流し、ワーカー数を変えながら
+全体の fps、1ワーカーのときからの速度の倍率、ワーカー1つあたりの効率（倍率 / ワーカー数）を表示する。
+フレームを捨てない入力元を使うため、どのワーカー数でも同じフレームを処理する。
+fps にはワーカーの起動（dlib のモデルの読み込み）の時間も含まれるため、フレーム数の多い入力を使う。
+
+実行例:
+    cd my_flask_app
+    python benchmarks/bench_streams.py --video recorded.mp4 --streams 4 --workers 1 2 4 8
+    python benchmarks/bench_streams.py --images frames/ --streams 2 --json results/streams.json
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from face_gallery import FaceGallery, ENCODING_DIM  # noqa: E402
+from stream_recognition import StreamRecognitionServer  # noqa: E402
+
+
+def build_gallery(gallery_size, seed=0):
+    """
+    照合に使う合成データのギャラリーを作る。
+    """
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(0.0, 0.09, (gallery_size, ENCODING_DIM))
+    gallery = FaceGallery()
+    gallery.load((i, f'user{i}', vector) for i, vector in enumerate(vectors))
+    return gallery
+
+
+def run(gallery, sources, workers, max_in_flight):
+    server = StreamRecognitionServer(gallery, sources, workers=workers, max_in_flight=max_in_flight)
+    stats = server.run()
+    latencies = [stream['latency_seconds_mean'] for stream in stats['streams']]
+    return {
+        'workers': workers,
+        'frames': stats['frames_processed'],
+        'errors': sum(stream['errors'] for stream in stats['streams']),
+        'elapsed_seconds': stats['elapsed_seconds'],
+        'fps': stats['fps'],
+        'latency_ms': float(np.mean(latencies)) * 1000.0 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video', help='録画した動画ファイル')
+    source.add_argument('--images', help='画像ファイルが入ったディレクトリ')
+    parser.add_argument('--streams', type=int, default=4, help='同時に流す入力元の数')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()],
+                        help='計測するワーカー数')
+    parser.add_argument('--max-in-flight', type=int, default=2, help='入力元ごとに同時に処理するフレーム数の上限')
+    parser.add_argument('--gallery-size', type=int, default=1000, help='合成データのギャラリーの人数')
+    parser.add_argument('--json', help='結果を書き出す JSON ファイル')
+    args = parser.parse_args()
+
+    gallery = build_gallery(args.gallery_size)
+    sources = [args.video or args.images] * args.streams
+    print(f"{args.streams} streams, {len(gallery)} enrolled faces, {os.cpu_count()} CPUs")
+
+    report = []
+    print(f"{'workers':>8}{'frames':>8}{'fps':>10}{'speedup':>10}{'efficiency':>12}{'latency ms':>12}")
+    for workers in sorted(set(args.workers)):
+        row = run(gallery, sources, workers, args.max_in_flight)
+        if not row['frames']:
+            sys.exit('No frames could be processed from the input.')
+        # 最も少ないワーカー数の結果を基準にする（1ワーカーでなければ、ワーカー数に比例すると仮定して換算する）
+        base = report[0] if report else row
+        row['speedup'] = row['fps'] / base['fps'] * base['workers']
+        row['efficiency'] = row['speedup'] / workers
+        report.append(row)
+        print(f"{workers:>8d}{row['frames']:>8d}{row['fps']:>10.1f}{row['speedup']:>10.2f}"
+              f"{row['efficiency']:>12.2f}{row['latency_ms']:>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'cpus': os.cpu_count(), 'results': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import csv
+import os
+from face_recognition_utils import compute_enrollment_encoding, encoding_to_bytes, ENROLLMENT_ERRORS
+from frame_source import IMAGE_EXTENSIONS
+
+EYE_PATTERN_COLUMNS = ('eye_pattern_1', 'eye_pattern_2', 'eye_pattern_3', 'eye_pattern_4')
+
+# ユーザー名とパスワードの長さ（ユーザー登録のフォームと同じ）
+USERNAME_MIN_LENGTH = 4
+USERNAME_MAX_LENGTH = 15
+PASSWORD_MIN_LENGTH = 8
+PASSWORD_MAX_LENGTH = 80
+
+
+def list_enrollment_jobs(source):
+    """
+    一括登録する顔写真の一覧を作る。
+
+    Args:
+        source (str): 画像が入ったディレクトリ（ファイル名の拡張子を除いた部分をユーザー名にする）、
+            または username, face_image 列（任意で password, eye_pattern_1～4 列）を持つCSVファイル。
+
+    Returns:
+        list: {'username', 'face_image', 'password', 'eye_patterns'} の辞書のリスト。
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            username, ext = os.path.splitext(filename)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                jobs.append({
+                    'username': username,
+                    'face_image': os.path.join(source, filename),
+                    'password': None,
+                    'eye_patterns': None,
+                })
+        return jobs
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            face_image = row['face_image']
+            if not os.path.isabs(face_image):
+                # CSVからの相対パスとして扱う
+                face_image = os.path.join(base_dir, face_image)
+            eye_patterns = [row.get(column) or None for column in EYE_PATTERN_COLUMNS]
+            jobs.append({
+                'username': row['username'],
+                'face_image': face_image,
+                'password': row.get('password') or None,
+                'eye_patterns': eye_patterns if any(eye_patterns) else None,
+            })
+    return jobs
+
+
+def validate_enrollment_jobs(jobs, existing_usernames=()):
+    """
+    ユーザー登録のフォームと同じ条件でユーザー名とパスワードを検証する。
+
+    前後に空白があるユーザー名、一覧の中や既存のユーザーと大文字・小文字だけが違うユーザー名も受け付けない
+    （一覧の中で重複する場合は最初のものだけを登録する）。既存のユーザーと完全に同じユーザー名は更新として受け付ける。
+
+    Args:
+        jobs (list): list_enrollment_jobs() の結果。
+        existing_usernames (iterable): 登録済みのユーザー名。
+
+    Returns:
+        tuple: (受け付けた job のリスト, (job, エラーメッセージ) のリスト)。
+    """
+    existing = {username.casefold(): username for username in existing_usernames}
+    seen = set()
+    valid, invalid = [], []
+    for job in jobs:
+        username = job['username'] or ''
+        password = job['password']
+        folded = username.casefold()
+        if not username.strip() or username != username.strip():
+            error = 'Username must not be empty or start or end with whitespace.'
+        elif not USERNAME_MIN_LENGTH <= len(username) <= USERNAME_MAX_LENGTH:
+            error = f"Username must be between {USERNAME_MIN_LENGTH} and {USERNAME_MAX_LENGTH} characters."
+        elif password is not None and not PASSWORD_MIN_LENGTH <= len(password) <= PASSWORD_MAX_LENGTH:
+            error = f"Password must be between {PASSWORD_MIN_LENGTH} and {PASSWORD_MAX_LENGTH} characters."
+        elif folded in seen:
+            error = 'Duplicate username in the enrollment list.'
+        elif folded in existing and existing[folded] != username:
+            error = f"Username differs only in case from the existing user {existing[folded]}."
+        else:
+            seen.add(folded)
+            valid.append(job)
+            continue
+        invalid.append((job, error))
+    return valid, invalid
+
+
+def encode_enrollment_job(job):
+    """
+    1枚の顔写真から顔特徴量を計算する（プロセスプールのワーカーで実行する）。
+
+    Returns:
+        tuple: (job, 顔特徴量のバイト列, エラーメッセージ)。顔が見つからない場合、品質の判定を
+            通らない場合、読み込めない場合は顔特徴量が None になり、エラーメッセージが入る。
+    """
+    try:
+        encoding, reason = compute_enrollment_encoding(job['face_image'])
+    except Exception as e:
+        return job, None, f"Error processing image: {e}"
+    if encoding is None:
+        return job, None, ENROLLMENT_ERRORS[reason]
+    return job, encoding_to_bytes(encoding), None
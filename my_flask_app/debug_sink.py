@@ -0,0 +1,78 @@
+import os
+import queue
+import threading
+import time
+import cv2
+
+# ヘッドレスモード（サーバーで動かす場合は 1 にして、描画と画面表示を行わない）
+HEADLESS = os.environ.get('HEADLESS', '0') == '1'
+# デバッグ用に描画したフレームを保存するディレクトリ（未設定なら保存しない）
+DEBUG_FRAME_DIR = os.environ.get('DEBUG_FRAME_DIR')
+# 何フレームに1回保存するか
+DEBUG_FRAME_EVERY = int(os.environ.get('DEBUG_FRAME_EVERY', '30'))
+
+
+class DebugSink:
+    """
+    デバッグ用の描画とファイルへの保存を、認証処理とは別のスレッドで行う。
+
+    認証処理側は submit() に元のフレームと描画関数を渡すだけで、フレームのコピー、描画、
+    JPEG への書き出しはすべてバックグラウンドのスレッドで行う。every_n フレームに1回だけ
+    受け付け、書き出しが追いつかない場合はそのフレームを捨てる（認証処理を待たせない）。
+
+    Args:
+        directory (str): 描画したフレームを保存するディレクトリ。
+        every_n (int): 何フレームに1回保存するか。
+        max_pending (int): 書き出し待ちにできるフレーム数の上限。
+    """
+
+    def __init__(self, directory, every_n=DEBUG_FRAME_EVERY, max_pending=4):
+        self.directory = directory
+        self.every_n = max(1, every_n)
+        self.submitted_frames = 0
+        self.written_frames = 0
+        self.dropped_frames = 0
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, image, render, *args):
+        """
+        描画対象のフレームを渡す。
+
+        Args:
+            image (numpy.ndarray): 元のフレーム（このスレッドでは変更しない）。
+            render (callable): render(image, *args) で描画した画像を返す関数。
+        """
+        self.submitted_frames += 1
+        if (self.submitted_frames - 1) % self.every_n != 0:
+            return
+        try:
+            self._queue.put_nowait((self.submitted_frames, image, render, args))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frame_no, image, render, args = item
+            debug_image = render(image.copy(), *args)
+            filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{frame_no:06d}.jpg"
+            cv2.imwrite(os.path.join(self.directory, filename), debug_image)
+            self.written_frames += 1
+
+
+def create_debug_sink(name):
+    """
+    DEBUG_FRAME_DIR が設定されていれば、その下の name ディレクトリに保存する DebugSink を作る。
+    """
+    if not DEBUG_FRAME_DIR:
+        return None
+    return DebugSink(os.path.join(DEBUG_FRAME_DIR, name))
@@ -0,0 +1,264 @@
+import threading
+import numpy as np
+
+# 顔特徴量の次元数
+ENCODING_DIM = 128
+
+# 顔特徴量の距離がこの値未満なら同一人物と判定する
+FACE_MATCH_THRESHOLD = 0.40
+
+
+class FaceGallery:
+    """
+    登録済みユーザーの顔特徴量をメモリ上に保持するギャラリー。
+
+    顔特徴量は連続した float32 の N×128 行列として保持し、ユーザーIDと名前は
+    同じ並びの配列で保持する。照合は行列とベクトルの積1回で全ユーザーとの
+    距離をまとめて計算する。ワーカープロセスごとに一度だけDBから読み込み、
+    登録時には行列をその場で更新する。
+    """
+
+    def __init__(self, capacity=64):
+        self._lock = threading.RLock()
+        self._encodings = np.empty((capacity, ENCODING_DIM), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._names = np.empty(capacity, dtype=object)
+        self._size = 0
+        self.loaded = False
+        self.version = None
+
+    @classmethod
+    def from_arrays(cls, ids, names, encodings, **kwargs):
+        """
+        読み込み済みのギャラリーを配列から作る。encodings（N×128 の float32）はコピーせずにそのまま使うため、
+        共有メモリ上の行列を複数のプロセスで読み取り専用で共有できる。kwargs はコンストラクタに渡す。
+        """
+        gallery = cls(capacity=0, **kwargs)
+        encodings = np.asarray(encodings, dtype=np.float32)
+        gallery._encodings = encodings
+        gallery._sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+        gallery._ids = np.asarray(ids, dtype=np.int64)
+        gallery._names = np.empty(len(names), dtype=object)
+        gallery._names[:] = list(names)
+        gallery._size = len(encodings)
+        gallery.loaded = True
+        return gallery
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def encodings(self):
+        """登録済みの顔特徴量（N×128）のビュー。"""
+        return self._encodings[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def names(self):
+        return self._names[:self._size]
+
+    def load(self, rows, version=None):
+        """
+        ギャラリーの内容を置き換える。
+
+        Args:
+            rows (iterable): (user_id, name, encoding) のタプルの列。
+            version: 読み込んだ時点のギャラリーのバージョン（無効化の判定に使う）。
+        """
+        rows = list(rows)
+        with self._lock:
+            self._size = 0
+            self._reserve(len(rows))
+            for user_id, name, encoding in rows:
+                self._append(user_id, name, encoding)
+            self.loaded = True
+            self.version = version
+
+    def invalidate(self):
+        """
+        次回の利用時にDBから読み込み直すようにする。
+        """
+        with self._lock:
+            self.loaded = False
+
+    def upsert(self, user_id, name, encoding):
+        """
+        ユーザーの顔特徴量を追加する。既に登録されている場合は上書きする。
+        """
+        with self._lock:
+            index = self._index_of(user_id)
+            if index is None:
+                self._reserve(self._size + 1)
+                self._append(user_id, name, encoding)
+            else:
+                self._set(index, user_id, name, encoding)
+
+    def remove(self, user_id):
+        """
+        ユーザーの顔特徴量を削除する。末尾の要素で穴を埋めるため並び順は保たれない。
+        """
+        with self._lock:
+            index = self._index_of(user_id)
+            if index is None:
+                return False
+            last = self._size - 1
+            if index != last:
+                self._encodings[index] = self._encodings[last]
+                self._sq_norms[index] = self._sq_norms[last]
+                self._ids[index] = self._ids[last]
+                self._names[index] = self._names[last]
+            self._names[last] = None
+            self._size = last
+            return True
+
+    def distances(self, face_encoding):
+        """
+        入力した顔特徴量と全登録ユーザーとのユークリッド距離をまとめて計算する。
+
+        ||a - b||^2 = ||a||^2 - 2a・b + ||b||^2 を使い、内積部分を行列ベクトル積1回で求める。
+        """
+        probe = np.asarray(face_encoding, dtype=np.float32)
+        with self._lock:
+            encodings = self._encodings[:self._size]
+            sq_norms = self._sq_norms[:self._size]
+            sq_dists = sq_norms - 2.0 * (encodings @ probe) + probe @ probe
+        return np.sqrt(np.maximum(sq_dists, 0.0))
+
+    def match(self, face_encoding, threshold):
+        """
+        入力した顔特徴量に最も近いユーザーを探す。
+
+        Returns:
+            tuple: (user_id, name, distance)。閾値未満のユーザーがいない場合は (None, None, 最小距離)。
+        """
+        with self._lock:
+            if self._size == 0:
+                return None, None, None
+            dists = self.distances(face_encoding)
+            match_index = int(np.argmin(dists))
+            min_dist = float(dists[match_index])
+            if min_dist < threshold:
+                return int(self._ids[match_index]), self._names[match_index], min_dist
+        return None, None, min_dist
+
+    def search(self, face_encoding, k=1):
+        """
+        入力した顔特徴量に近い順に最大 k 人のユーザーを返す。
+
+        Returns:
+            tuple: (user_id の配列, 距離の配列)。距離の昇順に並ぶ。
+        """
+        with self._lock:
+            if self._size == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            dists = self.distances(face_encoding)
+            k = min(k, self._size)
+            top = np.argpartition(dists, k - 1)[:k]
+            top = top[np.argsort(dists[top])]
+            return self._ids[top].copy(), dists[top]
+
+    def search_batch(self, face_encodings, k=1):
+        """
+        M 個の顔特徴量それぞれについて、近い順に最大 k 人のユーザーを返す。
+
+        M×N の距離行列を行列積1回で求めるため、1フレームに複数の顔が写っている場合でも
+        顔ごとに全員との距離を計算し直す必要がない。
+
+        Args:
+            face_encodings (array-like): M×128 の顔特徴量。
+            k (int): 顔ごとに返す候補の数（登録人数より多い場合は登録人数）。
+
+        Returns:
+            tuple: (user_id の配列, 名前の配列, 距離の配列)。いずれも M×k で、各行は距離の昇順に並ぶ。
+        """
+        probes = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        with self._lock:
+            rows, dists = self._search_rows(probes, k)
+            return self._ids[rows], self._names[rows], dists
+
+    def match_batch(self, face_encodings, threshold):
+        """
+        M 個の顔特徴量それぞれに最も近いユーザーを探す。
+
+        Args:
+            threshold (float or array-like): 閾値。顔ごとに変える場合は長さ M の配列。
+
+        Returns:
+            list: 顔ごとの (user_id, name, distance)。閾値未満のユーザーがいない場合は (None, None, 最小距離)。
+        """
+        ids, names, dists = self.search_batch(face_encodings, k=1)
+        return _threshold_matches(ids, names, dists, threshold)
+
+    def _search_rows(self, probes, k):
+        if self._size == 0:
+            return np.empty((len(probes), 0), dtype=np.int64), np.empty((len(probes), 0), dtype=np.float32)
+        encodings = self._encodings[:self._size]
+        sq_dists = (self._sq_norms[:self._size][None, :] - 2.0 * (probes @ encodings.T)
+                    + np.einsum('ij,ij->i', probes, probes)[:, None])
+        dists = np.sqrt(np.maximum(sq_dists, 0.0))
+        return _top_k(dists, k)
+
+    def _index_of(self, user_id):
+        hits = np.flatnonzero(self._ids[:self._size] == user_id)
+        return int(hits[0]) if hits.size else None
+
+    def _reserve(self, size):
+        capacity = self._encodings.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        encodings = np.empty((new_capacity, ENCODING_DIM), dtype=np.float32)
+        encodings[:self._size] = self._encodings[:self._size]
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        ids = np.empty(new_capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        names = np.empty(new_capacity, dtype=object)
+        names[:self._size] = self._names[:self._size]
+        self._encodings, self._sq_norms, self._ids, self._names = encodings, sq_norms, ids, names
+
+    def _append(self, user_id, name, encoding):
+        self._set(self._size, user_id, name, encoding)
+        self._size += 1
+
+    def _set(self, index, user_id, name, encoding):
+        vector = np.asarray(encoding, dtype=np.float32)
+        self._encodings[index] = vector
+        self._sq_norms[index] = vector @ vector
+        self._ids[index] = user_id
+        self._names[index] = name
+
+
+def _top_k(dists, k):
+    """
+    M×N の距離行列の各行から、小さい順に k 個の列番号と距離を取り出す。
+    """
+    k = min(k, dists.shape[1])
+    if k == 0:
+        return np.empty((len(dists), 0), dtype=np.int64), np.empty((len(dists), 0), dtype=dists.dtype)
+    top = np.argpartition(dists, k - 1, axis=1)[:, :k] if k < dists.shape[1] else np.tile(np.arange(k), (len(dists), 1))
+    top_dists = np.take_along_axis(dists, top, axis=1)
+    order = np.argsort(top_dists, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_dists, order, axis=1)
+
+
+def _threshold_matches(ids, names, dists, threshold):
+    """
+    search_batch() の最も近い候補を閾値で判定し、顔ごとの (user_id, name, distance) にする。
+    """
+    thresholds = np.broadcast_to(np.asarray(threshold, dtype=np.float64), (len(ids),))
+    matches = []
+    for row in range(len(ids)):
+        if ids.shape[1] == 0 or not np.isfinite(dists[row, 0]):
+            matches.append((None, None, None))
+            continue
+        distance = float(dists[row, 0])
+        if distance < thresholds[row]:
+            matches.append((int(ids[row, 0]), names[row, 0], distance))
+        else:
+            matches.append((None, None, distance))
+    return matches
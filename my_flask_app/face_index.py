@@ -0,0 +1,434 @@
+import os
+import threading
+import numpy as np
+from face_gallery import FaceGallery, ENCODING_DIM, _threshold_matches, _top_k
+
+# 量子化したギャラリーで、近似距離の上位何人を float32 の厳密な距離で並べ直すか
+RERANK_K = int(os.environ.get('FACE_RERANK_K', '32'))
+# 量子化した行列を float32 に戻して距離を計算する単位（行数）。CPU のキャッシュに収まる大きさにする
+SCAN_CHUNK = 1024
+# int8 で表す範囲の初期値（次元ごとの絶対値の最大）。登録された顔特徴量に合わせて広げる
+INT8_DEFAULT_RANGE = 0.5
+
+
+def _kmeans(data, k, iterations=10, seed=0):
+    """
+    k-means でクラスタの中心を求める。
+
+    Args:
+        data (numpy.ndarray): 学習に使う顔特徴量（N×128, float32）。
+        k (int): クラスタ数。
+        iterations (int): 反復回数。
+
+    Returns:
+        numpy.ndarray: クラスタの中心（k×128, float32）。
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    data_sq = np.einsum('ij,ij->i', data, data)
+    for _ in range(iterations):
+        centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+        sq_dists = data_sq[:, None] - 2.0 * (data @ centroids.T) + centroid_sq[None, :]
+        assignment = np.argmin(sq_dists, axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        # 空のクラスタは前回の中心をそのまま使う
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class IVFIndex:
+    """
+    転置ファイル（IVF）方式の近似最近傍探索インデックス。
+
+    顔特徴量を k-means でクラスタに分け、照合時は入力に近い nprobe 個のクラスタの中だけを
+    探索する。各クラスタの中身は FaceGallery で保持しているため、クラスタ内の距離計算は
+    総当たりと同じ行列演算になる。登録数が少ない間（min_train_size 未満）は学習を行わず、
+    1つのクラスタで総当たり探索を行う。
+
+    FaceGallery と同じインターフェース（load / upsert / remove / match / search）を持つため、
+    アプリからはどちらも同じように扱える。
+    """
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=1024, retrain_factor=4.0):
+        self._lock = threading.RLock()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self._centroids = None
+        self._lists = [FaceGallery()]
+        # user_id -> (所属するクラスタの番号, 名前)
+        self._members = {}
+        self._trained_size = 0
+        self.loaded = False
+        self.version = None
+
+    def __len__(self):
+        return len(self._members)
+
+    def load(self, rows, version=None):
+        """
+        インデックスの内容を置き換え、登録数が十分ならクラスタを学習し直す。
+
+        Args:
+            rows (iterable): (user_id, name, encoding) のタプルの列。
+            version: 読み込んだ時点のギャラリーのバージョン。
+        """
+        rows = [(user_id, name, np.asarray(encoding, dtype=np.float32)) for user_id, name, encoding in rows]
+        with self._lock:
+            self._build(rows)
+            self.loaded = True
+            self.version = version
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded = False
+
+    def rebuild(self):
+        """
+        現在の登録内容でクラスタを学習し直す。
+        """
+        with self._lock:
+            self._build(list(self._rows()))
+
+    def upsert(self, user_id, name, encoding):
+        """
+        顔特徴量を最も近いクラスタに追加する。既に登録されている場合は置き換える。
+        """
+        vector = np.asarray(encoding, dtype=np.float32)
+        with self._lock:
+            self._discard(user_id)
+            list_no = self._assign(vector[None, :])[0]
+            self._lists[list_no].upsert(user_id, name, vector)
+            self._members[user_id] = (list_no, name)
+            if self._needs_retrain():
+                self.rebuild()
+
+    def remove(self, user_id):
+        """
+        顔特徴量をインデックスから削除する。
+        """
+        with self._lock:
+            return self._discard(user_id)
+
+    def search(self, face_encoding, k=1, nprobe=None):
+        """
+        入力した顔特徴量に近い順に最大 k 人のユーザーを返す（近似）。
+
+        Returns:
+            tuple: (user_id の配列, 距離の配列)。距離の昇順に並ぶ。
+        """
+        probe = np.asarray(face_encoding, dtype=np.float32)
+        with self._lock:
+            ids, dists = [], []
+            for list_no in self._probe_lists(probe, nprobe or self.nprobe):
+                list_ids, list_dists = self._lists[list_no].search(probe, k)
+                ids.append(list_ids)
+                dists.append(list_dists)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate(ids)
+        dists = np.concatenate(dists)
+        order = np.argsort(dists)[:k]
+        return ids[order], dists[order]
+
+    def search_batch(self, face_encodings, k=1, nprobe=None):
+        """
+        M 個の顔特徴量それぞれについて、近い順に最大 k 人のユーザーを返す（近似）。
+
+        探索するクラスタが顔ごとに異なるため、距離の計算は顔ごとに行う。
+
+        Returns:
+            tuple: (user_id の配列, 名前の配列, 距離の配列)。いずれも M×k で、各行は距離の昇順に並ぶ。
+        """
+        probes = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        with self._lock:
+            k = min(k, len(self._members))
+            ids = np.empty((len(probes), k), dtype=np.int64)
+            names = np.empty((len(probes), k), dtype=object)
+            dists = np.empty((len(probes), k), dtype=np.float32)
+            for row, probe in enumerate(probes):
+                row_ids, row_dists = self.search(probe, k, nprobe)
+                # 探索したクラスタの人数が k 人未満の場合は、残りを距離が無限大の空の候補で埋める
+                ids[row], dists[row], names[row] = -1, np.inf, None
+                ids[row, :len(row_ids)], dists[row, :len(row_ids)] = row_ids, row_dists
+                names[row, :len(row_ids)] = [self._members[int(user_id)][1] for user_id in row_ids]
+        return ids, names, dists
+
+    def match_batch(self, face_encodings, threshold, nprobe=None):
+        """
+        M 個の顔特徴量それぞれに最も近いユーザーを探す（threshold は顔ごとに変える場合は長さ M の配列）。
+
+        Returns:
+            list: 顔ごとの (user_id, name, distance)。閾値未満のユーザーがいない場合は (None, None, 最小距離)。
+        """
+        ids, names, dists = self.search_batch(face_encodings, k=1, nprobe=nprobe)
+        return _threshold_matches(ids, names, dists, threshold)
+
+    def match(self, face_encoding, threshold, nprobe=None):
+        """
+        入力した顔特徴量に最も近いユーザーを探す。
+
+        Returns:
+            tuple: (user_id, name, distance)。閾値未満のユーザーがいない場合は (None, None, 最小距離)。
+        """
+        ids, dists = self.search(face_encoding, k=1, nprobe=nprobe)
+        if ids.size == 0:
+            return None, None, None
+        user_id, min_dist = int(ids[0]), float(dists[0])
+        if min_dist < threshold:
+            return user_id, self._members[user_id][1], min_dist
+        return None, None, min_dist
+
+    def _rows(self):
+        for gallery in self._lists:
+            for user_id, name, encoding in zip(gallery.ids, gallery.names, gallery.encodings):
+                yield int(user_id), name, encoding.copy()
+
+    def _build(self, rows):
+        self._members = {}
+        if len(rows) >= self.min_train_size:
+            nlist = self.nlist or max(1, int(np.sqrt(len(rows))))
+            data = np.stack([encoding for _, _, encoding in rows]) if rows else np.empty((0, ENCODING_DIM), np.float32)
+            self._centroids = _kmeans(data, nlist)
+            self._lists = [FaceGallery() for _ in range(nlist)]
+            assignment = self._assign(data)
+        else:
+            self._centroids = None
+            self._lists = [FaceGallery()]
+            assignment = np.zeros(len(rows), dtype=np.int64)
+
+        grouped = [[] for _ in self._lists]
+        for (user_id, name, encoding), list_no in zip(rows, assignment):
+            grouped[list_no].append((user_id, name, encoding))
+            self._members[user_id] = (int(list_no), name)
+        for gallery, list_rows in zip(self._lists, grouped):
+            gallery.load(list_rows)
+        self._trained_size = len(rows)
+
+    def _needs_retrain(self):
+        size = len(self._members)
+        if self._centroids is None:
+            return size >= self.min_train_size
+        return size >= self._trained_size * self.retrain_factor
+
+    def _assign(self, vectors):
+        if self._centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        centroid_sq = np.einsum('ij,ij->i', self._centroids, self._centroids)
+        return np.argmin(centroid_sq[None, :] - 2.0 * (vectors @ self._centroids.T), axis=1)
+
+    def _probe_lists(self, probe, nprobe):
+        if self._centroids is None:
+            return [0]
+        centroid_sq = np.einsum('ij,ij->i', self._centroids, self._centroids)
+        scores = centroid_sq - 2.0 * (self._centroids @ probe)
+        nprobe = min(nprobe, len(self._centroids))
+        return np.argpartition(scores, nprobe - 1)[:nprobe]
+
+    def _discard(self, user_id):
+        member = self._members.pop(user_id, None)
+        if member is None:
+            return False
+        self._lists[member[0]].remove(user_id)
+        return True
+
+
+class QuantizedGallery(FaceGallery):
+    """
+    顔特徴量を int8 または float16 に量子化した行列も保持し、2段階で照合するギャラリー。
+
+    1段階目は量子化した行列（1人あたり int8 で 128 バイト、float16 で 256 バイト）で全員との近似距離を求め、
+    2段階目で近似距離の上位 rerank_k 人だけを float32 の行列で厳密な距離に計算し直してから閾値で判定する。
+    全員分を読むのは量子化した行列だけなので、照合ごとに読むメモリの量が float32 の 1/4（int8）になる。
+    float32 の行列は候補の行しか読まないため、スナップショットの memmap のまま使っても大部分はディスク上に置いたままになる。
+
+    int8 は次元ごとの倍率で量子化する（倍率は登録された顔特徴量の絶対値の最大から決め、範囲外の顔特徴量が
+    登録されたときは全員分を量子化し直す）。
+
+    Args:
+        dtype (str): 'int8' または 'float16'。
+        rerank_k (int): 厳密な距離で並べ直す候補の数。省略時は FACE_RERANK_K。
+    """
+
+    def __init__(self, capacity=64, dtype='int8', rerank_k=None):
+        if dtype not in ('int8', 'float16'):
+            raise ValueError(f"Unsupported quantization dtype: {dtype}")
+        self.dtype = np.dtype(dtype)
+        self.rerank_k = RERANK_K if rerank_k is None else rerank_k
+        self._codes = np.empty((capacity, ENCODING_DIM), dtype=self.dtype)
+        # 量子化した顔特徴量を元に戻したときの二乗ノルム
+        self._code_sq_norms = np.empty(capacity, dtype=np.float32)
+        self._range = np.full(ENCODING_DIM, INT8_DEFAULT_RANGE, dtype=np.float32)
+        super().__init__(capacity)
+
+    @classmethod
+    def from_arrays(cls, ids, names, encodings, **kwargs):
+        gallery = super().from_arrays(ids, names, encodings, **kwargs)
+        with gallery._lock:
+            gallery._requantize()
+        return gallery
+
+    @property
+    def scale(self):
+        """量子化した値に掛けると元の値に戻る、次元ごとの倍率。"""
+        if self.dtype == np.int8:
+            return self._range / 127.0
+        return np.ones(ENCODING_DIM, dtype=np.float32)
+
+    @property
+    def codes(self):
+        """量子化した顔特徴量（N×128）のビュー。"""
+        return self._codes[:self._size]
+
+    def load(self, rows, version=None):
+        rows = list(rows)
+        with self._lock:
+            if self.dtype == np.int8 and rows:
+                # 読み込む顔特徴量がすべて範囲に収まる倍率を先に決めて、量子化し直しが起きないようにする
+                data = np.abs(np.stack([np.asarray(encoding, dtype=np.float32) for _, _, encoding in rows]))
+                self._range = np.maximum(data.max(axis=0), 1e-6).astype(np.float32)
+            super().load(rows, version=version)
+
+    def remove(self, user_id):
+        with self._lock:
+            index = self._index_of(user_id)
+            if index is not None:
+                last = self._size - 1
+                self._codes[index] = self._codes[last]
+                self._code_sq_norms[index] = self._code_sq_norms[last]
+            return super().remove(user_id)
+
+    def approximate_distances(self, face_encoding):
+        """
+        量子化した行列で、入力した顔特徴量と全登録ユーザーとの近似距離をまとめて計算する。
+        """
+        probe = np.asarray(face_encoding, dtype=np.float32)
+        with self._lock:
+            return np.sqrt(np.maximum(self._approximate_sq_distances(probe[None, :])[0], 0.0))
+
+    def search(self, face_encoding, k=1, rerank_k=None):
+        """
+        近似距離の上位 rerank_k 人を厳密な距離で並べ直し、近い順に最大 k 人のユーザーを返す。
+
+        Returns:
+            tuple: (user_id の配列, 距離の配列)。距離は float32 の厳密な値で、昇順に並ぶ。
+        """
+        probe = np.asarray(face_encoding, dtype=np.float32)
+        with self._lock:
+            rows, dists = self._search_rows(probe[None, :], k, rerank_k)
+            return self._ids[rows[0]], dists[0]
+
+    def match(self, face_encoding, threshold, rerank_k=None):
+        """
+        入力した顔特徴量に最も近いユーザーを探す。閾値の判定には厳密な距離を使う。
+
+        Returns:
+            tuple: (user_id, name, distance)。閾値未満のユーザーがいない場合は (None, None, 最小距離)。
+        """
+        probe = np.asarray(face_encoding, dtype=np.float32)
+        with self._lock:
+            if self._size == 0:
+                return None, None, None
+            rows, dists = self._search_rows(probe[None, :], 1, rerank_k)
+            row, min_dist = int(rows[0, 0]), float(dists[0, 0])
+            if min_dist < threshold:
+                return int(self._ids[row]), self._names[row], min_dist
+        return None, None, min_dist
+
+    def _search_rows(self, probes, k, rerank_k=None):
+        if self._size == 0:
+            return np.empty((len(probes), 0), dtype=np.int64), np.empty((len(probes), 0), dtype=np.float32)
+        approx = self._approximate_sq_distances(probes)
+        rows, _ = _top_k(approx, max(k, self.rerank_k if rerank_k is None else rerank_k))
+        # 候補だけを float32 の行列から読み、FaceGallery.distances と同じ式で厳密な距離を求める
+        sq_dists = (self._sq_norms[rows] - 2.0 * np.einsum('mcd,md->mc', self._encodings[rows], probes)
+                    + np.einsum('ij,ij->i', probes, probes)[:, None])
+        order, dists = _top_k(np.sqrt(np.maximum(sq_dists, 0.0)), k)
+        return np.take_along_axis(rows, order, axis=1), dists
+
+    def _approximate_sq_distances(self, probes):
+        # 倍率を入力側に掛けておき、量子化した値のまま内積を取る。変換は SCAN_CHUNK 行ずつ行い、
+        # 変換した行は M 個の顔特徴量すべてとの内積にまとめて使う
+        weights = (probes * self.scale).astype(np.float32)
+        dots = np.empty((self._size, len(probes)), dtype=np.float32)
+        buffer = np.empty((min(SCAN_CHUNK, self._size), ENCODING_DIM), dtype=np.float32)
+        for start in range(0, self._size, SCAN_CHUNK):
+            chunk = self._codes[start:min(start + SCAN_CHUNK, self._size)]
+            block = buffer[:len(chunk)]
+            np.copyto(block, chunk, casting='unsafe')
+            np.dot(block, weights.T, out=dots[start:start + len(chunk)])
+        return (self._code_sq_norms[:self._size][None, :] - 2.0 * dots.T
+                + np.einsum('ij,ij->i', probes, probes)[:, None])
+
+    def _reserve(self, size):
+        super()._reserve(size)
+        capacity = self._encodings.shape[0]
+        if self._codes.shape[0] < capacity:
+            codes = np.empty((capacity, ENCODING_DIM), dtype=self.dtype)
+            codes[:self._size] = self._codes[:self._size]
+            code_sq_norms = np.empty(capacity, dtype=np.float32)
+            code_sq_norms[:self._size] = self._code_sq_norms[:self._size]
+            self._codes, self._code_sq_norms = codes, code_sq_norms
+
+    def _set(self, index, user_id, name, encoding):
+        super()._set(index, user_id, name, encoding)
+        vector = self._encodings[index]
+        if self.dtype == np.int8 and np.any(np.abs(vector) > self._range):
+            self._range = np.maximum(self._range, np.abs(vector))
+            self._requantize(max(self._size, index + 1))
+        else:
+            self._quantize(index, index + 1)
+
+    def _requantize(self, size=None):
+        size = self._size if size is None else size
+        if self._codes.shape[0] < size:
+            self._codes = np.empty((size, ENCODING_DIM), dtype=self.dtype)
+            self._code_sq_norms = np.empty(size, dtype=np.float32)
+        if self.dtype == np.int8 and size:
+            self._range = np.maximum(np.abs(self._encodings[:size]).max(axis=0), 1e-6).astype(np.float32)
+        for start in range(0, size, SCAN_CHUNK):
+            self._quantize(start, min(start + SCAN_CHUNK, size))
+
+    def _quantize(self, start, stop):
+        vectors = self._encodings[start:stop]
+        if self.dtype == np.int8:
+            codes = np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        else:
+            codes = vectors.astype(np.float16)
+        self._codes[start:stop] = codes
+        restored = codes.astype(np.float32) * self.scale
+        self._code_sq_norms[start:stop] = np.einsum('ij,ij->i', restored, restored)
+
+
+# 設定値（FACE_INDEX）とインデックスの実装の対応
+INDEX_TYPES = {
+    'brute': FaceGallery,
+    'ivf': IVFIndex,
+    'int8': lambda **kwargs: QuantizedGallery(dtype='int8', **kwargs),
+    'float16': lambda **kwargs: QuantizedGallery(dtype='float16', **kwargs),
+}
+
+# 配列（スナップショットの memmap など）からそのまま作れるインデックスと、その作り方
+ARRAY_INDEX_TYPES = {
+    'brute': FaceGallery.from_arrays,
+    'int8': lambda ids, names, encodings: QuantizedGallery.from_arrays(ids, names, encodings, dtype='int8'),
+    'float16': lambda ids, names, encodings: QuantizedGallery.from_arrays(ids, names, encodings, dtype='float16'),
+}
+
+
+def create_index(kind='brute', **kwargs):
+    """
+    設定値に応じた顔特徴量のインデックスを作成する。
+
+    Args:
+        kind (str): 'brute'（総当たり、厳密）、'ivf'（近似）、'int8' / 'float16'（量子化した行列で絞り込み、厳密な距離で判定）。
+    """
+    try:
+        index_type = INDEX_TYPES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown face index type: {kind}")
+    return index_type(**kwargs)
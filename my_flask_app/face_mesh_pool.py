@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+class FaceMeshPool:
+    """
+    MediaPipe FaceMesh のインスタンスを上限付きでプールする。
+
+    FaceMesh はトラッキングの状態を内部に持つため、複数のスレッドで1つのインスタンスを
+    共有すると認証同士が干渉する。認証セッションごとに checkout() で1つ借りて、終わったら返す。
+    インスタンスは必要になったときに size 個まで作成する（warm_up() で事前に作成もできる）。
+
+    Args:
+        factory (callable): FaceMesh のインスタンスを作る関数。
+        size (int): プールするインスタンス数の上限。
+    """
+
+    def __init__(self, factory, size=2):
+        self.factory = factory
+        self.size = max(1, size)
+        self._available = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._started_at = time.monotonic()
+        # 計測用のカウンタ
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.busy_seconds_total = 0.0
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        FaceMesh のインスタンスを1つ借りる。すべて使用中の場合は返却されるまで最大 timeout 秒待つ。
+
+        使用例:
+            with pool.checkout() as face_mesh:
+                results = face_mesh.process(image_rgb)
+
+        Raises:
+            TimeoutError: timeout 秒以内にインスタンスを借りられなかった場合。
+        """
+        start = time.monotonic()
+        face_mesh = self._acquire(timeout)
+        acquired = time.monotonic()
+        with self._lock:
+            waited = acquired - start
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        try:
+            yield face_mesh
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                self.busy_seconds_total += time.monotonic() - acquired
+            self._available.put(face_mesh)
+
+    def warm_up(self, image=None):
+        """
+        プールの上限までインスタンスを作成し、それぞれにダミーの画像を1回処理させる。
+        """
+        if image is None:
+            image = np.zeros((480, 640, 3), dtype=np.uint8)
+        instances = []
+        try:
+            for _ in range(self.size):
+                instances.append(self._acquire(timeout=None))
+            for face_mesh in instances:
+                face_mesh.process(image)
+        finally:
+            for face_mesh in instances:
+                self._available.put(face_mesh)
+
+    def stats(self):
+        """
+        待ち時間と使用率の統計を返す。
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'wait_seconds_mean': self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                'busy_seconds_total': self.busy_seconds_total,
+                # 作成してからの時間のうち、インスタンスが使われていた割合
+                'utilization': self.busy_seconds_total / (self.size * elapsed) if elapsed > 0 else 0.0,
+            }
+
+    def _acquire(self, timeout):
+        try:
+            return self._available.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._available.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f"No FaceMesh instance became available within {timeout} seconds.")
@@ -0,0 +1,136 @@
+import os
+import cv2
+import numpy as np
+from model_loader import face_recognition
+from metrics import FACES_REJECTED
+
+# 顔の品質の判定（エンコードの前に、一致しそうにない顔を安い処理で除外する）の設定（環境変数で変更できる）
+# 0 にすると判定を行わない
+QUALITY_GATE = os.environ.get('FACE_QUALITY_GATE', '1') != '0'
+# 顔の枠の短い辺の最小のピクセル数
+MIN_FACE_SIZE = int(os.environ.get('FACE_QUALITY_MIN_SIZE', '50'))
+# 顔の周りを SHARPNESS_SIZE に縮小した画像のラプラシアンの分散の最小値（小さいほどぼやけている）
+MIN_SHARPNESS = float(os.environ.get('FACE_QUALITY_MIN_SHARPNESS', '40'))
+# 左右の目の中心を結ぶ線上での鼻先の位置（0.5 が正面）の、0.5 からのずれの最大値
+MAX_YAW = float(os.environ.get('FACE_QUALITY_MAX_YAW', '0.25'))
+
+# ぼやけ具合は顔の大きさによらず同じ基準で判定するため、この大きさに揃えてから計算する
+SHARPNESS_SIZE = 96
+
+# 判定で除外した理由
+TOO_SMALL = 'too_small'
+BLURRY = 'blurry'
+TURNED = 'turned'
+
+
+def sharpness(gray_image, location):
+    """
+    顔の周りの画像のラプラシアンの分散を返す（ピントが合っているほど大きい）。
+
+    Args:
+        gray_image (numpy.ndarray): グレースケールの画像。
+        location (tuple): 顔の位置 (top, right, bottom, left)。
+    """
+    top, right, bottom, left = location
+    face = gray_image[max(top, 0):bottom, max(left, 0):right]
+    if face.size == 0:
+        return 0.0
+    face = cv2.resize(face, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(face, cv2.CV_64F).var())
+
+
+def yaw_offset(rgb_image, location):
+    """
+    5点のランドマーク（両目の両端と鼻先）から、顔の左右の向きを 0（正面）～ 0.5 以上（真横）で返す。
+
+    左右の目の中心を結ぶ線に鼻先を投影した位置が、線の中央からどれだけずれているかで判定する。
+    ランドマークが求められない場合は None を返す。
+    """
+    landmarks = face_recognition().face_landmarks(rgb_image, [location], model='small')
+    if not landmarks:
+        return None
+    points = landmarks[0]
+    left_eye = np.mean(points['left_eye'], axis=0)
+    right_eye = np.mean(points['right_eye'], axis=0)
+    nose = np.asarray(points['nose_tip'][0], dtype=np.float64)
+    eye_axis = right_eye - left_eye
+    length = eye_axis @ eye_axis
+    if length == 0:
+        return None
+    return abs((nose - left_eye) @ eye_axis / length - 0.5)
+
+
+def assess_face_quality(rgb_image, location, gray_image=None):
+    """
+    顔の大きさ、ぼやけ具合、顔の向きの順に判定し、除外する理由を返す（問題がなければ None）。
+
+    Args:
+        rgb_image (numpy.ndarray): RGB形式の画像。
+        location (tuple): 顔の位置 (top, right, bottom, left)。
+        gray_image (numpy.ndarray): 変換済みのグレースケールの画像（省略時は rgb_image から変換する）。
+
+    Returns:
+        str: TOO_SMALL、BLURRY、TURNED のいずれか（問題がなければ None）。
+    """
+    top, right, bottom, left = location
+    if min(bottom - top, right - left) < MIN_FACE_SIZE:
+        return TOO_SMALL
+    if gray_image is None:
+        gray_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+    if sharpness(gray_image, location) < MIN_SHARPNESS:
+        return BLURRY
+    offset = yaw_offset(rgb_image, location)
+    if offset is not None and offset > MAX_YAW:
+        return TURNED
+    return None
+
+
+def partition_face_locations(rgb_image, face_locations):
+    """
+    顔の位置を、品質の判定を通ったものと除外したものに分ける（計測値は記録しない）。
+
+    FACE_QUALITY_GATE が 0 の場合はすべて通す。プロセスプールのワーカーでは、除外した理由を
+    親プロセスに返して、親プロセスで count_rejections() を呼ぶ。
+
+    Returns:
+        tuple: (判定を通った顔の位置のリスト（元の並び順）, 除外した理由のリスト)。
+    """
+    if not QUALITY_GATE or not face_locations:
+        return list(face_locations), []
+    gray_image = None
+    accepted = []
+    rejections = []
+    for location in face_locations:
+        top, right, bottom, left = location
+        if min(bottom - top, right - left) < MIN_FACE_SIZE:
+            rejections.append(TOO_SMALL)
+            continue
+        if gray_image is None:
+            # グレースケールへの変換は大きさの判定を通った顔があるときだけ、フレームごとに1回行う
+            gray_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+        reason = assess_face_quality(rgb_image, location, gray_image)
+        if reason is not None:
+            rejections.append(reason)
+            continue
+        accepted.append(location)
+    return accepted, rejections
+
+
+def count_rejections(rejections, pipeline):
+    """除外した顔を理由ごとに /metrics に数える。"""
+    for reason in rejections:
+        FACES_REJECTED.inc(pipeline=pipeline, reason=reason)
+
+
+def filter_face_locations(rgb_image, face_locations, pipeline='face'):
+    """
+    エンコードする前に、品質の判定を通った顔の位置だけを残す。除外した顔は理由ごとに数える。
+
+    FACE_QUALITY_GATE が 0 の場合はそのまま返す。
+
+    Returns:
+        list: 判定を通った顔の位置のリスト（元の並び順）。
+    """
+    accepted, rejections = partition_face_locations(rgb_image, face_locations)
+    count_rejections(rejections, pipeline)
+    return accepted
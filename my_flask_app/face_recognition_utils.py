@@ -1,73 +1,242 @@
-import face_recognition
 import numpy as np
 import cv2
 import os
+from face_gallery import FACE_MATCH_THRESHOLD
+from model_loader import face_recognition
+from face_quality import QUALITY_GATE, assess_face_quality, filter_face_locations
+from metrics import StageTimer, STAGE_SECONDS, FRAMES_PROCESSED, FACES_DETECTED, MATCH_DISTANCE
 
-def recognize_face_from_camera(users):
+# 段階ごとの処理時間を /metrics に記録する（計測用の StageTimings が渡されない場合に使う）
+FACE_STAGE_TIMER = StageTimer(STAGE_SECONDS, 'face')
+
+# 顔検出の設定（環境変数で変更できる）
+# 検出を行う前にフレームを縮小する倍率（0.25 や 0.5 にすると高速になるが、小さい顔は検出しにくくなる）
+DETECTION_SCALE = float(os.environ.get('FACE_DETECTION_SCALE', '1.0'))
+# 検出時に画像を拡大する回数（大きいほど小さい顔を検出できるが遅くなる）
+NUMBER_OF_TIMES_TO_UPSAMPLE = int(os.environ.get('FACE_DETECTION_UPSAMPLE', '1'))
+# 検出モデル（'hog': CPU向けで高速、'cnn': 高精度だがGPUがないと遅い）
+DETECTION_MODEL = os.environ.get('FACE_DETECTION_MODEL', 'hog')
+
+
+def detect_faces(rgb_frame, scale=None, number_of_times_to_upsample=None, model=None):
     """
-    引数として渡されたユーザー情報（名前と顔写真パス）を用いて顔認証を行う。
+    縮小したフレームで顔を検出し、検出した位置を元の解像度に戻して返す。
 
     Args:
-        users (list): 辞書形式のユーザー情報のリスト。例: [{'name': 'user1', 'face_image': 'path/to/image.jpg'}, ...]
+        rgb_frame (numpy.ndarray): RGB形式の画像。
+        scale (float): 検出前の縮小倍率（省略時は DETECTION_SCALE）。
+        number_of_times_to_upsample (int): 検出時の拡大回数（省略時は NUMBER_OF_TIMES_TO_UPSAMPLE）。
+        model (str): 'hog' または 'cnn'（省略時は DETECTION_MODEL）。
 
     Returns:
-        str: 一致したユーザー名（認証失敗時は None）。
-    """
-    known_face_encodings = []
-    known_face_names = []
-
-    for user in users:
-        if user['face_image']:
-            try:
-                img = face_recognition.load_image_file(user['face_image'])
-                encoding = face_recognition.face_encodings(img)[0]
-                known_face_encodings.append(encoding)
-                known_face_names.append(user['name'])
-            except Exception as e:
-                print(f"Error processing image for {user['name']}: {e}")
-                continue
-
-    cap = cv2.VideoCapture(0)  # Webカメラを起動
-
-    if not cap.isOpened():
-        print("Error: Unable to access the camera.")
+        list: 元の解像度での顔の位置 (top, right, bottom, left) のリスト。
+    """
+    scale = DETECTION_SCALE if scale is None else scale
+    if number_of_times_to_upsample is None:
+        number_of_times_to_upsample = NUMBER_OF_TIMES_TO_UPSAMPLE
+    model = model or DETECTION_MODEL
+
+    if scale == 1.0:
+        return face_recognition().face_locations(rgb_frame, number_of_times_to_upsample, model)
+
+    small_frame = cv2.resize(rgb_frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_locations = face_recognition().face_locations(small_frame, number_of_times_to_upsample, model)
+
+    # 縮小した画像での位置を元の解像度に戻す
+    height, width = rgb_frame.shape[:2]
+    face_locations = []
+    for top, right, bottom, left in small_locations:
+        face_locations.append((
+            max(int(top / scale), 0),
+            min(int(right / scale), width - 1),
+            min(int(bottom / scale), height - 1),
+            max(int(left / scale), 0),
+        ))
+    return face_locations
+
+
+def compute_face_encoding(image_path):
+    """
+    顔写真から128次元の顔特徴量（エンコーディング）を計算する。
+
+    Args:
+        image_path (str): 顔写真のファイルパス。
+
+    Returns:
+        numpy.ndarray: 128次元の顔特徴量（顔が検出できなかった場合は None）。
+    """
+    img = face_recognition().load_image_file(image_path)
+    encodings = face_recognition().face_encodings(img)
+    if not encodings:
         return None
+    return encodings[0]
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Unable to read from the camera.")
-            break
 
-        rgb_frame = np.ascontiguousarray(frame[:, :, ::-1])  # RGB形式に変換
-        face_locations = face_recognition.face_locations(rgb_frame)
+# 登録用の画像を受け付けなかった理由ごとのメッセージ
+ENROLLMENT_ERRORS = {
+    'no_face': 'No face was found in the uploaded image.',
+    'too_small': 'The face in the uploaded image is too small.',
+    'blurry': 'The face in the uploaded image is blurry.',
+    'turned': 'The face in the uploaded image is not facing the camera.',
+}
 
-        if face_locations:
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
 
-            for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-                dists = face_recognition.face_distance(known_face_encodings, face_encoding)
-                min_dist = min(dists)
+def compute_enrollment_encoding(image_path):
+    """
+    登録用の顔写真から顔特徴量を計算する。品質の判定（face_quality）を通らない顔写真は登録しない
+    （FACE_QUALITY_GATE が 0 の場合は判定しない）。
 
-                if min_dist < 0.40:  # 類似度が0.40以下なら一致
-                    match_index = np.argmin(dists)
-                    name = known_face_names[match_index]
+    Returns:
+        tuple: (128次元の顔特徴量, 受け付けなかった理由)。受け付けた場合は理由が None、
+            受け付けなかった場合は顔特徴量が None で、理由は ENROLLMENT_ERRORS のキーになる。
+    """
+    img = face_recognition().load_image_file(image_path)
+    face_locations = face_recognition().face_locations(img)
+    if not face_locations:
+        return None, 'no_face'
+    reason = assess_face_quality(img, face_locations[0]) if QUALITY_GATE else None
+    if reason is not None:
+        return None, reason
+    return face_recognition().face_encodings(img, face_locations[:1])[0], None
 
-                    # 顔の位置に名前を描画
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                    cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return name
+def encoding_to_bytes(encoding):
+    """
+    顔特徴量をDBに保存するためにバイト列へ変換する。
+    """
+    return np.asarray(encoding, dtype=np.float64).tobytes()
+
+
+def bytes_to_encoding(data):
+    """
+    DBに保存されたバイト列を顔特徴量に戻す。
+    """
+    return np.frombuffer(data, dtype=np.float64)
 
-        # フレームを表示
-        cv2.imshow('Face Recognition', frame)
 
-        # 'q'キーで終了
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+def recognize_face_in_frame(frame, gallery, overlay=None, timings=None, rgb_frame=None):
+    """
+    1フレーム分の画像に写っている顔をギャラリーと照合する。
+
+    Args:
+        frame (numpy.ndarray): BGR形式の画像。
+        gallery (FaceGallery): 登録済みユーザーの顔特徴量を保持したギャラリー。
+        overlay (list): 指定した場合、照合した顔ごとに (位置, 名前) を追加する（デバッグ表示用）。
+        timings (StageTimings): 指定した場合、段階ごとの処理時間を記録する。
+        rgb_frame (numpy.ndarray): 変換済みの RGB 形式の画像（SharedFrameRing のスロットなど）。
+            指定した場合は frame からの変換を行わない。
 
-    cap.release()
-    cv2.destroyAllWindows()
+    Returns:
+        str: 一致したユーザー名（一致する顔がない場合は None）。
+    """
+    timings = timings or FACE_STAGE_TIMER
+    FRAMES_PROCESSED.inc(pipeline='face')
+    if rgb_frame is None:
+        with timings.stage('bgr_to_rgb'):
+            rgb_frame = np.ascontiguousarray(frame[:, :, ::-1])  # RGB形式に変換
+    with timings.stage('detect'):
+        face_locations = detect_faces(rgb_frame)
+    if not face_locations:
+        return None
+    FACES_DETECTED.inc(len(face_locations), pipeline='face')
+
+    # 小さい・ぼやけた・横を向いた顔はエンコードしない
+    with timings.stage('quality'):
+        face_locations = filter_face_locations(rgb_frame, face_locations, pipeline='face')
+    if not face_locations:
+        return None
+
+    with timings.stage('encode'):
+        face_encodings = face_recognition().face_encodings(rgb_frame, face_locations)
+    # 検出したすべての顔と全登録ユーザーとの距離を1回の行列演算で計算
+    with timings.stage('match'):
+        matches = gallery.match_batch(face_encodings, FACE_MATCH_THRESHOLD)
+    for location, (_, name, distance) in zip(face_locations, matches):
+        if distance is not None:
+            MATCH_DISTANCE.observe(distance)
+        if overlay is not None:
+            overlay.append((location, name))
+
+        if name is not None:  # 類似度が0.40未満なら一致
+            return name
     return None
+
+
+def identify_encodings(face_encodings, gallery, k=1, threshold=FACE_MATCH_THRESHOLD):
+    """
+    M 個の顔特徴量を、ギャラリーとの M×N の距離行列1回でまとめて照合し、顔ごとに近い順の候補を返す。
+
+    Args:
+        face_encodings (array-like): M×128 の顔特徴量。
+        gallery (FaceGallery): 登録済みユーザーの顔特徴量を保持したギャラリー（search_batch を持つインデックス）。
+        k (int): 顔ごとに返す候補の数。
+        threshold (float or array-like): 一致とみなす距離の閾値。顔ごとに変える場合は長さ M の配列。
+
+    Returns:
+        list: 顔ごとの辞書 {'match', 'threshold', 'candidates'}。candidates は距離の昇順に並んだ
+            {'user_id', 'name', 'distance'} のリストで、match は閾値未満の最も近い候補（ない場合は None）。
+    """
+    face_encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+    thresholds = np.broadcast_to(np.asarray(threshold, dtype=np.float64), (len(face_encodings),))
+    with FACE_STAGE_TIMER.stage('match'):
+        ids, names, dists = gallery.search_batch(face_encodings, k=k)
+    results = []
+    for row in range(len(face_encodings)):
+        candidates = [
+            {'user_id': int(user_id), 'name': name, 'distance': float(distance)}
+            for user_id, name, distance in zip(ids[row], names[row], dists[row]) if np.isfinite(distance)
+        ]
+        best = candidates[0] if candidates else None
+        results.append({
+            'match': best if best is not None and best['distance'] < thresholds[row] else None,
+            'threshold': float(thresholds[row]),
+            'candidates': candidates,
+        })
+    return results
+
+
+def identify_faces_in_image(rgb_image, gallery, k=1, threshold=FACE_MATCH_THRESHOLD):
+    """
+    画像に写っているすべての顔を検出・エンコードし、identify_encodings() でまとめて照合する。
+    品質の判定を通らない顔はエンコードせず、結果にも含めない。
+
+    Returns:
+        list: 顔ごとの identify_encodings() の結果に、顔の位置 'location' (top, right, bottom, left) を加えたもの。
+    """
+    face_locations = detect_faces(rgb_image)
+    if not face_locations:
+        return []
+    FACES_DETECTED.inc(len(face_locations), pipeline='face')
+    face_locations = filter_face_locations(rgb_image, face_locations, pipeline='face')
+    if not face_locations:
+        return []
+    with FACE_STAGE_TIMER.stage('encode'):
+        face_encodings = face_recognition().face_encodings(rgb_image, face_locations)
+    results = identify_encodings(face_encodings, gallery, k=k, threshold=threshold)
+    for location, result in zip(face_locations, results):
+        result['location'] = list(location)
+    return results
+
+
+def render_face_overlay(frame, overlay):
+    """
+    recognize_face_in_frame() で照合した顔の位置と名前を描画する。
+    """
+    for (top, right, bottom, left), name in overlay:
+        color = (0, 255, 0) if name is not None else (0, 0, 255)
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+        cv2.putText(frame, name or "Unknown", (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+    return frame
+
+
+def decode_frame(data):
+    """
+    ブラウザから送られてきたJPEGなどの画像データをBGR形式の画像に変換する。
+
+    Returns:
+        numpy.ndarray: BGR形式の画像（デコードできない場合は None）。
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
@@ -0,0 +1,154 @@
+import cv2
+import numpy as np
+
+
+def _iou(box_a, box_b):
+    """
+    2つの顔の位置 (top, right, bottom, left) の重なり具合（IoU）を計算する。
+    """
+    top = max(box_a[0], box_b[0])
+    right = min(box_a[1], box_b[1])
+    bottom = min(box_a[2], box_b[2])
+    left = max(box_a[3], box_b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """
+    追跡中の1人分の顔。
+
+    name は一度照合できたらそのまま使い回す（照合できていない間は None）。
+    """
+
+    def __init__(self, track_id, box, name=None):
+        self.track_id = track_id
+        self.box = box
+        self.name = name
+        self.points = None
+        self.confidence = 1.0
+
+
+class FaceTracker:
+    """
+    数フレームに1回だけ顔検出を行い、その間のフレームではオプティカルフローで顔を追跡する。
+
+    追跡中の顔は照合結果（名前）を保持しているため、同じ人物について顔特徴量の計算や
+    距離の計算を毎フレーム繰り返さない。次のいずれかの場合にのみ顔検出を行う。
+
+    - 前回の検出から detect_interval フレーム経った
+    - 追跡中の顔がない
+    - 追跡の信頼度（追跡できた特徴点の割合）が min_confidence を下回った
+
+    Args:
+        detect (callable): RGB画像を受け取り、顔の位置 (top, right, bottom, left) のリストを返す関数。
+        identify (callable): RGB画像と顔の位置のリストを受け取り、それぞれの名前（不明なら None）のリストを返す関数。
+        detect_interval (int): 顔検出を行う間隔（フレーム数）。
+        min_confidence (float): これを下回ったら顔検出をやり直す追跡の信頼度。
+        iou_threshold (float): 検出結果と追跡中の顔を同一とみなす重なり具合。
+    """
+
+    def __init__(self, detect, identify, detect_interval=10, min_confidence=0.5, iou_threshold=0.3):
+        self.detect = detect
+        self.identify = identify
+        self.detect_interval = detect_interval
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+        self.tracks = []
+        self._prev_gray = None
+        self._frames_since_detection = 0
+        self._next_track_id = 0
+        # 計測用のカウンタ
+        self.detections = 0
+        self.identifications = 0
+
+    def update(self, rgb_frame):
+        """
+        1フレーム分の画像で追跡中の顔を更新する。
+
+        Returns:
+            list: 追跡中の Track のリスト。
+        """
+        gray = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+
+        tracked = False
+        if self.tracks and self._prev_gray is not None and self._frames_since_detection < self.detect_interval:
+            tracked = self._track(gray)
+
+        if not tracked:
+            self._detect(rgb_frame, gray)
+            self._frames_since_detection = 0
+        self._frames_since_detection += 1
+        self._prev_gray = gray
+        return self.tracks
+
+    def _detect(self, rgb_frame, gray):
+        self.detections += 1
+        face_locations = self.detect(rgb_frame)
+
+        tracks = []
+        unresolved = []
+        remaining = list(self.tracks)
+        for box in face_locations:
+            # 既存の追跡と重なる検出結果は同じ人物とみなし、名前を引き継ぐ
+            best = max(remaining, key=lambda track: _iou(track.box, box), default=None)
+            if best is not None and _iou(best.box, box) >= self.iou_threshold:
+                remaining.remove(best)
+                best.box = box
+                track = best
+            else:
+                track = Track(self._next_track_id, box)
+                self._next_track_id += 1
+            if track.name is None:
+                unresolved.append(track)
+            track.points = self._find_points(gray, box)
+            track.confidence = 1.0
+            tracks.append(track)
+
+        # 名前が分かっていない顔だけ照合する
+        if unresolved:
+            self.identifications += len(unresolved)
+            names = self.identify(rgb_frame, [track.box for track in unresolved])
+            for track, name in zip(unresolved, names):
+                track.name = name
+        self.tracks = tracks
+
+    def _track(self, gray):
+        height, width = gray.shape[:2]
+        for track in self.tracks:
+            if track.points is None or len(track.points) == 0:
+                return False
+            points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points, None)
+            # 逆方向にも追跡して、元の位置に戻らない点は除外する
+            back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, points, None)
+            error = np.linalg.norm((track.points - back).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+            track.confidence = good.mean() if good.size else 0.0
+            if track.confidence < self.min_confidence:
+                return False
+
+            # 追跡できた点の移動量の中央値だけ顔の位置をずらす
+            shift = np.median((points - track.points).reshape(-1, 2)[good], axis=0)
+            dx, dy = int(round(shift[0])), int(round(shift[1]))
+            top, right, bottom, left = track.box
+            track.box = (
+                max(top + dy, 0),
+                min(right + dx, width - 1),
+                min(bottom + dy, height - 1),
+                max(left + dx, 0),
+            )
+            track.points = points[good].reshape(-1, 1, 2)
+        return True
+
+    @staticmethod
+    def _find_points(gray, box, max_corners=30):
+        top, right, bottom, left = box
+        mask = np.zeros_like(gray)
+        mask[top:bottom, left:right] = 255
+        points = cv2.goodFeaturesToTrack(gray, max_corners, 0.01, 5, mask=mask)
+        if points is None:
+            return np.empty((0, 1, 2), dtype=np.float32)
+        return points.astype(np.float32)
@@ -0,0 +1,99 @@
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+
+class SharedFrameRing:
+    """
+    共有メモリ上に確保したフレームのスロットの並び。取り込み側のプロセスがスロットにフレームを書き込み、
+    ワーカープロセスは同じメモリを NumPy 配列のビューとして読む。
+
+    プロセス間ではスロット番号と通し番号だけを送るため、フレームを pickle してキューで送る場合の
+    コピーとシリアライズが不要になる。各スロットには BGR のフレームと、書き込み時に1回だけ変換した
+    RGB のフレームを並べて置くため、顔検出（face_recognition）と FaceMesh の両方で変換をやり直さない。
+
+    スロットの通し番号は書き込みのたびに更新するため、読む側は受け取った通し番号と比べて
+    処理中に上書きされていないかを確認できる。どのスロットが空いているかは書き込む側で管理する。
+
+    メモリの配置:
+        int64 × slots（通し番号） | slots × (BGR H×W×3 | RGB H×W×3)
+    """
+
+    def __init__(self, shm, slots, height, width, owner=False):
+        self._shm = shm
+        self.slots = slots
+        self.height = height
+        self.width = width
+        self.owner = owner
+        self._seqs = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf)
+        frames = np.ndarray((slots, 2, height, width, 3), dtype=np.uint8, buffer=shm.buf, offset=self._seqs.nbytes)
+        self._bgr = frames[:, 0]
+        self._rgb = frames[:, 1]
+        self._next_seq = 1
+
+    @classmethod
+    def create(cls, slots, height, width):
+        """
+        新しい共有メモリを確保する。作成したプロセスが最後に unlink() を呼ぶ。
+        """
+        size = slots * np.dtype(np.int64).itemsize + slots * 2 * height * width * 3
+        ring = cls(shared_memory.SharedMemory(create=True, size=size), slots, height, width, owner=True)
+        ring._seqs[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        他のプロセスが作成したリングに接続する。
+
+        Args:
+            descriptor (tuple): 作成側の descriptor の値。
+        """
+        name, slots, height, width = descriptor
+        return cls(shared_memory.SharedMemory(name=name), slots, height, width)
+
+    @property
+    def descriptor(self):
+        """ワーカーに送る接続情報（共有メモリの名前とスロットの大きさ）。"""
+        return self._shm.name, self.slots, self.height, self.width
+
+    @property
+    def shape(self):
+        return self.height, self.width, 3
+
+    def write(self, slot, frame):
+        """
+        BGR のフレームをスロットに書き込み、RGB に変換したフレームも同じスロットに書き込む。
+        大きさが異なるフレームはスロットの大きさに変換する。
+
+        Returns:
+            int: スロットの新しい通し番号。
+        """
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        np.copyto(self._bgr[slot], frame)
+        cv2.cvtColor(self._bgr[slot], cv2.COLOR_BGR2RGB, dst=self._rgb[slot])
+        seq = self._next_seq
+        self._next_seq += 1
+        self._seqs[slot] = seq
+        return seq
+
+    def bgr(self, slot):
+        return self._bgr[slot]
+
+    def rgb(self, slot):
+        return self._rgb[slot]
+
+    def is_current(self, slot, seq):
+        """
+        スロットの内容が通し番号 seq で書き込んだときのままかを返す。
+        """
+        return int(self._seqs[slot]) == seq
+
+    def close(self):
+        # ビューを先に手放さないと共有メモリを閉じられない
+        self._seqs = self._bgr = self._rgb = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
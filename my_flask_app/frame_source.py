@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+import cv2
+
+# 認証に使うフレームの入力元（カメラ番号、動画ファイル、画像ディレクトリ、ストリームのURL）
+FRAME_SOURCE = os.environ.get('FRAME_SOURCE', '0')
+# フレームを縮小・拡大する大きさ（0 の場合はそのまま）
+FRAME_WIDTH = int(os.environ.get('FRAME_WIDTH', '0')) or None
+FRAME_HEIGHT = int(os.environ.get('FRAME_HEIGHT', '0')) or None
+# カメラに要求するフレームレート。動画ファイルでは元の fps からこの fps になるよう間引く
+FRAME_FPS = float(os.environ.get('FRAME_FPS', '0')) or None
+
+# 画像ディレクトリから読み込む画像の拡張子（一括登録・一括照合でも使う）
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class FrameSource:
+    """
+    認証処理にフレームを渡す入力元の基底クラス。
+
+    cv2.VideoCapture と同じ read() / isOpened() / release() を持つ。read() は BGR 形式の
+    フレームを返し、width / height を指定した場合はその大きさに変換して返す（片方だけの場合は縦横比を保つ）。
+
+    clock() は最後に読んだフレームの時刻（秒）を返す。カメラでは現在時刻、録画した映像では
+    映像内の時刻になるため、録画を全速力で処理しても目線認証の待ち時間や制限時間が実時間と同じように働く。
+    """
+
+    # read() で timeout を省略したときの待ち時間（秒）
+    read_timeout = 1.0
+    # カメラやストリームのように、止まった後に開き直せば続きのフレームが届く入力元かどうか
+    live = False
+
+    def __init__(self, width=None, height=None, fps=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.captured_frames = 0
+        self.dropped_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def isOpened(self):
+        raise NotImplementedError
+
+    def read(self, timeout=None):
+        """
+        Returns:
+            tuple: (ret, frame)。フレームがなくなった場合やタイムアウトした場合は (False, None)。
+        """
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def ended(self):
+        """
+        read() が (False, None) を返したときに、入力が終わったか（True）、
+        一時的にフレームが届かなかっただけか（False）を返す。
+        """
+        return True
+
+    def clock(self):
+        return time.time()
+
+    def _resize(self, frame):
+        if self.width is None and self.height is None:
+            return frame
+        frame_height, frame_width = frame.shape[:2]
+        width = self.width or round(frame_width * self.height / frame_height)
+        height = self.height or round(frame_height * self.width / frame_width)
+        if (width, height) == (frame_width, frame_height):
+            return frame
+        return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+class ThreadedFrameSource(FrameSource):
+    """
+    バックグラウンドのスレッドでカメラからフレームを取り込み、最新のフレームだけを保持する。
+
+    処理側が read() を呼んだ時点で最も新しいフレームを返すため、処理に時間がかかっても
+    カメラのバッファに溜まった古いフレームを処理することがない。処理側が読む前に
+    新しいフレームで上書きされたフレームの数は dropped_frames で確認できる。
+    録画した映像をすべてのフレームを処理したい場合は VideoFileSource を使う。
+
+    Args:
+        source: cv2.VideoCapture に渡すカメラ番号またはストリームのURL。
+        width, height (int): フレームの大きさ。カメラにも同じ大きさを要求する。
+        fps (float): カメラに要求するフレームレート。
+    """
+
+    live = True
+
+    def __init__(self, source=0, width=None, height=None, fps=None):
+        super().__init__(width, height, fps)
+        self._cap = cv2.VideoCapture(source)
+        # カメラが対応していれば、縮小の処理をせずに済むよう最初から指定の大きさで取り込む
+        if width:
+            self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self._cap.set(cv2.CAP_PROP_FPS, fps)
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._read_seq = 0
+        self._running = self._cap.isOpened()
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        if self._running:
+            self._thread.start()
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def read(self, timeout=None):
+        """
+        まだ読んでいない最新のフレームを返す。新しいフレームが届くまで最大 timeout 秒待つ。
+
+        Returns:
+            tuple: (ret, frame)。カメラが止まった場合やタイムアウトした場合は (False, None)。
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > self._read_seq or not self._running,
+                                self.read_timeout if timeout is None else timeout)
+            if self._seq <= self._read_seq:
+                return False, None
+            self._read_seq = self._seq
+            return True, self._frame
+
+    def release(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout=1.0)
+        self._cap.release()
+
+    def ended(self):
+        # 取り込みのスレッドが止まっていなければ、タイムアウトしただけ
+        with self._cond:
+            return not self._running
+
+    def _capture_loop(self):
+        while self._running:
+            ret, frame = self._cap.read()
+            if ret:
+                # 大きさの変換も取り込み側のスレッドで行う
+                frame = self._resize(frame)
+            with self._cond:
+                if not ret:
+                    self._running = False
+                    self._cond.notify_all()
+                    break
+                # 処理側がまだ読んでいないフレームは捨てて、最新のフレームで上書きする
+                if self._seq > self._read_seq:
+                    self.dropped_frames += 1
+                self._frame = frame
+                self._seq += 1
+                self.captured_frames += 1
+                self._cond.notify_all()
+
+
+class VideoFileSource(FrameSource):
+    """
+    録画した動画ファイルのフレームを順番に1枚ずつ返す（フレームを捨てない）。
+
+    処理が終わるたびに次のフレームをデコードするため、処理の速さに関係なく同じ結果になり、
+    CPU の速さの限り全速力で処理できる。
+
+    Args:
+        path (str): 動画ファイルのパス。
+        width, height (int): フレームの大きさ。
+        fps (float): 指定した場合、元の fps からこの fps になるようにフレームを間引く
+            （間引いたフレームはデコードしない）。
+    """
+
+    def __init__(self, path, width=None, height=None, fps=None):
+        super().__init__(width, height, fps)
+        self._cap = cv2.VideoCapture(path)
+        native_fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.native_fps = native_fps if native_fps and native_fps > 0 else 30.0
+        self._step = max(1, round(self.native_fps / fps)) if fps else 1
+        self._index = -1
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def read(self, timeout=None):
+        if self._index >= 0:
+            for _ in range(self._step - 1):
+                if not self._cap.grab():
+                    return False, None
+                self._index += 1
+                self.dropped_frames += 1
+        ret, frame = self._cap.read()
+        if not ret:
+            return False, None
+        self._index += 1
+        self.captured_frames += 1
+        return True, self._resize(frame)
+
+    def release(self):
+        self._cap.release()
+
+    def clock(self):
+        return max(self._index, 0) / self.native_fps
+
+
+class ImageDirectorySource(FrameSource):
+    """
+    ディレクトリ内の画像をファイル名の順に1枚ずつ返す。読み込めない画像は飛ばす。
+
+    Args:
+        directory (str): 画像の連番が入ったディレクトリ。
+        width, height (int): フレームの大きさ。
+        fps (float): 画像を撮影した間隔（clock() の計算に使う）。省略時は 30。
+    """
+
+    def __init__(self, directory, width=None, height=None, fps=None):
+        super().__init__(width, height, fps)
+        self.native_fps = fps or 30.0
+        self._paths = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+                       if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS]
+        self._next = 0
+        self._index = -1
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self, timeout=None):
+        while self._opened and self._next < len(self._paths):
+            frame = cv2.imread(self._paths[self._next])
+            self._next += 1
+            if frame is None:
+                self.dropped_frames += 1
+                continue
+            self._index += 1
+            self.captured_frames += 1
+            return True, self._resize(frame)
+        return False, None
+
+    def release(self):
+        self._opened = False
+
+    def clock(self):
+        return max(self._index, 0) / self.native_fps
+
+
+def open_frame_source(source=None, width=None, height=None, fps=None):
+    """
+    入力元の指定から FrameSource を作る。
+
+    Args:
+        source: FrameSource（そのまま返す）、カメラ番号、動画ファイルのパス、画像ディレクトリのパス、
+            またはストリームのURL。省略時は FRAME_SOURCE。
+        width, height, fps: 省略時は FRAME_WIDTH / FRAME_HEIGHT / FRAME_FPS。
+
+    Returns:
+        FrameSource: 入力元。
+    """
+    if isinstance(source, FrameSource):
+        return source
+    if source is None:
+        source = FRAME_SOURCE
+    width = width or FRAME_WIDTH
+    height = height or FRAME_HEIGHT
+    fps = fps or FRAME_FPS
+    if isinstance(source, int) or str(source).isdigit():
+        return ThreadedFrameSource(int(source), width, height, fps)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, width, height, fps)
+    if os.path.isfile(source):
+        return VideoFileSource(source, width, height, fps)
+    # rtsp:// などのストリームはカメラと同じく最新のフレームだけを処理する
+    return ThreadedFrameSource(source, width, height, fps)
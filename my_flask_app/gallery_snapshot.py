@@ -0,0 +1,198 @@
+import fcntl
+import os
+import struct
+from contextlib import contextmanager
+import numpy as np
+from face_gallery import ENCODING_DIM
+from face_index import ARRAY_INDEX_TYPES
+
+# ギャラリーのスナップショットファイルの形式（リトルエンディアン）
+#
+#   ヘッダー（64バイト）   マジック 'FGAL', 形式のバージョン, 次元数, 人数 N, 名前の領域のバイト数, 顔特徴量の位置
+#   ユーザーID            int64 × N
+#   名前の位置            uint64 × (N + 1)（名前の領域内での各名前の開始位置と、最後の名前の終了位置）
+#   名前                  UTF-8 の文字列を続けたもの
+#   顔特徴量              float32 × N × 128（64バイト境界から始まる連続した行列）
+#   追記したレコード       (int64 ユーザーID, uint32 名前のバイト数, 名前, float32 × 128) の繰り返し
+#
+# 顔特徴量の行列は np.memmap で開くため、同じファイルを開いた全ワーカープロセスがページキャッシュを共有する。
+# 登録時はファイルの末尾にレコードを追記するだけにして、compact_snapshot() で行列にまとめ直す。
+MAGIC = b'FGAL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIQQQ')
+HEADER_SIZE = 64
+RECORD_HEADER = struct.Struct('<qI')
+ALIGNMENT = 64
+ENCODING_BYTES = ENCODING_DIM * np.dtype(np.float32).itemsize
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+@contextmanager
+def _locked(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # 追記と compaction（ファイルの置き換え）が同時に行われないよう、別のロックファイルで排他制御する
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _dedupe(rows):
+    # 同じユーザーIDが複数回ある場合は後のものを使う
+    latest = {}
+    for user_id, name, encoding in rows:
+        latest[int(user_id)] = (name, encoding)
+    return [(user_id, name, encoding) for user_id, (name, encoding) in latest.items()]
+
+
+def write_snapshot(path, rows):
+    """
+    (user_id, name, encoding) の列からスナップショットファイルを作る（既にある場合は置き換える）。
+
+    一時ファイルに書き出してから置き換えるため、既に開いているワーカーは古いファイルをそのまま使い続けられる。
+
+    Returns:
+        int: 書き出した人数。
+    """
+    with _locked(path):
+        return _write_snapshot(path, rows)
+
+
+def _write_snapshot(path, rows):
+    rows = _dedupe(rows)
+    ids = np.array([user_id for user_id, _, _ in rows], dtype='<i8')
+    encoded_names = [name.encode('utf-8') for _, name, _ in rows]
+    name_offsets = np.zeros(len(rows) + 1, dtype='<u8')
+    np.cumsum([len(name) for name in encoded_names], out=name_offsets[1:])
+    names_size = int(name_offsets[-1])
+    encodings_offset = _align(HEADER_SIZE + ids.nbytes + name_offsets.nbytes + names_size)
+    encodings = np.empty((len(rows), ENCODING_DIM), dtype='<f4')
+    for i, (_, _, encoding) in enumerate(rows):
+        encodings[i] = encoding
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, ENCODING_DIM, len(rows), names_size, encodings_offset)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(ids.tobytes())
+        f.write(name_offsets.tobytes())
+        f.write(b''.join(encoded_names))
+        f.write(b'\0' * (encodings_offset - f.tell()))
+        f.write(encodings.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def read_snapshot(path):
+    """
+    スナップショットファイルを開く。顔特徴量の行列はコピーせずに np.memmap で開く。
+
+    Returns:
+        tuple: (ユーザーIDの配列, 名前のリスト, 顔特徴量の行列（N×128 の memmap）, 追記したレコードのリスト)。
+            追記したレコードは (user_id, name, encoding) のタプル。
+    """
+    with open(path, 'rb') as f:
+        magic, version, _, dim, count, names_size, encodings_offset = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION or dim != ENCODING_DIM:
+            raise ValueError(f"{path} is not a face gallery snapshot (format {FORMAT_VERSION}).")
+        f.seek(HEADER_SIZE)
+        ids = np.frombuffer(f.read(count * 8), dtype='<i8').astype(np.int64)
+        name_offsets = np.frombuffer(f.read((count + 1) * 8), dtype='<u8')
+        names_blob = f.read(names_size)
+        names = [names_blob[name_offsets[i]:name_offsets[i + 1]].decode('utf-8') for i in range(count)]
+        tail = _read_records(f, encodings_offset + count * ENCODING_BYTES)
+
+    # 書き込みは各プロセスのメモリにだけ反映する（copy-on-write）
+    if count:
+        encodings = np.memmap(path, dtype='<f4', mode='c', offset=encodings_offset, shape=(count, ENCODING_DIM))
+    else:
+        encodings = np.empty((0, ENCODING_DIM), dtype=np.float32)
+    return ids, names, encodings, tail
+
+
+def _read_records(f, offset):
+    f.seek(offset)
+    records = []
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            break
+        user_id, name_size = RECORD_HEADER.unpack(header)
+        body = f.read(name_size + ENCODING_BYTES)
+        if len(body) < name_size + ENCODING_BYTES:
+            # 書き込みの途中で止まったレコードは無視する
+            break
+        name = body[:name_size].decode('utf-8')
+        encoding = np.frombuffer(body[name_size:], dtype='<f4').astype(np.float32)
+        records.append((user_id, name, encoding))
+    return records
+
+
+def iter_snapshot_rows(path):
+    """
+    スナップショットの内容を (user_id, name, encoding) の列として返す（追記したレコードも反映する）。
+    """
+    ids, names, encodings, tail = read_snapshot(path)
+    return _dedupe(list(zip(ids.tolist(), names, encodings)) + tail)
+
+
+def open_snapshot_gallery(path, version=None, index='brute'):
+    """
+    スナップショットファイルから FaceGallery を作る。index に 'int8' / 'float16' を指定すると、
+    memmap の行列を厳密な距離の計算に使い、量子化した行列だけをメモリに置く QuantizedGallery を作る。
+
+    顔特徴量の行列は memmap をそのまま使うため、DBから読み込む場合と違って人数によらず数ミリ秒で開ける。
+    追記したレコードはギャラリーに upsert する（新しいユーザーがいる場合は行列がメモリにコピーされるため、
+    定期的に compact_snapshot() で行列にまとめ直す）。
+    """
+    ids, names, encodings, tail = read_snapshot(path)
+    gallery = ARRAY_INDEX_TYPES[index](ids, names, encodings)
+    for user_id, name, encoding in tail:
+        gallery.upsert(user_id, name, encoding)
+    gallery.version = version
+    return gallery
+
+
+def append_to_snapshot(path, user_id, name, encoding):
+    """
+    登録したユーザーの顔特徴量をスナップショットの末尾に追記する。
+
+    Returns:
+        int: 追記されたまま compaction されていないレコードの数。
+    """
+    encoded_name = name.encode('utf-8')
+    record = (RECORD_HEADER.pack(int(user_id), len(encoded_name)) + encoded_name
+              + np.asarray(encoding, dtype='<f4').tobytes())
+    with _locked(path):
+        with open(path, 'ab') as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        return pending_records(path)
+
+
+def pending_records(path):
+    """
+    追記されたまま compaction されていないレコードの数を返す。
+    """
+    with open(path, 'rb') as f:
+        _, _, _, _, count, _, encodings_offset = HEADER.unpack(f.read(HEADER.size))
+        return len(_read_records(f, encodings_offset + count * ENCODING_BYTES))
+
+
+def compact_snapshot(path):
+    """
+    追記したレコードを顔特徴量の行列にまとめ直したスナップショットで置き換える。
+
+    Returns:
+        int: まとめ直した後の人数。
+    """
+    with _locked(path):
+        return _write_snapshot(path, iter_snapshot_rows(path))
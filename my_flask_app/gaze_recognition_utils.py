@@ -1,54 +1,190 @@
-import copy
+import os
 import numpy as np
 import cv2 as cv
-import mediapipe as mp
-import time  # 時間遅延を使うためのインポート
+import time
+from face_mesh_pool import FaceMeshPool
+from model_loader import mediapipe_face_mesh
+from metrics import Counter, Gauge, StageTimer, STAGE_SECONDS, FRAMES_PROCESSED, FACES_DETECTED, GAZE_STEPS_MATCHED, GAZE_RESULTS
 
 # 矢印の描画パラメータ
 arrow_length = 50
 arrow_color = (0, 255, 0)  # 矢印の色を設定（BGR形式）
 
-# モデルロード
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    max_num_faces=1,
-    refine_landmarks=True,
-    min_detection_confidence=0.7,
-    min_tracking_confidence=0.5,
-)
+def create_face_mesh(static_image_mode=False):
+    """
+    FaceMesh のインスタンスを作成する関数
+
+    Parameters:
+    - static_image_mode: True の場合はフレーム間のトラッキングを行わず、毎回顔を検出する
+    """
+    # mediapipe は import に時間がかかるため、最初に FaceMesh を作成するときに読み込む
+    return mediapipe_face_mesh().FaceMesh(
+        static_image_mode=static_image_mode,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.7,
+        min_tracking_confidence=0.5,
+    )
+
+
+# FaceMesh はトラッキングの状態を持つため、スレッド間で共有せずプールから借りて使う
+FACE_MESH_POOL_SIZE = int(os.environ.get('FACE_MESH_POOL_SIZE', '2'))
+# すべてのインスタンスが使用中のときに、返却を待つ最大の秒数（過ぎたら混雑として認証を断る）
+FACE_MESH_POOL_TIMEOUT = float(os.environ.get('FACE_MESH_POOL_TIMEOUT', '5'))
+# カメラを使う認証セッション用（セッションの間1つのインスタンスを借りてトラッキングする）
+face_mesh_pool = FaceMeshPool(create_face_mesh, FACE_MESH_POOL_SIZE)
+# フレームAPI用（リクエストごとに別のセッションのフレームが来るため、トラッキングを行わない）
+static_face_mesh_pool = FaceMeshPool(lambda: create_face_mesh(static_image_mode=True), FACE_MESH_POOL_SIZE)
+
+
+def _face_mesh_pool_stat(key):
+    def collect():
+        return {(name,): pool.stats()[key] for name, pool in (('session', face_mesh_pool), ('frame', static_face_mesh_pool))}
+    return collect
+
+
+# FaceMesh のプールの状態を /metrics に出力する
+Gauge('face_mesh_pool_in_use', 'FaceMesh instances currently checked out.', ['pool'],
+      callback=_face_mesh_pool_stat('in_use'))
+Gauge('face_mesh_pool_utilization', 'Share of time FaceMesh instances were checked out.', ['pool'],
+      callback=_face_mesh_pool_stat('utilization'))
+Counter('face_mesh_pool_wait_seconds_total', 'Total time spent waiting for a FaceMesh instance.', ['pool'],
+        callback=_face_mesh_pool_stat('wait_seconds_total'))
+Counter('face_mesh_pool_timeouts_total', 'Checkouts that timed out waiting for a FaceMesh instance.', ['pool'],
+        callback=_face_mesh_pool_stat('timeouts'))
+
+# 段階ごとの処理時間を /metrics に記録する（計測用の StageTimings が渡されない場合に使う）
+GAZE_STAGE_TIMER = StageTimer(STAGE_SECONDS, 'gaze')
 
 # 目のアスペクト比に基づく閾値
 EAR_THRESHOLD_CLOSE = 1.6
 EAR_THRESHOLD_OPEN = 1.3
 
+# 目線認証の設定（環境変数で変更できる）
+# 目線の方向を確定するのに必要な、同じ方向が連続して検出されたフレーム数
+GAZE_STABLE_FRAMES = int(os.environ.get('GAZE_STABLE_FRAMES', '3'))
+# 同じ方向を見続けたときに、もう一度その方向を入力したとみなすまでの秒数
+GAZE_REPEAT_INTERVAL = float(os.environ.get('GAZE_REPEAT_INTERVAL', '0.8'))
+# 目線認証全体の制限時間（秒）
+GAZE_TIMEOUT = float(os.environ.get('GAZE_TIMEOUT', '60'))
+
+# ROI モード（顔の位置が分かっている場合、フレーム全体ではなく顔の周りだけを FaceMesh に渡す）
+FACE_MESH_ROI = os.environ.get('FACE_MESH_ROI', '1') != '0'
+# FaceMesh に渡す顔の周りの画像の大きさ（正方形の一辺のピクセル数）
+FACE_MESH_ROI_SIZE = int(os.environ.get('FACE_MESH_ROI_SIZE', '256'))
+# 顔の枠の周りに加える余白（顔の枠の一辺に対する割合）
+FACE_MESH_ROI_PADDING = float(os.environ.get('FACE_MESH_ROI_PADDING', '0.25'))
+
+# 目のアスペクト比の計算に使うランドマークの添え字（左目, 右目）
+EYE_RATIO_LANDMARKS = np.array([
+    [33, 246, 161, 160, 159, 158, 157, 173],
+    [263, 466, 388, 387, 386, 385, 384, 398],
+])
+# 虹彩のランドマークの添え字（左目, 右目）
+IRIS_LANDMARKS = np.array([
+    [468, 469, 470, 471, 472],
+    [473, 474, 475, 476, 477],
+])
+# 目線方向の計算に使う目の端のランドマークの添え字（左目, 右目）
+EYE_START_LANDMARKS = np.array([130, 463])
+EYE_END_LANDMARKS = np.array([244, 359])
+
+
+def landmarks_to_array(face_landmarks):
+    """
+    MediaPipe のランドマークを (478, 3) の NumPy 配列に変換する関数。
+
+    ランドマークを1つずつ読むのはフレームごとにこの1回だけにして、以降の計算はすべてこの配列を使う。
+
+    Parameters:
+    - face_landmarks: MediaPipe で検出した顔のランドマーク（NormalizedLandmarkList）
+
+    Returns:
+    - 正規化座標 (x, y, z) の配列
+    """
+    return np.array([(landmark.x, landmark.y, landmark.z) for landmark in face_landmarks.landmark], dtype=np.float32)
+
+
+def to_pixel_points(landmark_array, image_width, image_height):
+    """
+    正規化座標のランドマークを画像上のピクセル座標 (478, 2) に変換する関数。
+    """
+    points = (landmark_array[:, :2] * (image_width, image_height)).astype(np.int32)
+    return np.minimum(points, (image_width - 1, image_height - 1))
+
+
+def crop_face_roi(image_rgb, face_box, size=None, padding=None):
+    """
+    顔の枠の周りを正方形に切り出し、size×size に拡大・縮小した画像を返す関数。
+
+    切り出しと拡大・縮小は warpAffine 1回で行い、フレームの外にはみ出した部分は黒で埋める
+    （顔が画面の端にあっても縦横比が変わらないようにする）。
+
+    Parameters:
+    - image_rgb: RGB形式のフレーム
+    - face_box: 顔の枠 (top, right, bottom, left)（face_recognition.face_locations と同じ形式）
+    - size: 切り出した画像の一辺のピクセル数（省略時は FACE_MESH_ROI_SIZE）
+    - padding: 顔の枠の周りに加える余白の割合（省略時は FACE_MESH_ROI_PADDING）
+
+    Returns:
+    - roi_image: 切り出した画像
+    - roi: フレーム上での切り出し範囲 (左上のx, 左上のy, 一辺の長さ)（roi_landmarks_to_frame に渡す）
+    """
+    size = size or FACE_MESH_ROI_SIZE
+    padding = FACE_MESH_ROI_PADDING if padding is None else padding
+    top, right, bottom, left = face_box
+    side = max(right - left, bottom - top, 1) * (1.0 + 2.0 * padding)
+    x0 = (left + right) / 2.0 - side / 2.0
+    y0 = (top + bottom) / 2.0 - side / 2.0
+    scale = size / side
+    transform = np.array([[scale, 0.0, -x0 * scale], [0.0, scale, -y0 * scale]], dtype=np.float32)
+    roi_image = cv.warpAffine(image_rgb, transform, (size, size), flags=cv.INTER_LINEAR,
+                              borderMode=cv.BORDER_CONSTANT)
+    return roi_image, (x0, y0, side)
+
+
+def roi_landmarks_to_frame(landmark_array, roi, image_width, image_height):
+    """
+    切り出した画像上の正規化座標のランドマークを、フレーム全体での正規化座標に戻す関数。
+
+    フレーム全体で検出した場合と同じ座標になるため、以降の目線方向や目のアスペクト比の計算はそのまま使える。
+    """
+    x0, y0, side = roi
+    frame_array = np.empty_like(landmark_array)
+    frame_array[:, 0] = (landmark_array[:, 0] * side + x0) / image_width
+    frame_array[:, 1] = (landmark_array[:, 1] * side + y0) / image_height
+    # z は x と同じ尺度（画像の幅に対する割合）で表されている
+    frame_array[:, 2] = landmark_array[:, 2] * side / image_width
+    return frame_array
+
+
+def landmarks_face_box(landmark_point):
+    """
+    ピクセル座標のランドマークを囲む顔の枠 (top, right, bottom, left) を返す関数（次のフレームの ROI に使う）。
+    """
+    left, top = landmark_point.min(axis=0)
+    right, bottom = landmark_point.max(axis=0)
+    return int(top), int(right), int(bottom), int(left)
+
+
 def calc_min_enc_losingCircle(landmark_list):
-    center, radius = cv.minEnclosingCircle(np.array(landmark_list))
+    center, radius = cv.minEnclosingCircle(np.asarray(landmark_list, dtype=np.int32))
     center = (int(center[0]), int(center[1]))
     radius = int(radius)
     return center, radius
 
-def calc_iris_min_enc_losingCircle(image, landmarks):
+def calc_iris_min_enc_losingCircle(landmark_point):
     """
     虹彩の外接円を計算する関数
 
+    Parameters:
+    - landmark_point: ランドマークのピクセル座標 (478, 2)
+
     Returns:
     - 左目と右目の虹彩の中心と半径
     """
-    image_width, image_height = image.shape[1], image.shape[0]
-    landmark_point = []
-    for landmark in landmarks.landmark:
-        landmark_x = min(int(landmark.x * image_width), image_width - 1)
-        landmark_y = min(int(landmark.y * image_height), image_height - 1)
-        landmark_point.append((landmark_x, landmark_y))
-
-    # 左目と右目のランドマークを抽出
-    left_eye_points = [landmark_point[i] for i in range(468, 473)]  # 468~472
-    right_eye_points = [landmark_point[i] for i in range(473, 478)]  # 473~477
-
-    # 虹彩の外接円を計算
-    left_eye_info = calc_min_enc_losingCircle(left_eye_points)
-    right_eye_info = calc_min_enc_losingCircle(right_eye_points)
-
+    left_eye_info = calc_min_enc_losingCircle(landmark_point[IRIS_LANDMARKS[0]])  # 468~472
+    right_eye_info = calc_min_enc_losingCircle(landmark_point[IRIS_LANDMARKS[1]])  # 473~477
     return left_eye_info, right_eye_info
 
 def get_eye_direction(eye_start, eye_end, iris_center):
@@ -63,83 +199,79 @@ def get_eye_direction(eye_start, eye_end, iris_center):
     Returns:
     - 'left', 'right', 'center' のいずれか
     """
-    eye_width = np.abs(eye_end[0] - eye_start[0])
-    if eye_width < 1:  # 安全チェック
-        return 'center'
+    return get_eye_directions(np.array([eye_start]), np.array([eye_end]), np.array([iris_center]))[0]
+
 
-    # 虹彩の位置が目全体のどの位置にあるかを計算
-    relative_position = (iris_center[0] - eye_start[0]) / eye_width
+def get_eye_directions(eye_starts, eye_ends, iris_centers):
+    """
+    両目の目線方向をまとめて計算する関数
+
+    Parameters:
+    - eye_starts: 目の左端の座標 (N, 2)
+    - eye_ends: 目の右端の座標 (N, 2)
+    - iris_centers: 虹彩の中心座標 (N, 2)
 
+    Returns:
+    - 'left', 'right', 'center' のリスト
+    """
+    eye_widths = np.abs(eye_ends[:, 0] - eye_starts[:, 0]).astype(np.float32)
+    # 虹彩の位置が目全体のどの位置にあるかを計算（目の幅が1未満の場合は安全のため center とする）
+    relative_positions = np.divide(
+        iris_centers[:, 0] - eye_starts[:, 0], eye_widths,
+        out=np.full(len(eye_widths), 0.5, dtype=np.float32), where=eye_widths >= 1,
+    )
     # 虹彩の位置に基づいて方向を判断
-    if relative_position < 0.4:
-        return 'left'
-    elif relative_position > 0.6:
-        return 'right'
-    else:
-        return 'center'
+    directions = np.where(relative_positions < 0.4, 'left', np.where(relative_positions > 0.6, 'right', 'center'))
+    return directions.tolist()
 
 
 def is_centered(left_direction, right_direction):
     # 両目ともにcenterならcenterとして判定
     return left_direction == 'center' and right_direction == 'center'
 
-def draw_landmarks(image, landmarks, refine_landmarks, left_eye, right_eye):
+def draw_landmarks(image, landmark_point, refine_landmarks, left_eye, right_eye):
     """
     画像上に顔のランドマークを描画する関数。
 
     Parameters:
     - image (numpy.ndarray): 描画対象の画像。
-    - landmarks (mediapipe.framework.formats.landmark_pb2.NormalizedLandmarkList): 顔のランドマーク情報。
+    - landmark_point (numpy.ndarray): 顔のランドマークのピクセル座標 (478, 2)。
     - refine_landmarks (bool): 虹彩の外接円と目の輪郭のランドマークを描画するかどうかを指定するフラグ。
     - left_eye (tuple): 左目の虹彩の中心座標と半径を含むタプル。
     - right_eye (tuple): 右目の虹彩の中心座標と半径を含むタプル。
 
     Returns:
     - image (numpy.ndarray): ランドマークが描画された画像。
-    - landmark_point (list): 顔のランドマークの座標リスト。
+    - landmark_point (numpy.ndarray): 顔のランドマークの座標。
     """
-    image_width, image_height = image.shape[1], image.shape[0]
-    landmark_point = []
-    for index, landmark in enumerate(landmarks.landmark):
-        landmark_x = min(int(landmark.x * image_width), image_width - 1)
-        landmark_y = min(int(landmark.y * image_height), image_height - 1)
-        landmark_point.append((landmark_x, landmark_y))
     if refine_landmarks:
         # 虹彩の外接円の描画
         cv.circle(image, left_eye[0], left_eye[1], (0, 255, 0), 2)
         cv.circle(image, right_eye[0], right_eye[1], (0, 255, 0), 2)
         # 目の輪郭のランドマークを描画
-        left_eye_indices = [468, 469, 470, 471, 472]
-        right_eye_indices = [473, 474, 475, 476, 477]
-        for idx in left_eye_indices + right_eye_indices:
-            cv.circle(image, landmark_point[idx], 1, (0, 255, 0), 1)
+        for idx in IRIS_LANDMARKS.ravel():
+            cv.circle(image, tuple(landmark_point[idx].tolist()), 1, (0, 255, 0), 1)
     # 左目の左端から右端を結ぶ直線を赤で描画
-    cv.line(image, landmark_point[468], landmark_point[472], (0, 0, 255), 2)
+    cv.line(image, tuple(landmark_point[468].tolist()), tuple(landmark_point[472].tolist()), (0, 0, 255), 2)
     # 右目の左端から右端を結ぶ直線を赤で描画
-    cv.line(image, landmark_point[473], landmark_point[477], (0, 0, 255), 2)
+    cv.line(image, tuple(landmark_point[473].tolist()), tuple(landmark_point[477].tolist()), (0, 0, 255), 2)
     return image, landmark_point
 
-def draw_eye_lines(image, landmarks):
+def draw_eye_lines(image, landmark_point):
     """
     左目と右目の直線を赤で描画する関数
 
     Parameters:
     - image: 画像
-    - landmarks: 顔のランドマーク
+    - landmark_point: 顔のランドマークのピクセル座標 (478, 2)
 
     Returns:
     - image: 直線が描画された画像
     """
-    image_width, image_height = image.shape[1], image.shape[0]
-    landmark_point = []
-    for index, landmark in enumerate(landmarks.landmark):
-        landmark_x = min(int(landmark.x * image_width), image_width - 1)
-        landmark_y = min(int(landmark.y * image_height), image_height - 1)
-        landmark_point.append((landmark_x, landmark_y))
     # 左目の直線を描画
-    cv.line(image, landmark_point[33], landmark_point[133], (0, 0, 255), 2)
+    cv.line(image, tuple(landmark_point[33].tolist()), tuple(landmark_point[133].tolist()), (0, 0, 255), 2)
     # 右目の直線を描画
-    cv.line(image, landmark_point[362], landmark_point[359], (0, 0, 255), 2)
+    cv.line(image, tuple(landmark_point[362].tolist()), tuple(landmark_point[359].tolist()), (0, 0, 255), 2)
     return image
 
 def draw_gaze_arrow(image, eye_center, iris_center, direction, arrow_length):
@@ -165,133 +297,303 @@ def draw_gaze_arrow(image, eye_center, iris_center, direction, arrow_length):
     cv.arrowedLine(image, eye_center, end_point, (255, 0, 0), 2, tipLength=0.3)
     return image
 
-def calculate_eye_ratio(face_landmarks, eye_landmarks):
+def calculate_eye_ratio(landmark_array, eye_landmarks):
     # 眼のアスペクト比を計算する関数
-    eye_points = np.array([[face_landmarks.landmark[i].x, face_landmarks.landmark[i].y] for i in eye_landmarks])
+    return calculate_eye_ratios(landmark_array, np.array([eye_landmarks]))[0]
+
+
+def calculate_eye_ratios(landmark_array, eye_landmarks=EYE_RATIO_LANDMARKS):
+    """
+    両目のアスペクト比（EAR）をまとめて計算する関数
+
+    Parameters:
+    - landmark_array: landmarks_to_array で変換したランドマーク (478, 3)
+    - eye_landmarks: 目ごとのランドマークの添え字 (目の数, 8)
+
+    Returns:
+    - 目ごとのアスペクト比の配列
+    """
+    eye_points = landmark_array[eye_landmarks][:, :, :2]
     # EAR計算
-    A = np.linalg.norm(eye_points[1] - eye_points[5])
-    B = np.linalg.norm(eye_points[2] - eye_points[4])
-    C = np.linalg.norm(eye_points[0] - eye_points[3])
-    eye_ratio = (A + B) / (2.0 * C)
-    return eye_ratio
-
-# 目線認証関数
-def perform_gaze_recognition(user):
-    eye_open = True
-    # 登録しているユーザの目線のパターンと何回マッチしたか
-    match_count = 0
-    # Webカメラのキャプチャを開始
-    cap = cv.VideoCapture(0)
-    while True:
-        ret, image = cap.read()
-        if not ret:
-            break
-        debug_image = copy.deepcopy(image)
-        image_width, image_height = image.shape[1], image.shape[0]
-
-        left_eye_direction = None
-        right_eye_direction = None
-        eye_direction = None
-        
-
-        # BGRからRGBに変換
-        image_rgb = cv.cvtColor(image, cv.COLOR_BGR2RGB)
-        is_blinked = False
-
-        # 顔のランドマークを検出
-        results = face_mesh.process(image_rgb)
-        # 瞬きと目の状態を検出
+    A = np.linalg.norm(eye_points[:, 1] - eye_points[:, 5], axis=1)
+    B = np.linalg.norm(eye_points[:, 2] - eye_points[:, 4], axis=1)
+    C = np.linalg.norm(eye_points[:, 0] - eye_points[:, 3], axis=1)
+    return (A + B) / (2.0 * C)
+
+
+def _analyze_face_landmarks(landmark_arrays, image_width, image_height, eye_open, overlay):
+    """
+    FaceMesh で検出したランドマーク（フレーム全体での正規化座標の配列のリスト）からまばたきと
+    両目の目線方向を求め、デバッグ表示用の情報を overlay に追加する。
+
+    Returns:
+    - eye_open, is_blinked, left_eye_direction, right_eye_direction
+    """
+    is_blinked = False
+    left_eye_direction = None
+    right_eye_direction = None
+    for landmark_array in landmark_arrays:
+        landmark_point = to_pixel_points(landmark_array, image_width, image_height)
+        # 左右の目のアスペクト比をまとめて計算
+        left_eye_ratio, right_eye_ratio = calculate_eye_ratios(landmark_array)
+
+        # 目が閉じていると判断
+        if left_eye_ratio < EAR_THRESHOLD_CLOSE or right_eye_ratio < EAR_THRESHOLD_CLOSE:
+            eye_open = False
+        # 目が開いていると判断(eye_openがtrueの場合に目線は関係なく、blinkの状態になる。)
+        elif left_eye_ratio > EAR_THRESHOLD_OPEN or right_eye_ratio > EAR_THRESHOLD_OPEN:
+            if not eye_open:
+                is_blinked = True
+            eye_open = True
+
+        # 虹彩の外接円の計算
+        left_eye, right_eye = calc_iris_min_enc_losingCircle(landmark_point)
+
+        # 虹彩の中心と目の中心を使用して、両目の見ている方向をまとめて取得
+        left_eye_direction, right_eye_direction = get_eye_directions(
+            landmark_point[EYE_START_LANDMARKS],
+            landmark_point[EYE_END_LANDMARKS],
+            np.array([left_eye[0], right_eye[0]]),
+        )
+        overlay['faces'].append({
+            'landmark_array': landmark_array,
+            'landmark_point': landmark_point,
+            'left_eye': left_eye,
+            'right_eye': right_eye,
+            'left_eye_direction': left_eye_direction,
+            'right_eye_direction': right_eye_direction,
+        })
+    return eye_open, is_blinked, left_eye_direction, right_eye_direction
+
+
+def process_gaze_frame(image, eye_open, face_mesh, timings=None, image_rgb=None, face_box=None):
+    """
+    1フレーム分の画像から目線の方向とまばたきを検出する。
+
+    描画は行わず、デバッグ表示に必要な情報だけを overlay として返す。描画が必要な場合は
+    render_gaze_overlay() に元の画像のコピーと overlay を渡す。
+
+    Parameters:
+    - image: BGR形式の画像
+    - eye_open: 直前のフレームで目が開いていたかどうか
+    - face_mesh: プールから借りた FaceMesh のインスタンス
+    - timings: 指定した場合、段階ごとの処理時間を記録する StageTimings
+    - image_rgb: 変換済みの RGB 形式の画像（SharedFrameRing のスロットなど）。指定した場合は image からの変換を行わない
+    - face_box: 顔の枠 (top, right, bottom, left)。指定した場合（かつ FACE_MESH_ROI が有効な場合）は
+      顔の周りを FACE_MESH_ROI_SIZE に切り出して FaceMesh に渡す。切り出した範囲で顔が見つからない場合は
+      フレーム全体でやり直す
+
+    Returns:
+    - eye_direction: 'left', 'right', 'center', 'blink' または None（顔が検出できない場合など）
+    - eye_open: このフレームで目が開いているかどうか
+    - overlay: デバッグ表示用の情報（ランドマークの座標、虹彩の外接円、目線の方向など）。
+      顔が見つかった場合は overlay['face_box'] にランドマークを囲む顔の枠が入る（次のフレームの face_box に使う）
+    """
+    timings = timings or GAZE_STAGE_TIMER
+    FRAMES_PROCESSED.inc(pipeline='gaze')
+    image_width, image_height = image.shape[1], image.shape[0]
+
+    eye_direction = None
+    overlay = {'faces': []}
+
+    # BGRからRGBに変換
+    if image_rgb is None:
+        with timings.stage('bgr_to_rgb'):
+            image_rgb = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+
+    # 顔のランドマークを検出（ランドマークはフレームごとに1回だけ配列に変換する）
+    landmark_arrays = []
+    if face_box is not None and FACE_MESH_ROI:
+        # 顔の周りだけを小さな固定サイズで処理し、ランドマークをフレーム全体の座標に戻す
+        with timings.stage('roi_crop'):
+            roi_image, roi = crop_face_roi(image_rgb, face_box)
+        with timings.stage('facemesh'):
+            results = face_mesh.process(roi_image)
         if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                debug_image = draw_eye_lines(debug_image, face_landmarks)
-                # 左右の目のランドマーク
-                left_eye_ratio = calculate_eye_ratio(face_landmarks, [33, 246, 161, 160, 159, 158, 157, 173])
-                right_eye_ratio = calculate_eye_ratio(face_landmarks, [263, 466, 388, 387, 386, 385, 384, 398])
-
-                # 目が閉じていると判断
-                if left_eye_ratio < EAR_THRESHOLD_CLOSE or right_eye_ratio < EAR_THRESHOLD_CLOSE:
-                    eye_open = False
-                # 目が開いていると判断(eye_openがtrueの場合に目線は関係なく、blinkの状態になる。)
-                elif left_eye_ratio > EAR_THRESHOLD_OPEN or right_eye_ratio > EAR_THRESHOLD_OPEN:
-                    if not eye_open:
-                        is_blinked = True
-                    eye_open = True
-
-                # 虹彩の外接円の計算
-                left_eye, right_eye = None, None
-                left_eye, right_eye = calc_iris_min_enc_losingCircle(
-                    debug_image,
-                    face_landmarks,
-                )
-                # 描画
-                debug_image, landmark_point = draw_landmarks(  # landmark_point を受け取る
-                    debug_image,
-                    face_landmarks,
-                    True,
-                    left_eye,
-                    right_eye,
-                )
-
-                # 虹彩の中心と目の中心を使用して、見ている方向の矢印を描画
-                left_eye_center = (int(face_landmarks.landmark[468].x * image_width), int(face_landmarks.landmark[468].y * image_height))
-                right_eye_center = (int(face_landmarks.landmark[473].x * image_width), int(face_landmarks.landmark[473].y * image_height))
-                # 虹彩の中心と目の中心を使用して、見ている方向を取得
-                left_eye_direction = get_eye_direction(landmark_point[130], landmark_point[244], left_eye[0])
-                right_eye_direction = get_eye_direction(landmark_point[463], landmark_point[359], right_eye[0])
-                # 虹彩の中心と目の中心を使用して、見ている方向の矢印を描画
-                debug_image = draw_gaze_arrow(debug_image, left_eye_center, left_eye[0], left_eye_direction, arrow_length)
-                debug_image = draw_gaze_arrow(debug_image, right_eye_center, right_eye[0], right_eye_direction, arrow_length)
-
-        # 目の状態（まばたき、目の方向）を表示
-
-        if is_blinked:
-            eye_direction = 'blink'
-            cv.putText(debug_image, f"Eye_direction: blink", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        elif left_eye_direction == 'left' or right_eye_direction == 'left':
-            cv.putText(debug_image, f"Eye_direction: left", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            eye_direction = 'left'
-        elif left_eye_direction == 'right' or right_eye_direction == 'right':
-            eye_direction = 'right'
-            cv.putText(debug_image, f"Eye_direction: right", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        elif left_eye_direction == 'center' and right_eye_direction == 'center':
-            eye_direction = 'center'
-            cv.putText(debug_image, f"Eye_direction: center", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            landmark_arrays = [roi_landmarks_to_frame(landmarks_to_array(face_landmarks), roi, image_width, image_height)
+                               for face_landmarks in results.multi_face_landmarks]
+    if not landmark_arrays:
+        with timings.stage('facemesh'):
+            results = face_mesh.process(image_rgb)
+        if results.multi_face_landmarks:
+            landmark_arrays = [landmarks_to_array(face_landmarks) for face_landmarks in results.multi_face_landmarks]
+    if landmark_arrays:
+        FACES_DETECTED.inc(len(landmark_arrays), pipeline='gaze')
+    # 瞬きと目の状態を検出
+    with timings.stage('ear_direction'):
+        eye_open, is_blinked, left_eye_direction, right_eye_direction = _analyze_face_landmarks(
+            landmark_arrays, image_width, image_height, eye_open, overlay)
+    if overlay['faces']:
+        overlay['face_box'] = landmarks_face_box(overlay['faces'][0]['landmark_point'])
+
+    # 目の状態（まばたき、目の方向）を判定
+    if is_blinked:
+        eye_direction = 'blink'
+    elif left_eye_direction == 'left' or right_eye_direction == 'left':
+        eye_direction = 'left'
+    elif left_eye_direction == 'right' or right_eye_direction == 'right':
+        eye_direction = 'right'
+    elif left_eye_direction == 'center' and right_eye_direction == 'center':
+        eye_direction = 'center'
+    overlay['eye_direction'] = eye_direction
+
+    return eye_direction, eye_open, overlay
+
+
+def render_gaze_overlay(debug_image, overlay):
+    """
+    process_gaze_frame() が返した overlay を画像に描画する関数
+
+    Parameters:
+    - debug_image: 描画先の画像（元のフレームのコピーを渡す）
+    - overlay: process_gaze_frame() が返したデバッグ表示用の情報
+
+    Returns:
+    - debug_image: 目線などを描画した画像
+    """
+    image_width, image_height = debug_image.shape[1], debug_image.shape[0]
+    for face in overlay['faces']:
+        landmark_array = face['landmark_array']
+        left_eye, right_eye = face['left_eye'], face['right_eye']
+        debug_image = draw_eye_lines(debug_image, face['landmark_point'])
+        debug_image, _ = draw_landmarks(debug_image, face['landmark_point'], True, left_eye, right_eye)
+        # 虹彩の中心と目の中心を使用して、見ている方向の矢印を描画
+        left_eye_center = tuple((landmark_array[468, :2] * (image_width, image_height)).astype(int).tolist())
+        right_eye_center = tuple((landmark_array[473, :2] * (image_width, image_height)).astype(int).tolist())
+        debug_image = draw_gaze_arrow(debug_image, left_eye_center, left_eye[0], face['left_eye_direction'], arrow_length)
+        debug_image = draw_gaze_arrow(debug_image, right_eye_center, right_eye[0], face['right_eye_direction'], arrow_length)
+    cv.putText(debug_image, f"Eye_direction: {overlay['eye_direction']}", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    return debug_image
+
+
+def get_eye_patterns(user):
+    """
+    ユーザの登録している4つの目線パターンをリストで返す。
+    """
+    return [user.eye_pattern_1, user.eye_pattern_2, user.eye_pattern_3, user.eye_pattern_4]
+
+
+class GazeSequenceMatcher:
+    """
+    フレームごとに検出した目線の方向から、登録された目線パターンとの一致を判定する状態機械。
+
+    - 目線の方向は stable_frames フレーム連続で同じ方向が検出されたときに確定する（ノイズ除去）。
+    - 確定した方向が変わったときに、次のパターンと比較して一致すれば1つ進み、一致しなければやり直す。
+    - 同じ方向を見続けた場合は repeat_interval 秒ごとにもう一度その方向を入力したとみなす
+      （「左、左」のように同じ方向が続くパターンに対応するため）。
+    - まばたきは目が開き直したフレームで1回だけ検出されるため、検出した時点で確定する。まばたきの後は、
+      まばたきの前に確定していた方向を見続けているとみなす（目を閉じている間の方向は使わず、
+      目を開き直しただけで同じ方向がもう一度入力されたことにはしない）。
+    - 続けて 'blink' が入力された場合は、間に目が開いているフレーム（方向が入力されたフレーム）が
+      あったときだけ2回目のまばたきとみなす。
+    - 顔が検出できないフレーム（方向が None）は無視する。
+    - 開始から timeout 秒経っても一致しなければ失敗とする。
+
+    状態は state() で辞書にして保存し、from_state() で復元できる（フレームAPIのセッションで使う）。
+    """
+
+    MATCHING = 'matching'
+    SUCCESS = 'success'
+    TIMEOUT = 'timeout'
+
+    def __init__(self, eye_patterns, stable_frames=None, repeat_interval=None, timeout=None, clock=time.time):
+        self.eye_patterns = list(eye_patterns)
+        self.stable_frames = stable_frames or GAZE_STABLE_FRAMES
+        self.repeat_interval = repeat_interval or GAZE_REPEAT_INTERVAL
+        self.timeout = timeout or GAZE_TIMEOUT
+        self.clock = clock
+        self.started_at = clock()
+        # 登録しているユーザの目線のパターンと何回マッチしたか
+        self.match_count = 0
+        self.status = self.MATCHING
+        self._candidate = None
+        self._candidate_frames = 0
+        self._accepted_at = None
+        # 最後に確定した方向（まばたきの後に、見続けている方向として戻す）
+        self._stable = None
+        # 前のまばたきの後に目が開いているフレームがあったか
+        self._blink_armed = True
+
+    def state(self):
+        return {
+            'started_at': self.started_at,
+            'match_count': self.match_count,
+            'status': self.status,
+            'candidate': self._candidate,
+            'candidate_frames': self._candidate_frames,
+            'accepted_at': self._accepted_at,
+            'stable': self._stable,
+            'blink_armed': self._blink_armed,
+        }
+
+    @classmethod
+    def from_state(cls, eye_patterns, state, **kwargs):
+        matcher = cls(eye_patterns, **kwargs)
+        matcher.started_at = state['started_at']
+        matcher.match_count = state['match_count']
+        matcher.status = state['status']
+        matcher._candidate = state['candidate']
+        matcher._candidate_frames = state['candidate_frames']
+        matcher._accepted_at = state['accepted_at']
+        matcher._stable = state.get('stable')
+        matcher._blink_armed = state.get('blink_armed', True)
+        return matcher
+
+    def update(self, eye_direction):
+        """
+        1フレーム分の目線の方向を入力して状態を進める。
+
+        Returns:
+        - 'matching'（判定中）, 'success'（全パターン一致）, 'timeout'（時間切れ）のいずれか
+        """
+        if self.status != self.MATCHING:
+            return self.status
+        now = self.clock()
+        if now - self.started_at > self.timeout:
+            self.status = self.TIMEOUT
+            GAZE_RESULTS.inc(result=self.TIMEOUT)
+            return self.status
+        if eye_direction is None:
+            return self.status
+
+        if eye_direction == 'blink':
+            if not self._blink_armed:
+                # 目が開き直す前の2回目の 'blink' は同じまばたきとみなす
+                return self.status
+            self._blink_armed = False
+            self._accept('blink', now)
+            # まばたきの前に確定していた方向を見続けているとみなし、別の方向に変わったときだけ次の入力にする
+            self._candidate = self._stable
+            self._candidate_frames = self.stable_frames if self._stable is not None else 0
+            return self.status
+
+        self._blink_armed = True
+        if eye_direction != self._candidate:
+            self._candidate = eye_direction
+            self._candidate_frames = 1
+            self._accepted_at = None
+            if self.stable_frames <= 1:
+                self._accept(eye_direction, now)
+        else:
+            self._candidate_frames += 1
+            if self._candidate_frames == self.stable_frames:
+                # 方向が安定した（新しい方向への遷移）
+                self._accept(eye_direction, now)
+            elif self._accepted_at is not None and now - self._accepted_at >= self.repeat_interval:
+                # 同じ方向を見続けている
+                self._accept(eye_direction, now)
+        return self.status
+
+    def _accept(self, eye_direction, now):
+        self._accepted_at = now
+        if eye_direction != 'blink':
+            self._stable = eye_direction
+        if eye_direction == self.eye_patterns[self.match_count]:
+            self.match_count += 1
+            GAZE_STEPS_MATCHED.inc()
         else:
-            eye_direction == 'None'
-            cv.putText(debug_image, f"Eye_direction: None", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
-
-        # match_countの回数に応じて、Userの登録している認証情報とマッチしているかを確かめる。
-        if match_count == 0:
-            if eye_direction == user.eye_pattern_1:
-                match_count += 1
-            else:
-                match_count = 0
-        elif match_count == 1:
-            if eye_direction == user.eye_pattern_2:
-                match_count += 1
-            else:
-                match_count = 0
-        elif match_count == 2:
-            if eye_direction == user.eye_pattern_3:
-                match_count += 1
-            else:
-                match_count = 0
-        elif match_count == 3:
-            if eye_direction == user.eye_pattern_4:
-                match_count += 1
-                cv.putText(debug_image, f"Success", (50, 50), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                return True
-            else:
-                match_count = 0
-
-        # 画像を表示
-        cv.imshow('Eye Direction and Blink Detection', debug_image)
-
-        # 'q'キーで終了
-        if cv.waitKey(10) & 0xFF == ord('q'):
-            break
-        time.sleep(0.8)  # 0.8秒遅延
-
-    cap.release()
-    return False
+            # 一致しなければやり直す（入力した方向が1つ目のパターンと一致すればそこから数える）
+            self.match_count = 1 if eye_direction == self.eye_patterns[0] else 0
+        if self.match_count == len(self.eye_patterns):
+            self.status = self.SUCCESS
+            GAZE_RESULTS.inc(result=self.SUCCESS)
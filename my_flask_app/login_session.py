@@ -0,0 +1,187 @@
+import os
+import time
+from contextlib import ExitStack
+import cv2
+from debug_sink import HEADLESS, create_debug_sink
+from face_recognition_utils import recognize_face_in_frame, render_face_overlay
+from frame_source import open_frame_source
+from gaze_recognition_utils import (
+    FACE_MESH_POOL_TIMEOUT,
+    face_mesh_pool,
+    get_eye_patterns,
+    process_gaze_frame,
+    render_gaze_overlay,
+    GazeSequenceMatcher,
+)
+from metrics import LOGIN_DECISION_SECONDS
+
+# 顔認証の段階の制限時間（秒）。この時間内に登録済みの顔が見つからなければ失敗にする
+FACE_TIMEOUT = float(os.environ.get('FACE_TIMEOUT', '30'))
+
+
+class LoginSession:
+    """
+    1つのキャプチャと1つのフレームのループで、顔認証と目線認証を続けて行うログインセッション。
+
+    カメラは最初に1回だけ開き、顔認証で本人を確認した後も同じカメラのフレームで目線認証を続ける。
+    各フレームの BGR→RGB 変換は1回だけ行い、顔検出と FaceMesh で同じ RGB 画像を使う。
+    顔認証で一致した顔の位置は face_box に保持し、目線認証では顔の周りだけを FaceMesh に渡す（ROI モード）。
+
+    決定までの時間（time_to_decision）と顔認証にかかった時間（face_seconds）は入力元の時刻で計測する
+    （カメラでは実時間、録画では映像内の時間）。
+
+    使用例:
+        session = LoginSession(gallery, lambda name: User.query.filter_by(username=name).first())
+        user = session.run()
+        session.stage, session.time_to_decision
+
+    Args:
+        gallery (FaceGallery): 登録済みユーザーの顔特徴量を保持したギャラリー。
+        lookup_user (callable): 一致したユーザー名から User を返す関数（見つからない場合は None）。
+        source: フレームの入力元（open_frame_source に渡せるもの）。省略時は FRAME_SOURCE。
+        face_timeout (float): 顔認証の段階の制限時間（秒）。省略時は FACE_TIMEOUT。
+        gaze_timeout (float): 目線認証の段階の制限時間（秒）。省略時は GAZE_TIMEOUT。
+        headless (bool): True の場合は画面表示を行わない。
+        debug_sink (DebugSink): 描画したフレームを別スレッドで保存する（省略時は DEBUG_FRAME_DIR の設定に従う）。
+    """
+
+    FACE = 'face'
+    GAZE = 'gaze'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    # FaceMesh のインスタンスがすべて使用中で、目線認証を始められなかった場合の failed_stage
+    BUSY = 'busy'
+
+    def __init__(self, gallery, lookup_user, source=None, face_timeout=None, gaze_timeout=None,
+                 headless=HEADLESS, debug_sink=None):
+        self.gallery = gallery
+        self.lookup_user = lookup_user
+        self.source = source
+        self.face_timeout = FACE_TIMEOUT if face_timeout is None else face_timeout
+        self.gaze_timeout = gaze_timeout
+        self.headless = headless
+        self.debug_sink = debug_sink
+        self.stage = self.FACE
+        # 失敗した段階（'face'、'gaze'、または混雑で目線認証を始められなかった場合は 'busy'）
+        self.failed_stage = None
+        self.user = None
+        self.face_box = None
+        self.frames = 0
+        self.face_seconds = None
+        self.time_to_decision = None
+        self._eye_open = True
+        self._matcher = None
+        # run() では入力元の時刻に置き換える
+        self._clock = time.time
+        self._started_at = None
+
+    @property
+    def decided(self):
+        return self.stage in (self.SUCCESS, self.FAILED)
+
+    def run(self):
+        """
+        入力元を開き、成功・失敗が決まるまでフレームを処理する。
+
+        Returns:
+            User: 顔認証と目線認証の両方に成功したユーザー（失敗時は None）。
+        """
+        if len(self.gallery) == 0:
+            print("Error: No registered face encodings.")
+            self._decide(self.FAILED)
+            return None
+
+        cap = open_frame_source(self.source)
+        owns_source = cap is not self.source
+        debug_sink = self.debug_sink if self.debug_sink is not None else create_debug_sink('login')
+        try:
+            if not cap.isOpened():
+                print("Error: Unable to open the frame source.")
+                self._decide(self.FAILED)
+                return None
+            self._clock = cap.clock
+            self._started_at = self._clock()
+            with ExitStack() as stack:
+                face_mesh = None
+                while not self.decided:
+                    ret, frame = cap.read()
+                    if not ret:
+                        print("Error: No more frames from the frame source.")
+                        self._decide(self.FAILED)
+                        break
+                    if self.stage == self.GAZE and face_mesh is None:
+                        # 目線認証の間だけ FaceMesh のインスタンスを借りる
+                        try:
+                            face_mesh = stack.enter_context(face_mesh_pool.checkout(FACE_MESH_POOL_TIMEOUT))
+                        except TimeoutError as e:
+                            print(f"Error: {e}")
+                            self._decide(self.FAILED, failed_stage=self.BUSY)
+                            break
+                    overlay = self.process(frame, face_mesh, debug=debug_sink is not None or not self.headless)
+                    if overlay is not None:
+                        render, args = overlay
+                        if debug_sink is not None:
+                            debug_sink.submit(frame, render, *args)
+                        if not self.headless:
+                            cv2.imshow('Face Login', render(frame.copy(), *args))
+                            # 'q'キーで終了
+                            if cv2.waitKey(1) & 0xFF == ord('q'):
+                                self._decide(self.FAILED)
+        finally:
+            if owns_source:
+                cap.release()
+            if debug_sink is not None:
+                debug_sink.close()
+            if not self.headless:
+                cv2.destroyAllWindows()
+        return self.user if self.stage == self.SUCCESS else None
+
+    def process(self, frame, face_mesh=None, debug=False):
+        """
+        1フレーム分の処理を行い、段階を進める。目線認証の段階では face_mesh が必要。
+
+        Returns:
+            tuple: debug が True の場合は描画用の (描画関数, 引数)。それ以外は None。
+        """
+        if self.decided:
+            return None
+        now = self._clock()
+        if self._started_at is None:
+            self._started_at = now
+        self.frames += 1
+        # 顔検出と FaceMesh の両方で使う RGB 画像（変換は1回だけ）
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+        if self.stage == self.FACE:
+            face_overlay = []
+            recognized_name = recognize_face_in_frame(frame, self.gallery, face_overlay, rgb_frame=rgb_frame)
+            user = self.lookup_user(recognized_name) if recognized_name is not None else None
+            if user is not None:
+                self.user = user
+                self.face_box = next(location for location, name in face_overlay if name == recognized_name)
+                self.face_seconds = now - self._started_at
+                self._matcher = GazeSequenceMatcher(get_eye_patterns(user), timeout=self.gaze_timeout,
+                                                    clock=self._clock)
+                self.stage = self.GAZE
+            elif now - self._started_at > self.face_timeout:
+                self._decide(self.FAILED)
+            return (render_face_overlay, (face_overlay,)) if debug else None
+
+        # 顔認証で見つけた顔の周り（以降は前のフレームのランドマークの周り）だけを FaceMesh に渡す
+        eye_direction, self._eye_open, gaze_overlay = process_gaze_frame(
+            frame, self._eye_open, face_mesh, image_rgb=rgb_frame, face_box=self.face_box)
+        self.face_box = gaze_overlay.get('face_box')
+        status = self._matcher.update(eye_direction)
+        if status == GazeSequenceMatcher.SUCCESS:
+            self._decide(self.SUCCESS)
+        elif status == GazeSequenceMatcher.TIMEOUT:
+            self._decide(self.FAILED)
+        return (render_gaze_overlay, (gaze_overlay,)) if debug else None
+
+    def _decide(self, stage, failed_stage=None):
+        if stage == self.FAILED:
+            self.failed_stage = failed_stage or self.stage
+        self.stage = stage
+        if self._started_at is not None:
+            self.time_to_decision = self._clock() - self._started_at
+            LOGIN_DECISION_SECONDS.observe(self.time_to_decision, outcome=stage)
@@ -0,0 +1,181 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 処理時間のヒストグラムの区切り（秒）
+DEFAULT_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 顔特徴量の距離のヒストグラムの区切り（0.40 未満が一致）
+DISTANCE_BUCKETS = (0.2, 0.3, 0.35, 0.4, 0.45, 0.5, 0.6, 0.7, 0.8, 1.0)
+
+_registry = []
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Prometheus のテキスト形式で出力できる計測値の基底クラス。
+
+    ラベルの値の組ごとに値を持つ。更新はロックを1回取るだけなので、常に有効にしておける。
+    callback を指定した場合は、出力するたびに callback() が返す {ラベルの値の組: 値} を使う
+    （他のオブジェクトが数えている値をそのまま出力する場合）。
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        if self.callback is not None:
+            values = self.callback()
+            with self._lock:
+                self._values = dict(values)
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """増える一方の回数。"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """現在の値。"""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """値の分布（区切りごとの累積回数、合計、回数）。"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 区切りごとの回数（最後は +Inf）、合計、回数
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class StageTimer:
+    """
+    StageTimings と同じ stage() を持ち、段階ごとの処理時間をヒストグラムに記録する。
+
+    フレームごとの値は残さず、ワーカープロセス全体の分布として /metrics に出力する
+    （フレームごとの値が必要な場合は stage_timer.StageTimings を使う）。
+    """
+
+    def __init__(self, histogram, pipeline):
+        self.histogram = histogram
+        self.pipeline = pipeline
+
+    def stage(self, name):
+        return self.histogram.time(pipeline=self.pipeline, stage=name)
+
+
+def render():
+    """
+    登録されているすべての計測値を Prometheus のテキスト形式で返す。
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# アプリ全体で使う計測値
+FRAMES_PROCESSED = Counter(
+    'face_login_frames_processed_total', 'Frames processed by each pipeline.', ['pipeline'])
+FACES_DETECTED = Counter(
+    'face_login_faces_detected_total', 'Faces detected in processed frames.', ['pipeline'])
+FACES_REJECTED = Counter(
+    'face_login_faces_rejected_total', 'Detected faces skipped by the quality gate before encoding.',
+    ['pipeline', 'reason'])
+STAGE_SECONDS = Histogram(
+    'face_login_stage_seconds', 'Time spent in each processing stage.', ['pipeline', 'stage'])
+MATCH_DISTANCE = Histogram(
+    'face_login_match_distance', 'Distance to the nearest enrolled face.', buckets=DISTANCE_BUCKETS)
+GAZE_STEPS_MATCHED = Counter(
+    'face_login_gaze_steps_matched_total', 'Eye pattern steps matched during gaze authentication.')
+GAZE_RESULTS = Counter(
+    'face_login_gaze_results_total', 'Finished gaze authentications by result.', ['result'])
+LOGIN_OUTCOMES = Counter(
+    'face_login_outcomes_total', 'Login attempts by method and outcome.', ['method', 'outcome'])
+LOGIN_DECISION_SECONDS = Histogram(
+    'face_login_time_to_decision_seconds', 'Time from opening the camera to a login decision.', ['outcome'],
+    buckets=(0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0))
+REQUEST_SECONDS = Histogram(
+    'face_login_request_seconds', 'Time spent handling each endpoint.', ['endpoint'])
+GALLERY_LOAD_SECONDS = Histogram(
+    'face_login_gallery_load_seconds', 'Time spent loading face encodings from the database.')
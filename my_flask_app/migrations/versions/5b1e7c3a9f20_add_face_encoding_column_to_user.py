@@ -0,0 +1,26 @@
+"""Add face_encoding column to user
+
+Revision ID: 5b1e7c3a9f20
+Revises: d085ba610dae
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7c3a9f20'
+down_revision = 'd085ba610dae'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('face_encoding', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('face_encoding')
@@ -0,0 +1,34 @@
+"""Add face_login_attempt table
+
+Revision ID: 9c4d2e6b1a73
+Revises: 5b1e7c3a9f20
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4d2e6b1a73'
+down_revision = '5b1e7c3a9f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('face_login_attempt',
+    sa.Column('nonce', sa.String(length=64), nullable=False),
+    sa.Column('stage', sa.String(length=16), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('gaze', sa.JSON(), nullable=True),
+    sa.Column('eye_open', sa.Boolean(), nullable=False),
+    sa.Column('face_box', sa.JSON(), nullable=True),
+    sa.Column('started_at', sa.Float(), nullable=False),
+    sa.Column('stage_started_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('nonce')
+    )
+
+
+def downgrade():
+    op.drop_table('face_login_attempt')
@@ -0,0 +1,79 @@
+import importlib
+import threading
+import time
+import numpy as np
+from metrics import Gauge
+
+# 読み込みに時間のかかるライブラリ。face_recognition は import 時に dlib のモデルを読み込み、
+# mediapipe は import 時に多数のモジュールを読み込む
+_lock = threading.Lock()
+_modules = {}
+
+MODEL_LOAD_SECONDS = Gauge(
+    'face_login_model_load_seconds', 'Time spent loading each model library.', ['model'])
+WARM_UP_SECONDS = Gauge(
+    'face_login_warm_up_seconds', 'Time spent running the dummy frame through every model.')
+
+
+def _load(name):
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(name)
+                MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=name)
+                _modules[name] = module
+    return module
+
+
+def face_recognition():
+    """
+    face_recognition モジュールを返す。初回の呼び出し時に import し、dlib のモデルを読み込む。
+
+    使用例:
+        face_locations = face_recognition().face_locations(rgb_frame)
+    """
+    return _load('face_recognition')
+
+
+def mediapipe_face_mesh():
+    """
+    mediapipe の FaceMesh のモジュール（mp.solutions.face_mesh）を返す。初回の呼び出し時に import する。
+    """
+    return _load('mediapipe').solutions.face_mesh
+
+
+def loaded_models():
+    """読み込み済みのライブラリの名前の一覧。"""
+    return sorted(_modules)
+
+
+def warm_up(image=None):
+    """
+    ダミーのフレームを顔検出・エンコード・FaceMesh に1回ずつ通して、モデルの読み込みと初回の処理を済ませる。
+
+    ワーカーがリクエストを受け付ける前に呼ぶと、最初のログインで読み込みの時間を待たせずに済む。
+    FaceMesh はプールの上限までインスタンスを作成する。
+
+    Returns:
+        float: かかった秒数。
+    """
+    # 循環 import を避けるため、ここで import する
+    from face_recognition_utils import detect_faces
+    from gaze_recognition_utils import face_mesh_pool, static_face_mesh_pool
+
+    start = time.perf_counter()
+    if image is None:
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+    rgb_image = np.ascontiguousarray(image[:, :, ::-1])
+    detect_faces(rgb_image)
+    # 顔が写っていない画像でもエンコードを実行するため、画像全体を顔の位置として渡す
+    height, width = rgb_image.shape[:2]
+    face_recognition().face_encodings(rgb_image, [(0, width, height, 0)])
+    face_mesh_pool.warm_up(rgb_image)
+    static_face_mesh_pool.warm_up(rgb_image)
+    elapsed = time.perf_counter() - start
+    WARM_UP_SECONDS.set(elapsed)
+    return elapsed
@@ -0,0 +1,29 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimings:
+    """
+    1フレーム分の処理を段階（検出、エンコード、照合など）ごとに計測する。
+
+    計測した時間は呼び出し元がフレームごとに受け取る（ベンチマークの p50/p95 やストリームの結果に使う）。
+    /metrics のヒストグラムに記録する場合は metrics.StageTimer を使う（stage() は同じなので、
+    処理の関数はどちらを渡されても同じように使える）。
+
+    使用例:
+        timings = StageTimings()
+        with timings.stage('detect'):
+            face_locations = detect_faces(rgb_frame)
+        timings.durations  # {'detect': 0.012}
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
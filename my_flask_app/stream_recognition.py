@@ -0,0 +1,340 @@
+import collections
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from face_gallery import FaceGallery, ENCODING_DIM, FACE_MATCH_THRESHOLD
+from face_quality import count_rejections, partition_face_locations
+from face_recognition_utils import detect_faces
+from frame_ring import SharedFrameRing
+from frame_source import open_frame_source
+from metrics import FRAMES_PROCESSED, FACES_DETECTED, STAGE_SECONDS
+from model_loader import face_recognition
+from stage_timer import StageTimings
+
+# 止まったカメラやストリームを開き直すまでの待ち時間（秒）。開けなかった場合は倍にしていく
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+# ワーカープロセスごとに1つだけ保持する、共有メモリ上のギャラリー
+_worker_gallery = None
+_worker_shm = None
+# ワーカープロセスが接続済みのフレームのリング（共有メモリの名前ごと）
+_worker_rings = {}
+
+
+def _init_worker(shm_name, ids, names):
+    global _worker_gallery, _worker_shm
+    # Ctrl+C は親プロセスで受けて、処理中のフレームを終えてから止める
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    encodings = np.ndarray((len(ids), ENCODING_DIM), dtype=np.float32, buffer=_worker_shm.buf)
+    encodings.flags.writeable = False
+    _worker_gallery = FaceGallery.from_arrays(ids, names, encodings)
+    # 最初のフレームを待たせないよう、dlib のモデルはワーカーの起動時に読み込む
+    face_recognition()
+
+
+def _worker_ring(descriptor):
+    ring = _worker_rings.get(descriptor[0])
+    if ring is None:
+        ring = _worker_rings[descriptor[0]] = SharedFrameRing.attach(descriptor)
+    return ring
+
+
+def recognize_stream_frame(ring_descriptor, slot, seq, threshold=FACE_MATCH_THRESHOLD):
+    """
+    共有メモリのスロットにあるフレームの顔検出・エンコード・照合を行う（プロセスプールのワーカーで実行する）。
+
+    フレームはコピーせずに、書き込み時に変換済みの RGB のビューをそのまま使う。
+    ワーカーのプロセスで記録した計測値は親プロセスの /metrics に届かないため、検出した顔の数、
+    品質の判定で除外した理由、段階ごとの処理時間は結果として返し、親プロセスで記録する。
+
+    Returns:
+        tuple: (faces, 検出した顔の数, 除外した理由のリスト, 段階ごとの処理時間の辞書)。
+            faces は判定を通った顔ごとの (顔の位置, user_id, ユーザー名, 距離)。一致しない顔は user_id と名前が None。
+    """
+    ring = _worker_ring(ring_descriptor)
+    if not ring.is_current(slot, seq):
+        raise RuntimeError(f"Frame slot {slot} was overwritten before it was processed.")
+    rgb_frame = ring.rgb(slot)
+    timings = StageTimings()
+    with timings.stage('detect'):
+        face_locations = detect_faces(rgb_frame)
+    detected = len(face_locations)
+    with timings.stage('quality'):
+        face_locations, rejections = partition_face_locations(rgb_frame, face_locations)
+    faces = []
+    if face_locations:
+        with timings.stage('encode'):
+            face_encodings = face_recognition().face_encodings(rgb_frame, face_locations)
+        # 検出したすべての顔を1回の行列演算で照合する
+        with timings.stage('match'):
+            matches = _worker_gallery.match_batch(face_encodings, threshold)
+        for location, (user_id, name, distance) in zip(face_locations, matches):
+            faces.append((tuple(location), user_id, name, distance))
+    if not ring.is_current(slot, seq):
+        raise RuntimeError(f"Frame slot {slot} was overwritten while it was processed.")
+    return faces, detected, rejections, timings.durations
+
+
+class StreamStats:
+    """
+    入力元ごとの集計値。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames_submitted = 0
+        self.frames_processed = 0
+        self.errors = 0
+        self.stalls = 0
+        self.reconnects = 0
+        self.faces_detected = 0
+        self.faces_recognized = 0
+        self.latency_seconds_total = 0.0
+        self.recognized = {}
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'frames_submitted': self.frames_submitted,
+            'frames_processed': self.frames_processed,
+            'errors': self.errors,
+            'stalls': self.stalls,
+            'reconnects': self.reconnects,
+            'faces_detected': self.faces_detected,
+            'faces_recognized': self.faces_recognized,
+            'latency_seconds_mean': (self.latency_seconds_total / self.frames_processed
+                                     if self.frames_processed else 0.0),
+            'recognized': dict(self.recognized),
+        }
+
+
+class _Stream:
+    def __init__(self, name, spec, source):
+        self.name = name
+        # 開き直すときに使う入力元の指定
+        self.spec = spec
+        self.source = source
+        # 開き直す前の入力元で捨てたフレーム数
+        self.dropped_before = 0
+        self.stats = StreamStats(name)
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.frame_index = 0
+        # 最初のフレームの大きさで作る、max_in_flight 個のスロットを持つリング
+        self.ring = None
+        self.free_slots = collections.deque()
+
+
+class StreamRecognitionServer:
+    """
+    複数の入力元（カメラ、動画ファイルなど）のフレームをプロセスプールに振り分けて顔認証を行う。
+
+    ギャラリーの顔特徴量は共有メモリに1つだけ置き、各ワーカーは読み取り専用で参照する。
+    フレームも入力元ごとの SharedFrameRing に書き込み、ワーカーにはスロット番号だけを送る。
+    入力元ごとに処理中のフレーム数を max_in_flight までに制限するため、処理の遅い入力元や
+    フレームの多い入力元がプールを占有して他の入力元を待たせることがない。処理中のフレームが
+    上限に達している間は次のフレームを読まないので、カメラでは ThreadedFrameSource が古いフレームを
+    捨てて最新のフレームを渡し、動画ファイルではフレームを捨てずに待つ。
+
+    カメラやストリームからフレームが一時的に届かない場合（stalls）は読み続け、取り込みが止まった場合は
+    間隔を延ばしながら開き直す（reconnects）。入力元の処理を終えるのは、動画ファイル・画像ディレクトリの
+    終わりと stop() のときだけ。
+
+    使用例:
+        server = StreamRecognitionServer(gallery, ['0', 'rtsp://camera2/stream', 'recorded.mp4'])
+        server.run()
+
+    Args:
+        gallery (FaceGallery): 照合に使うギャラリー（開始時点の内容を共有する）。
+        sources (list): 入力元の指定（open_frame_source に渡せるもの）のリスト。
+        workers (int): ワーカープロセス数（省略時は CPU のコア数）。
+        max_in_flight (int): 入力元ごとに同時に処理するフレーム数の上限。
+        threshold (float): 同一人物と判定する距離の閾値。
+        on_result (callable): フレームの処理が終わるたびに on_result(入力元の名前, フレーム番号, faces) を呼ぶ
+            （結果を受け取るスレッドで呼ばれるため、時間のかかる処理は行わない）。
+    """
+
+    def __init__(self, gallery, sources, workers=None, max_in_flight=2, threshold=FACE_MATCH_THRESHOLD,
+                 on_result=None):
+        self.gallery = gallery
+        self.sources = list(sources)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_in_flight = max(1, max_in_flight)
+        self.threshold = threshold
+        self.on_result = on_result
+        self._streams = []
+        self._stopping = threading.Event()
+        self._started_at = None
+
+    def stop(self):
+        self._stopping.set()
+        for stream in self._streams:
+            with stream.cond:
+                stream.cond.notify_all()
+
+    def stats(self):
+        """
+        入力元ごとの集計値と全体の処理速度を返す。
+        """
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        streams = []
+        for stream in self._streams:
+            with stream.cond:
+                stats = stream.stats.as_dict()
+            stats['frames_dropped'] = stream.dropped_before + stream.source.dropped_frames
+            stats['fps'] = stats['frames_processed'] / elapsed if elapsed > 0 else 0.0
+            streams.append(stats)
+        processed = sum(stats['frames_processed'] for stats in streams)
+        return {
+            'workers': self.workers,
+            'elapsed_seconds': elapsed,
+            'frames_processed': processed,
+            'fps': processed / elapsed if elapsed > 0 else 0.0,
+            'streams': streams,
+        }
+
+    def run(self, report_interval=None, report=None):
+        """
+        すべての入力元のフレームがなくなるか stop() が呼ばれるまで顔認証を行う。
+
+        Args:
+            report_interval (float): 指定した場合、この秒数ごとに report(stats()) を呼ぶ。
+            report (callable): 集計値を受け取る関数。
+
+        Returns:
+            dict: 終了時の stats()。
+        """
+        encodings = np.ascontiguousarray(self.gallery.encodings, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, encodings.nbytes))
+        try:
+            np.ndarray(encodings.shape, dtype=np.float32, buffer=shm.buf)[:] = encodings
+            self._streams = [_Stream(str(source), source, open_frame_source(source)) for source in self.sources]
+            self._started_at = time.monotonic()
+            pool = multiprocessing.Pool(
+                self.workers, initializer=_init_worker,
+                initargs=(shm.name, self.gallery.ids.tolist(), self.gallery.names.tolist()))
+            try:
+                readers = [threading.Thread(target=self._read_loop, args=(pool, stream), daemon=True)
+                           for stream in self._streams]
+                for reader in readers:
+                    reader.start()
+                next_report = time.monotonic() + report_interval if report_interval else None
+                try:
+                    while any(reader.is_alive() for reader in readers):
+                        time.sleep(0.2)
+                        if next_report is not None and time.monotonic() >= next_report and report is not None:
+                            report(self.stats())
+                            next_report += report_interval
+                except KeyboardInterrupt:
+                    self.stop()
+                for reader in readers:
+                    reader.join()
+                # 処理中のフレームの結果を待つ
+                pool.close()
+                pool.join()
+            finally:
+                pool.terminate()
+                for stream in self._streams:
+                    stream.source.release()
+                    if stream.ring is not None:
+                        stream.ring.close()
+                        stream.ring.unlink()
+            return self.stats()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _read_loop(self, pool, stream):
+        while not self._stopping.is_set():
+            # 処理中のフレームが上限に達している間は次のフレームを読まない
+            with stream.cond:
+                stream.cond.wait_for(lambda: stream.in_flight < self.max_in_flight or self._stopping.is_set())
+                if self._stopping.is_set():
+                    break
+            ret, frame = stream.source.read()
+            if not ret:
+                if not stream.source.ended():
+                    # カメラやストリームからフレームが一時的に届かなかっただけなので、読み続ける
+                    with stream.cond:
+                        stream.stats.stalls += 1
+                    continue
+                if not stream.source.live or not self._reopen(stream):
+                    # 動画ファイル・画像ディレクトリの終わり、または stop() による停止
+                    break
+                continue
+            if stream.ring is None:
+                stream.ring = SharedFrameRing.create(self.max_in_flight, frame.shape[0], frame.shape[1])
+                stream.free_slots.extend(range(self.max_in_flight))
+            with stream.cond:
+                # 処理中のフレーム数が上限未満なので、空いているスロットが必ずある
+                slot = stream.free_slots.popleft()
+                stream.in_flight += 1
+                stream.stats.frames_submitted += 1
+                frame_index = stream.frame_index
+                stream.frame_index += 1
+            # BGR のフレームと RGB に変換したフレームを共有メモリに書き込み、ワーカーにはスロット番号だけを送る
+            seq = stream.ring.write(slot, frame)
+            submitted_at = time.monotonic()
+            pool.apply_async(
+                recognize_stream_frame, (stream.ring.descriptor, slot, seq, self.threshold),
+                callback=lambda result, i=frame_index, t=submitted_at, s=slot: self._on_done(stream, s, i, t, result),
+                error_callback=lambda error, s=slot: self._on_error(stream, s, error))
+
+    def _reopen(self, stream):
+        """
+        止まったカメラやストリームを、開けるまで間隔を延ばしながら開き直す。
+
+        Returns:
+            bool: 開き直せた場合は True。stop() が呼ばれた場合は False。
+        """
+        delay = RECONNECT_MIN_DELAY
+        while not self._stopping.is_set():
+            print(f"Frame source {stream.name} stopped. Reopening in {delay:.0f}s.")
+            if self._stopping.wait(delay):
+                break
+            with stream.cond:
+                stream.dropped_before += stream.source.dropped_frames
+            stream.source.release()
+            stream.source = open_frame_source(stream.spec)
+            if stream.source.isOpened():
+                with stream.cond:
+                    stream.stats.reconnects += 1
+                print(f"Frame source {stream.name} reopened.")
+                return True
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return False
+
+    def _on_done(self, stream, slot, frame_index, submitted_at, result):
+        faces, detected, rejections, durations = result
+        FRAMES_PROCESSED.inc(pipeline='stream')
+        FACES_DETECTED.inc(detected, pipeline='stream')
+        count_rejections(rejections, 'stream')
+        for stage, seconds in durations.items():
+            STAGE_SECONDS.observe(seconds, pipeline='stream', stage=stage)
+        with stream.cond:
+            stats = stream.stats
+            stats.frames_processed += 1
+            stats.latency_seconds_total += time.monotonic() - submitted_at
+            stats.faces_detected += len(faces)
+            for _, _, name, _ in faces:
+                if name is not None:
+                    stats.faces_recognized += 1
+                    stats.recognized[name] = stats.recognized.get(name, 0) + 1
+            stream.free_slots.append(slot)
+            stream.in_flight -= 1
+            stream.cond.notify_all()
+        if self.on_result is not None:
+            self.on_result(stream.name, frame_index, faces)
+
+    def _on_error(self, stream, slot, error):
+        with stream.cond:
+            stream.stats.errors += 1
+            stream.free_slots.append(slot)
+            stream.in_flight -= 1
+            stream.cond.notify_all()
+        print(f"Error processing frame from {stream.name}: {error}")
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# テストは my_flask_app のモジュールをそのまま import する（benchmarks と同じ）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# app.py を import する前に、メモリ上のDBと存在しないスナップショットファイルを使うように設定する
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('FACE_GALLERY_SNAPSHOT', os.path.join(tempfile.mkdtemp(prefix='face-login-tests-'),
+                                                            'gallery.snapshot'))
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    """
+    テスト用に設定した app.py のモジュール。DBはテストごとに作り直し、instance と
+    アップロード先（カレントディレクトリからの相対パス）は tmp_path を使う。
+    """
+    import app as app_module
+    from face_index import create_index
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app_module.app, 'instance_path', str(tmp_path / 'instance'))
+    monkeypatch.setitem(app_module.app.config, 'TESTING', True)
+    monkeypatch.setitem(app_module.app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setattr(app_module, 'face_gallery', create_index(app_module.app.config['FACE_INDEX']))
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        yield app_module
+        app_module.db.session.remove()
+        app_module.db.drop_all()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def add_user(app_module, username='alice', eye_patterns=('left', 'right', 'center', 'blink'), encoding=None):
+    from face_recognition_utils import encoding_to_bytes
+    from werkzeug.security import generate_password_hash
+
+    user = app_module.User(username=username, password=generate_password_hash('password'))
+    user.eye_pattern_1, user.eye_pattern_2, user.eye_pattern_3, user.eye_pattern_4 = eye_patterns
+    if encoding is not None:
+        user.face_image = f"{username}.jpg"
+        user.face_encoding = encoding_to_bytes(encoding)
+    app_module.db.session.add(user)
+    app_module.db.session.commit()
+    return user
+
+
+def log_in(client, user):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
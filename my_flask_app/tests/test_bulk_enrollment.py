@@ -0,0 +1,73 @@
+import os
+import pytest
+from sqlalchemy.exc import IntegrityError
+from bulk_enrollment import validate_enrollment_jobs
+
+
+def job(username, password=None):
+    return {'username': username, 'face_image': f"{username}.jpg", 'password': password, 'eye_patterns': None}
+
+
+def errors(invalid):
+    return {entry['username']: error for entry, error in invalid}
+
+
+def test_validate_accepts_registration_form_values():
+    valid, invalid = validate_enrollment_jobs([job('alice'), job('bob_smith', 'password123')])
+    assert [entry['username'] for entry in valid] == ['alice', 'bob_smith']
+    assert invalid == []
+
+
+@pytest.mark.parametrize('username', ['', '    ', ' alice', 'alice ', 'abc', 'a' * 16])
+def test_validate_rejects_bad_usernames(username):
+    valid, invalid = validate_enrollment_jobs([job(username)])
+    assert valid == []
+    assert len(invalid) == 1
+
+
+@pytest.mark.parametrize('password', ['short', 'p' * 81])
+def test_validate_rejects_bad_passwords(password):
+    valid, invalid = validate_enrollment_jobs([job('alice', password)])
+    assert valid == []
+    assert 'Password' in invalid[0][1]
+
+
+def test_validate_rejects_case_duplicates_in_list():
+    valid, invalid = validate_enrollment_jobs([job('alice'), job('Alice'), job('ALICE')])
+    assert [entry['username'] for entry in valid] == ['alice']
+    assert [entry['username'] for entry, _ in invalid] == ['Alice', 'ALICE']
+
+
+def test_validate_rejects_case_variant_of_existing_user():
+    valid, invalid = validate_enrollment_jobs([job('alice'), job('Bobby')], existing_usernames=['alice', 'bobby'])
+    # 既存のユーザーと同じユーザー名は更新として受け付ける
+    assert [entry['username'] for entry in valid] == ['alice']
+    assert 'bobby' in errors(invalid)['Bobby']
+
+
+def test_save_batch_copies_images_after_commit(app_module, tmp_path):
+    source = tmp_path / 'carol.jpg'
+    source.write_bytes(b'jpeg')
+    upload_folder = tmp_path / 'uploads'
+    upload_folder.mkdir()
+
+    assert app_module.save_enrollment_batch([(job('carol') | {'face_image': str(source)}, b'enc')],
+                                            str(upload_folder)) == 1
+    user = app_module.User.query.filter_by(username='carol').first()
+    assert user.face_encoding == b'enc'
+    assert os.path.exists(user.face_image)
+
+
+def test_save_batch_failed_commit_leaves_no_files(app_module, tmp_path, monkeypatch):
+    source = tmp_path / 'dave.jpg'
+    source.write_bytes(b'jpeg')
+    upload_folder = tmp_path / 'uploads'
+    upload_folder.mkdir()
+
+    def failing_commit():
+        raise IntegrityError('commit', {}, Exception('conflict'))
+
+    monkeypatch.setattr(app_module.db.session, 'commit', failing_commit)
+    with pytest.raises(IntegrityError):
+        app_module.save_enrollment_batch([(job('dave') | {'face_image': str(source)}, b'enc')], str(upload_folder))
+    assert os.listdir(upload_folder) == []
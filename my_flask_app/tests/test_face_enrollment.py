@@ -0,0 +1,69 @@
+import io
+import os
+import numpy as np
+import pytest
+from conftest import add_user, log_in
+from face_gallery import ENCODING_DIM
+from face_recognition_utils import encoding_to_bytes, bytes_to_encoding
+
+UPLOAD_FOLDER = os.path.join('static', 'uploads', 'faces')
+
+
+def test_encoding_round_trip():
+    encoding = np.random.default_rng(0).normal(0.0, 0.1, ENCODING_DIM)
+    data = encoding_to_bytes(encoding)
+    assert len(data) == ENCODING_DIM * 8
+    np.testing.assert_array_equal(bytes_to_encoding(data), encoding)
+
+
+@pytest.fixture
+def enrollment(app_module, client, monkeypatch):
+    user = add_user(app_module)
+    log_in(client, user)
+    result = {'encoding': None, 'reason': 'blurry'}
+    # 顔写真の代わりに、決めた結果を返す
+    monkeypatch.setattr(app_module, 'compute_enrollment_encoding',
+                        lambda path: (result['encoding'], None if result['encoding'] is not None else result['reason']))
+    return user, result
+
+
+def post_face(client, filename='face.jpg', patterns=('left', 'right', 'center', 'blink')):
+    data = {f"eye_pattern_{i}": pattern for i, pattern in enumerate(patterns, 1)}
+    if filename:
+        data['face_image'] = (io.BytesIO(b'jpeg'), filename)
+    return client.post('/face_recognition', data=data, content_type='multipart/form-data')
+
+
+def test_rejected_photo_is_not_kept(app_module, client, enrollment):
+    user, _ = enrollment
+    response = post_face(client)
+    assert response.status_code == 200
+    assert os.listdir(UPLOAD_FOLDER) == []
+    assert app_module.db.session.get(app_module.User, user.id).face_encoding is None
+
+
+def test_rejected_photo_keeps_enrolled_photo(app_module, client, enrollment):
+    _, result = enrollment
+    result['encoding'] = np.full(ENCODING_DIM, 0.1)
+    post_face(client)
+    with open(os.path.join(UPLOAD_FOLDER, 'face.jpg'), 'rb') as f:
+        enrolled = f.read()
+
+    result['encoding'] = None
+    post_face(client)
+    assert os.listdir(UPLOAD_FOLDER) == ['face.jpg']
+    with open(os.path.join(UPLOAD_FOLDER, 'face.jpg'), 'rb') as f:
+        assert f.read() == enrolled
+
+
+def test_accepted_photo_stores_encoding(app_module, client, enrollment):
+    user, result = enrollment
+    result['encoding'] = np.full(ENCODING_DIM, 0.1)
+    response = post_face(client)
+    assert response.status_code == 302
+    assert os.listdir(UPLOAD_FOLDER) == ['face.jpg']
+    user = app_module.db.session.get(app_module.User, user.id)
+    assert user.face_image == os.path.join(UPLOAD_FOLDER, 'face.jpg')
+    np.testing.assert_array_equal(bytes_to_encoding(user.face_encoding), result['encoding'])
+    # 顔特徴量は登録時に保存したものを照合に使う
+    assert app_module.get_face_gallery().match(result['encoding'], 0.4)[:2] == (user.id, 'alice')
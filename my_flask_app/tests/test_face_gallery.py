@@ -0,0 +1,137 @@
+import io
+import numpy as np
+import pytest
+from conftest import add_user, log_in
+from face_gallery import FaceGallery, ENCODING_DIM
+
+
+def make_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, 0.1, (count, ENCODING_DIM)).astype(np.float32)
+    return [(user_id, f"user{user_id}", encodings[user_id]) for user_id in range(count)]
+
+
+def brute_force(rows, probe, k):
+    ids = np.array([user_id for user_id, _, _ in rows])
+    dists = np.linalg.norm(np.stack([encoding for _, _, encoding in rows]) - probe, axis=1)
+    order = np.argsort(dists)[:k]
+    return ids[order], dists[order]
+
+
+def loaded_gallery(rows):
+    gallery = FaceGallery()
+    gallery.load(rows)
+    return gallery
+
+
+def test_search_matches_brute_force():
+    rows = make_rows(200)
+    gallery = loaded_gallery(rows)
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        probe = rows[rng.integers(len(rows))][2] + rng.normal(0.0, 0.01, ENCODING_DIM).astype(np.float32)
+        ids, dists = gallery.search(probe, k=5)
+        expected_ids, expected_dists = brute_force(rows, probe, 5)
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(dists, expected_dists, rtol=1e-4, atol=1e-4)
+
+
+def test_match_applies_threshold():
+    rows = make_rows(50)
+    gallery = loaded_gallery(rows)
+    user_id, name, distance = gallery.match(rows[7][2], threshold=0.4)
+    assert (user_id, name) == (7, 'user7')
+    assert distance == pytest.approx(0.0, abs=1e-3)
+
+    user_id, name, distance = gallery.match(np.full(ENCODING_DIM, 5.0, dtype=np.float32), threshold=0.4)
+    assert (user_id, name) == (None, None)
+    assert distance > 0.4
+
+
+def test_match_batch_matches_match():
+    rows = make_rows(50)
+    gallery = loaded_gallery(rows)
+    probes = np.stack([rows[3][2], np.full(ENCODING_DIM, 5.0, dtype=np.float32), rows[20][2]])
+    results = gallery.match_batch(probes, threshold=[0.4, 0.4, 0.0])
+    assert [(user_id, name) for user_id, name, _ in results] == [(3, 'user3'), (None, None), (None, None)]
+
+
+def test_upsert_and_remove():
+    rows = make_rows(40)
+    gallery = loaded_gallery(rows)
+    new_encoding = np.full(ENCODING_DIM, 0.3, dtype=np.float32)
+
+    gallery.upsert(5, 'renamed', new_encoding)
+    assert len(gallery) == 40
+    assert gallery.match(new_encoding, 0.4)[:2] == (5, 'renamed')
+    assert gallery.match(rows[5][2], 0.01)[0] is None
+
+    # 容量を超えて追加しても行列が広がる
+    for user_id in range(100, 200):
+        gallery.upsert(user_id, f"new{user_id}", -new_encoding + user_id * 0.001)
+    assert len(gallery) == 140
+
+    assert gallery.remove(5)
+    assert not gallery.remove(5)
+    assert len(gallery) == 139
+    assert gallery.match(new_encoding, 0.4)[0] is None
+    remaining = ([row for row in rows if row[0] != 5]
+                 + [(user_id, f"new{user_id}", -new_encoding + user_id * 0.001) for user_id in range(100, 200)])
+    probe = rows[12][2]
+    np.testing.assert_array_equal(gallery.search(probe, k=3)[0], brute_force(remaining, probe, 3)[0])
+
+
+def test_empty_gallery():
+    gallery = loaded_gallery([])
+    assert len(gallery) == 0
+    assert gallery.match(np.zeros(ENCODING_DIM, dtype=np.float32), 0.4) == (None, None, None)
+
+
+def test_from_arrays_shares_encodings():
+    rows = make_rows(10)
+    encodings = np.stack([encoding for _, _, encoding in rows])
+    gallery = FaceGallery.from_arrays([row[0] for row in rows], [row[1] for row in rows], encodings)
+    assert np.shares_memory(gallery.encodings, encodings)
+    assert gallery.match(rows[4][2], 0.4)[:2] == (4, 'user4')
+
+
+def test_gallery_version_counter(app_module):
+    assert app_module.current_gallery_version() is None
+    assert app_module.touch_gallery_version() == 1
+    assert app_module.touch_gallery_version() == 2
+    assert app_module.current_gallery_version() == 2
+
+
+def test_gallery_reloads_after_another_worker_enrolls(app_module):
+    encoding = np.full(ENCODING_DIM, 0.1)
+    gallery = app_module.get_face_gallery()
+    assert len(gallery) == 0
+    assert app_module.get_face_gallery() is gallery
+
+    # 他のワーカーでの登録（DBへの保存とバージョン番号の更新）
+    user = add_user(app_module, encoding=encoding)
+    assert len(app_module.get_face_gallery()) == 0
+    app_module.touch_gallery_version()
+    assert app_module.get_face_gallery().match(encoding, 0.4)[:2] == (user.id, 'alice')
+
+
+def test_enrollment_does_not_skip_other_workers_updates(app_module, client, monkeypatch):
+    user = add_user(app_module)
+    log_in(client, user)
+    encoding = np.full(ENCODING_DIM, 0.1)
+    monkeypatch.setattr(app_module, 'compute_enrollment_encoding', lambda path: (encoding, None))
+    app_module.touch_gallery_version()
+    app_module.get_face_gallery()
+
+    # 他のワーカーで登録されたが、このワーカーはまだ読み込んでいない
+    other = add_user(app_module, username='bob', encoding=np.full(ENCODING_DIM, -0.1))
+    app_module.touch_gallery_version()
+    client.post('/face_recognition', data={'face_image': (io.BytesIO(b'jpeg'), 'face.jpg'),
+                                           'eye_pattern_1': 'left', 'eye_pattern_2': 'left',
+                                           'eye_pattern_3': 'left', 'eye_pattern_4': 'left'},
+                content_type='multipart/form-data')
+    assert app_module.current_gallery_version() == 3
+    gallery = app_module.get_face_gallery()
+    assert gallery.version == 3
+    assert gallery.match(np.full(ENCODING_DIM, -0.1), 0.4)[0] == other.id
+    assert gallery.match(encoding, 0.4)[0] == user.id
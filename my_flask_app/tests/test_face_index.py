@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from face_gallery import FaceGallery, ENCODING_DIM
+from face_index import IVFIndex, QuantizedGallery, create_index
+from test_face_gallery import make_rows, brute_force
+
+
+def make_index(kind, rows):
+    if kind == 'ivf':
+        # 学習を行う大きさにして、探索するクラスタは全部にする（結果が総当たりと一致する）
+        index = IVFIndex(nlist=4, nprobe=4, min_train_size=16)
+    else:
+        index = create_index(kind)
+    index.load(rows)
+    return index
+
+
+@pytest.fixture(params=['ivf', 'int8', 'float16'])
+def kind(request):
+    return request.param
+
+
+def test_search_matches_brute_force(kind):
+    rows = make_rows(200)
+    index = make_index(kind, rows)
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        probe = rows[rng.integers(len(rows))][2] + rng.normal(0.0, 0.01, ENCODING_DIM).astype(np.float32)
+        ids, dists = index.search(probe, k=5)
+        expected_ids, expected_dists = brute_force(rows, probe, 5)
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(dists, expected_dists, rtol=1e-4, atol=1e-4)
+
+
+def test_match_applies_threshold(kind):
+    rows = make_rows(50)
+    index = make_index(kind, rows)
+    user_id, name, distance = index.match(rows[7][2], threshold=0.4)
+    assert (user_id, name) == (7, 'user7')
+    assert distance == pytest.approx(0.0, abs=1e-3)
+
+    user_id, name, distance = index.match(np.full(ENCODING_DIM, 5.0, dtype=np.float32), threshold=0.4)
+    assert (user_id, name) == (None, None)
+    assert distance > 0.4
+
+
+def test_match_batch_matches_match(kind):
+    rows = make_rows(50)
+    index = make_index(kind, rows)
+    probes = np.stack([rows[3][2], np.full(ENCODING_DIM, 5.0, dtype=np.float32), rows[20][2]])
+    results = index.match_batch(probes, threshold=[0.4, 0.4, 0.0])
+    assert [(user_id, name) for user_id, name, _ in results] == [(3, 'user3'), (None, None), (None, None)]
+
+
+def test_upsert_and_remove(kind):
+    rows = make_rows(40)
+    index = make_index(kind, rows)
+    new_encoding = np.full(ENCODING_DIM, 0.3, dtype=np.float32)
+
+    index.upsert(5, 'renamed', new_encoding)
+    assert len(index) == 40
+    assert index.match(new_encoding, 0.4)[:2] == (5, 'renamed')
+    assert index.match(rows[5][2], 0.01)[0] is None
+
+    index.upsert(100, 'new', -new_encoding)
+    assert len(index) == 41
+    assert index.match(-new_encoding, 0.4)[:2] == (100, 'new')
+
+    assert index.remove(5)
+    assert not index.remove(5)
+    assert len(index) == 40
+    assert index.match(new_encoding, 0.4)[0] is None
+    remaining = [row for row in rows if row[0] != 5] + [(100, 'new', -new_encoding)]
+    probe = rows[12][2]
+    np.testing.assert_array_equal(index.search(probe, k=3)[0], brute_force(remaining, probe, 3)[0])
+
+
+def test_empty_index(kind):
+    index = make_index(kind, [])
+    assert len(index) == 0
+    assert index.match(np.zeros(ENCODING_DIM, dtype=np.float32), 0.4) == (None, None, None)
+
+
+def test_quantized_from_arrays():
+    rows = make_rows(10)
+    encodings = np.stack([encoding for _, _, encoding in rows])
+    for dtype in ('int8', 'float16'):
+        quantized = QuantizedGallery.from_arrays([row[0] for row in rows], [row[1] for row in rows], encodings,
+                                                 dtype=dtype)
+        assert len(quantized) == 10
+        assert quantized.match(rows[4][2], 0.4)[:2] == (4, 'user4')
+
+
+def test_ivf_recall_with_few_probes():
+    # クラスタの一部だけを探索しても、登録済みの人物はほぼ見つかる
+    rows = make_rows(2000)
+    index = IVFIndex(nlist=16, nprobe=4, min_train_size=256)
+    index.load(rows)
+    rng = np.random.default_rng(2)
+    queries = rng.integers(len(rows), size=100)
+    found = sum(index.match(rows[i][2] + rng.normal(0.0, 0.005, ENCODING_DIM), 0.4)[0] == i for i in queries)
+    assert found >= 90
+
+
+def test_create_index():
+    assert isinstance(create_index('brute'), FaceGallery)
+    assert isinstance(create_index('ivf'), IVFIndex)
+    assert isinstance(create_index('int8'), QuantizedGallery)
+    assert isinstance(create_index('float16'), QuantizedGallery)
+    with pytest.raises(ValueError):
+        create_index('hnsw')
@@ -0,0 +1,151 @@
+from contextlib import contextmanager
+import cv2
+import numpy as np
+import pytest
+from conftest import add_user
+
+
+class FakeFaceMeshPool:
+    def __init__(self):
+        self.busy = False
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        if self.busy:
+            raise TimeoutError('FaceMesh pool is busy')
+        yield object()
+
+
+@pytest.fixture
+def frame_login(app_module, monkeypatch):
+    """顔認証は recognized の名前を返し、目線認証は directions の方向を順に返すようにする。"""
+    user = add_user(app_module, eye_patterns=('left', 'right', 'center', 'blink'))
+    fake = {'recognized': None, 'directions': [], 'pool': FakeFaceMeshPool()}
+
+    def recognize_face_in_frame(frame, gallery, overlay=None):
+        if fake['recognized'] and overlay is not None:
+            overlay.append(((10, 90, 90, 10), fake['recognized']))
+        return fake['recognized']
+
+    def process_gaze_frame(frame, eye_open, face_mesh, face_box=None):
+        direction = fake['directions'].pop(0) if fake['directions'] else None
+        return direction, eye_open, {'face_box': face_box}
+
+    monkeypatch.setattr(app_module, 'get_face_gallery', lambda: None)
+    monkeypatch.setattr(app_module, 'recognize_face_in_frame', recognize_face_in_frame)
+    monkeypatch.setattr(app_module, 'process_gaze_frame', process_gaze_frame)
+    monkeypatch.setattr(app_module, 'static_face_mesh_pool', fake['pool'])
+    fake['user'] = user
+    return fake
+
+
+FRAME = cv2.imencode('.jpg', np.zeros((100, 100, 3), dtype=np.uint8))[1].tobytes()
+
+
+def post_frame(client, data=FRAME):
+    return client.post('/face_login/session/frame', data=data, content_type='image/jpeg')
+
+
+def attempts(app_module):
+    return app_module.FaceLoginAttempt.query.all()
+
+
+def session_nonce(client):
+    with client.session_transaction() as session:
+        return session.get('face_login')
+
+
+def test_frame_without_session(client, frame_login):
+    assert post_frame(client).status_code == 404
+    assert client.get('/face_login/session').status_code == 404
+
+
+def test_start_stores_only_a_nonce_in_the_cookie(app_module, client, frame_login):
+    response = client.post('/face_login/session')
+    assert response.get_json() == {'stage': 'face', 'match_count': 0}
+    nonce = session_nonce(client)
+    assert isinstance(nonce, str) and len(nonce) >= 32
+    [attempt] = attempts(app_module)
+    assert attempt.nonce == nonce
+    assert attempt.stage == 'face'
+
+    # 始め直すと前の状態は削除される
+    client.post('/face_login/session')
+    [attempt] = attempts(app_module)
+    assert attempt.nonce == session_nonce(client) != nonce
+
+
+def test_undecodable_frame(client, frame_login):
+    client.post('/face_login/session')
+    assert post_frame(client, b'not a jpeg').status_code == 400
+
+
+def test_face_then_gaze_success(app_module, client, frame_login):
+    client.post('/face_login/session')
+    assert post_frame(client).get_json()['stage'] == 'face'
+
+    frame_login['recognized'] = 'alice'
+    verdict = post_frame(client).get_json()
+    assert verdict == {'stage': 'gaze', 'match_count': 0}
+    [attempt] = attempts(app_module)
+    assert attempt.user_id == frame_login['user'].id
+    assert attempt.face_box == [10, 90, 90, 10]
+    # ユーザーIDはCookieに入れない
+    assert session_nonce(client) == attempt.nonce
+
+    frame_login['directions'] = ['left'] * 3 + ['right'] * 3 + ['center'] * 3
+    for _ in range(9):
+        verdict = post_frame(client).get_json()
+    assert verdict == {'stage': 'gaze', 'match_count': 3}
+
+    frame_login['directions'] = ['blink']
+    replayed = session_nonce(client)
+    verdict = post_frame(client).get_json()
+    assert verdict['stage'] == 'success'
+    assert verdict['redirect'] == '/dashboard'
+    with client.session_transaction() as session:
+        assert session['_user_id'] == str(frame_login['user'].id)
+        assert 'face_login' not in session
+    assert attempts(app_module) == []
+
+    # 成功した後に同じ nonce を送り直しても再利用できない
+    with client.session_transaction() as session:
+        session['face_login'] = replayed
+    assert post_frame(client).status_code == 404
+
+
+def test_face_stage_timeout(app_module, client, frame_login, monkeypatch):
+    client.post('/face_login/session')
+    monkeypatch.setattr(app_module, 'FACE_TIMEOUT', 0.0)
+    verdict = post_frame(client).get_json()
+    assert verdict == {'stage': 'failed', 'failed_stage': 'face', 'match_count': 0}
+    assert attempts(app_module) == []
+    assert post_frame(client).status_code == 404
+
+
+def test_gaze_stage_timeout(app_module, client, frame_login, monkeypatch):
+    client.post('/face_login/session')
+    frame_login['recognized'] = 'alice'
+    post_frame(client)
+    # 顔認証の制限時間は目線認証の段階には使わない
+    monkeypatch.setattr(app_module, 'FACE_TIMEOUT', 0.0)
+    assert post_frame(client).get_json()['stage'] == 'gaze'
+
+    monkeypatch.setattr(app_module, 'GAZE_TIMEOUT', 0.0)
+    verdict = client.get('/face_login/session').get_json()
+    assert verdict == {'stage': 'failed', 'failed_stage': 'gaze', 'match_count': 0}
+    assert attempts(app_module) == []
+
+
+def test_busy_face_mesh_pool_keeps_state(app_module, client, frame_login):
+    client.post('/face_login/session')
+    frame_login['recognized'] = 'alice'
+    post_frame(client)
+    frame_login['pool'].busy = True
+    frame_login['directions'] = ['left']
+    response = post_frame(client)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    [attempt] = attempts(app_module)
+    assert attempt.stage == 'gaze'
+    assert frame_login['directions'] == ['left']
@@ -0,0 +1,88 @@
+import threading
+from contextlib import ExitStack
+import time
+import pytest
+from face_mesh_pool import FaceMeshPool
+
+
+class FakeFaceMesh:
+    def __init__(self):
+        self.processed = 0
+
+    def process(self, image):
+        self.processed += 1
+
+
+def test_creates_instances_up_to_size_and_reuses_them():
+    created = []
+    pool = FaceMeshPool(lambda: created.append(FakeFaceMesh()) or created[-1], size=2)
+    with pool.checkout() as first:
+        with pool.checkout() as second:
+            assert first is not second
+            assert pool.stats()['in_use'] == 2
+    with pool.checkout() as again:
+        assert again in (first, second)
+    stats = pool.stats()
+    assert stats['created'] == 2 and len(created) == 2
+    assert stats['checkouts'] == 3 and stats['in_use'] == 0
+
+
+def test_checkout_times_out_when_all_instances_are_in_use():
+    pool = FaceMeshPool(FakeFaceMesh, size=1)
+    with pool.checkout():
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            with pool.checkout(timeout=0.05):
+                pass
+        assert time.monotonic() - start >= 0.05
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['in_use'] == 0
+    # 時間切れの後も、返却されたインスタンスは借りられる
+    with pool.checkout(timeout=0.05):
+        pass
+
+
+def test_checkout_waits_for_a_returned_instance():
+    pool = FaceMeshPool(FakeFaceMesh, size=1)
+    released = threading.Event()
+
+    def hold():
+        with pool.checkout():
+            released.wait(1.0)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    while pool.stats()['in_use'] == 0:
+        time.sleep(0.001)
+    threading.Timer(0.05, released.set).start()
+    with pool.checkout(timeout=1.0):
+        pass
+    holder.join()
+    assert pool.stats()['wait_seconds_max'] >= 0.04
+
+
+def test_failed_factory_does_not_use_up_the_pool():
+    calls = []
+
+    def factory():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError('model failed to load')
+        return FakeFaceMesh()
+
+    pool = FaceMeshPool(factory, size=1)
+    with pytest.raises(RuntimeError):
+        with pool.checkout(timeout=0.01):
+            pass
+    with pool.checkout(timeout=0.01) as face_mesh:
+        assert isinstance(face_mesh, FakeFaceMesh)
+
+
+def test_warm_up_processes_every_instance():
+    pool = FaceMeshPool(FakeFaceMesh, size=3)
+    pool.warm_up()
+    assert pool.stats()['created'] == 3
+    with ExitStack() as stack:
+        instances = [stack.enter_context(pool.checkout(timeout=0.01)) for _ in range(3)]
+    assert [face_mesh.processed for face_mesh in instances] == [1, 1, 1]
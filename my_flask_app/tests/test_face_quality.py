@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import face_quality
+from face_quality import assess_face_quality, partition_face_locations, filter_face_locations, TOO_SMALL, BLURRY, TURNED
+from metrics import FACES_REJECTED
+
+FACE = (20, 180, 180, 20)
+
+
+def sharp_image(seed=0):
+    # ラプラシアンの分散が大きい（ピントが合っている）画像
+    return np.random.default_rng(seed).integers(0, 256, (200, 200, 3), dtype=np.uint8)
+
+
+def flat_image():
+    return np.full((200, 200, 3), 128, dtype=np.uint8)
+
+
+@pytest.fixture
+def yaw(monkeypatch):
+    # 顔の向きは dlib のランドマークの代わりに決めた値を返す
+    offsets = {'value': 0.0}
+    monkeypatch.setattr(face_quality, 'yaw_offset', lambda rgb_image, location: offsets['value'])
+    return offsets
+
+
+def test_accepts_good_face(yaw):
+    assert assess_face_quality(sharp_image(), FACE) is None
+
+
+def test_rejects_small_face(yaw):
+    top, left = 20, 20
+    size = face_quality.MIN_FACE_SIZE - 1
+    assert assess_face_quality(sharp_image(), (top, left + size, top + size, left)) == TOO_SMALL
+
+
+def test_rejects_blurry_face(yaw):
+    assert assess_face_quality(flat_image(), FACE) == BLURRY
+
+
+def test_rejects_turned_face(yaw):
+    yaw['value'] = face_quality.MAX_YAW + 0.1
+    assert assess_face_quality(sharp_image(), FACE) == TURNED
+
+
+def test_missing_landmarks_are_not_rejected(yaw):
+    yaw['value'] = None
+    assert assess_face_quality(sharp_image(), FACE) is None
+
+
+def test_checks_run_cheapest_first(monkeypatch):
+    def fail(*args):
+        raise AssertionError('landmarks should not be computed')
+    monkeypatch.setattr(face_quality, 'yaw_offset', fail)
+    assert assess_face_quality(flat_image(), (0, 10, 10, 0)) == TOO_SMALL
+    assert assess_face_quality(flat_image(), FACE) == BLURRY
+
+
+def test_partition_keeps_order_and_reasons(yaw):
+    image = sharp_image()
+    image[100:200, 100:200] = 128
+    small = (0, 10, 10, 0)
+    blurry = (100, 200, 200, 100)
+    good = (0, 100, 100, 0)
+    accepted, rejections = partition_face_locations(image, [small, good, blurry])
+    assert accepted == [good]
+    assert rejections == [TOO_SMALL, BLURRY]
+
+
+def rejected_count(pipeline, reason):
+    prefix = f'face_login_faces_rejected_total{{pipeline="{pipeline}",reason="{reason}"}} '
+    return next((int(line[len(prefix):]) for line in FACES_REJECTED.render() if line.startswith(prefix)), 0)
+
+
+def test_filter_counts_rejections(yaw):
+    before = rejected_count('test', TOO_SMALL)
+    assert filter_face_locations(sharp_image(), [(0, 10, 10, 0)], pipeline='test') == []
+    assert rejected_count('test', TOO_SMALL) == before + 1
+
+
+def test_gate_disabled(monkeypatch, yaw):
+    monkeypatch.setattr(face_quality, 'QUALITY_GATE', False)
+    locations = [(0, 10, 10, 0)]
+    assert partition_face_locations(flat_image(), locations) == (locations, [])
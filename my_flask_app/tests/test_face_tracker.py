@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+from face_tracker import FaceTracker, _iou
+
+PATCH = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 256, (60, 60), dtype=np.uint8), (3, 3), 0)
+
+
+def frame_with_face(dx=0, dy=0):
+    # 顔の代わりに、模様のある四角を (50 + dy, 50 + dx) に置いた画像
+    gray = np.zeros((200, 200), dtype=np.uint8)
+    gray[50 + dy:110 + dy, 50 + dx:110 + dx] = PATCH
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+
+
+class FakeModels:
+    """検出は現在の四角の位置を返し、照合は名前を返す。呼ばれた回数を数える。"""
+
+    def __init__(self):
+        self.box = (50, 110, 110, 50)
+        self.detect_calls = 0
+        self.identify_calls = []
+
+    def detect(self, rgb_frame):
+        self.detect_calls += 1
+        return [self.box] if rgb_frame.any() else []
+
+    def identify(self, rgb_frame, boxes):
+        self.identify_calls.append(list(boxes))
+        return ['alice' for _ in boxes]
+
+
+def make_tracker(models, **kwargs):
+    return FaceTracker(models.detect, models.identify, **kwargs)
+
+
+def test_iou():
+    assert _iou((0, 10, 10, 0), (0, 10, 10, 0)) == 1.0
+    assert _iou((0, 10, 10, 0), (0, 20, 10, 10)) == 0.0
+    assert _iou((0, 10, 10, 0), (0, 15, 10, 5)) == 50 / 150
+
+
+def test_tracks_between_detections_without_identifying_again():
+    models = FakeModels()
+    tracker = make_tracker(models, detect_interval=10)
+    [track] = tracker.update(frame_with_face())
+    assert track.name == 'alice'
+    assert models.detect_calls == 1
+
+    for step in range(1, 5):
+        [tracked] = tracker.update(frame_with_face(dx=2 * step, dy=step))
+        assert tracked is track
+        top, right, bottom, left = tracked.box
+        assert abs(left - (50 + 2 * step)) <= 1 and abs(top - (50 + step)) <= 1
+    assert models.detect_calls == 1
+    assert len(models.identify_calls) == 1
+    assert tracker.detections == 1 and tracker.identifications == 1
+
+
+def test_detects_again_after_interval_and_keeps_identity():
+    models = FakeModels()
+    tracker = make_tracker(models, detect_interval=3)
+    [track] = tracker.update(frame_with_face())
+    for _ in range(2):
+        tracker.update(frame_with_face())
+    assert models.detect_calls == 1
+    [redetected] = tracker.update(frame_with_face())
+    assert models.detect_calls == 2
+    # 重なる検出結果は同じ人物とみなし、照合し直さない
+    assert redetected is track
+    assert redetected.name == 'alice'
+    assert len(models.identify_calls) == 1
+
+
+def test_lost_track_triggers_detection():
+    models = FakeModels()
+    tracker = make_tracker(models, detect_interval=10)
+    tracker.update(frame_with_face())
+    # 顔が消えると追跡の信頼度が下がり、検出し直す
+    assert tracker.update(np.zeros((200, 200, 3), dtype=np.uint8)) == []
+    assert models.detect_calls == 2
+    # 追跡中の顔がない間は毎フレーム検出する
+    tracker.update(np.zeros((200, 200, 3), dtype=np.uint8))
+    assert models.detect_calls == 3
+
+    [track] = tracker.update(frame_with_face())
+    assert track.name == 'alice'
+    assert len(models.identify_calls) == 2
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from frame_ring import SharedFrameRing
+
+
+@pytest.fixture
+def ring():
+    ring = SharedFrameRing.create(3, 4, 6)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def frame(value, height=4, width=6):
+    bgr = np.zeros((height, width, 3), dtype=np.uint8)
+    bgr[..., 0] = value  # B
+    bgr[..., 2] = 255 - value  # R
+    return bgr
+
+
+def test_write_converts_to_rgb(ring):
+    seq = ring.write(0, frame(10))
+    assert ring.is_current(0, seq)
+    np.testing.assert_array_equal(ring.bgr(0), frame(10))
+    np.testing.assert_array_equal(ring.rgb(0), frame(10)[:, :, ::-1])
+
+
+def test_wraparound_detects_overwritten_slots(ring):
+    reader = SharedFrameRing.attach(ring.descriptor)
+    try:
+        written = []
+        # スロットの数より多く書き込み、スロットを順番に使い回す
+        for index in range(8):
+            slot = index % ring.slots
+            written.append((slot, ring.write(slot, frame(index * 20)), index))
+
+        seqs = [seq for _, seq, _ in written]
+        assert seqs == sorted(set(seqs))
+        for slot, seq, index in written:
+            latest = index + ring.slots >= len(written)
+            # 上書きされたスロットは、読む側で古い通し番号と一致しなくなる
+            assert reader.is_current(slot, seq) == latest
+            if latest:
+                np.testing.assert_array_equal(reader.bgr(slot), frame(index * 20))
+                np.testing.assert_array_equal(reader.rgb(slot), frame(index * 20)[:, :, ::-1])
+    finally:
+        reader.close()
+
+
+def test_write_resizes_to_slot_shape(ring):
+    ring.write(1, frame(100, height=8, width=12))
+    assert ring.bgr(1).shape == ring.shape
+    assert ring.rgb(1)[0, 0].tolist() == [155, 0, 100]
+
+
+def test_attach_reads_same_memory(ring):
+    reader = SharedFrameRing.attach(ring.descriptor)
+    try:
+        assert reader.descriptor == ring.descriptor
+        assert not reader.owner
+        seq = ring.write(2, frame(50))
+        assert reader.is_current(2, seq)
+        np.testing.assert_array_equal(reader.bgr(2), frame(50))
+    finally:
+        reader.close()
@@ -0,0 +1,173 @@
+import queue
+import time
+import cv2
+import numpy as np
+import pytest
+import frame_source
+from frame_source import ThreadedFrameSource, VideoFileSource, ImageDirectorySource, open_frame_source
+
+
+class FakeCapture:
+    """テストから put() したフレームを順番に返す cv2.VideoCapture の代わり。None を入れると終わる。"""
+
+    def __init__(self, source):
+        self.source = source
+        self.frames = queue.Queue()
+        self.properties = {}
+        self.released = False
+
+    def isOpened(self):
+        return not self.released
+
+    def set(self, prop, value):
+        self.properties[prop] = value
+
+    def read(self):
+        frame = self.frames.get(timeout=5)
+        if frame is None:
+            return False, None
+        return True, frame
+
+    def release(self):
+        self.released = True
+        self.frames.put(None)
+
+
+def frame(value, width=8, height=6):
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def threaded(monkeypatch):
+    monkeypatch.setattr(frame_source.cv2, 'VideoCapture', FakeCapture)
+    source = ThreadedFrameSource(0)
+    yield source
+    # 取り込みのスレッドが cap.read() で待ったままにならないよう、入力を終わらせてから止める
+    source._cap.frames.put(None)
+    source.release()
+
+
+def test_threaded_source_returns_latest_frame(threaded):
+    for value in (1, 2, 3):
+        threaded._cap.frames.put(frame(value))
+    wait_until(lambda: threaded.captured_frames == 3)
+
+    ret, latest = threaded.read()
+    assert ret and latest[0, 0, 0] == 3
+    assert threaded.dropped_frames == 2
+
+    # 同じフレームを2回返さない
+    assert threaded.read(timeout=0.05) == (False, None)
+    assert not threaded.ended()
+
+    threaded._cap.frames.put(frame(4))
+    ret, latest = threaded.read()
+    assert ret and latest[0, 0, 0] == 4
+
+
+def test_threaded_source_ends_when_capture_stops(threaded):
+    threaded._cap.frames.put(frame(1))
+    threaded._cap.frames.put(None)
+    wait_until(lambda: threaded.ended())
+
+    # 止まる前に届いたフレームは読める
+    ret, latest = threaded.read()
+    assert ret and latest[0, 0, 0] == 1
+    assert threaded.read(timeout=1.0) == (False, None)
+    assert threaded.ended()
+
+
+class LiveCapture(FakeCapture):
+    """カメラと同じく、一定の間隔でフレームを返し続ける cv2.VideoCapture の代わり。"""
+
+    def read(self):
+        time.sleep(0.01)
+        return True, frame(1)
+
+
+def test_threaded_source_release_stops_thread(monkeypatch):
+    monkeypatch.setattr(frame_source.cv2, 'VideoCapture', LiveCapture)
+    source = ThreadedFrameSource(0)
+    wait_until(lambda: source.captured_frames >= 3)
+
+    source.release()
+    assert not source._thread.is_alive()
+    assert source._cap.released
+    assert source.ended()
+    # 止まる前に届いたフレームを読んだ後は、待たずに (False, None) を返す
+    source.read(timeout=0)
+    start = time.monotonic()
+    assert source.read(timeout=5.0) == (False, None)
+    assert time.monotonic() - start < 1.0
+
+
+def test_threaded_source_resizes_in_capture_thread(monkeypatch):
+    monkeypatch.setattr(frame_source.cv2, 'VideoCapture', FakeCapture)
+    with ThreadedFrameSource(0, width=4) as source:
+        assert source._cap.properties[cv2.CAP_PROP_FRAME_WIDTH] == 4
+        source._cap.frames.put(frame(1, width=8, height=6))
+        ret, resized = source.read()
+        assert ret and resized.shape == (3, 4, 3)
+        source._cap.frames.put(None)
+
+
+def test_video_file_source_reads_every_frame_in_order(tmp_path):
+    path = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (32, 24))
+    for index in range(6):
+        writer.write(frame(index * 40, width=32, height=24))
+    writer.release()
+
+    with VideoFileSource(path, fps=5) as source:
+        values, clocks = [], []
+        while True:
+            ret, image = source.read()
+            if not ret:
+                break
+            values.append(int(image.mean()))
+            clocks.append(source.clock())
+    # 10fps の動画を 5fps に間引くので、1枚おきに返す
+    assert values == pytest.approx([0, 80, 160], abs=8)
+    assert clocks == pytest.approx([0.0, 0.2, 0.4])
+    assert source.captured_frames == 3
+    assert source.ended()
+
+
+def test_image_directory_source_skips_unreadable_images(tmp_path):
+    for index in (2, 0, 1):
+        cv2.imwrite(str(tmp_path / f"{index:03d}.png"), frame(index * 50))
+    (tmp_path / '001_broken.jpg').write_bytes(b'not an image')
+    (tmp_path / 'notes.txt').write_text('ignored')
+
+    source = ImageDirectorySource(str(tmp_path), fps=10)
+    values = []
+    while True:
+        ret, image = source.read()
+        if not ret:
+            break
+        values.append(int(image[0, 0, 0]))
+    assert values == [0, 50, 100]
+    assert source.dropped_frames == 1
+    assert source.clock() == pytest.approx(0.2)
+
+    source.release()
+    assert not source.isOpened()
+    assert source.read() == (False, None)
+
+
+def test_open_frame_source(tmp_path, monkeypatch):
+    monkeypatch.setattr(frame_source.cv2, 'VideoCapture', FakeCapture)
+    assert isinstance(open_frame_source(str(tmp_path)), ImageDirectorySource)
+    existing = ImageDirectorySource(str(tmp_path))
+    assert open_frame_source(existing) is existing
+
+    camera = open_frame_source('1')
+    assert isinstance(camera, ThreadedFrameSource) and camera._cap.source == 1
+    camera.release()
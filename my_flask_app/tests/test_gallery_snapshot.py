@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from face_gallery import ENCODING_DIM
+from gallery_snapshot import (write_snapshot, read_snapshot, iter_snapshot_rows, open_snapshot_gallery,
+                              append_to_snapshot, pending_records, compact_snapshot)
+
+
+def make_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(user_id, f"ユーザー{user_id}", rng.normal(0.0, 0.1, ENCODING_DIM).astype(np.float32))
+            for user_id in range(1, count + 1)]
+
+
+def as_dict(rows):
+    return {user_id: (name, np.asarray(encoding, dtype=np.float32)) for user_id, name, encoding in rows}
+
+
+def assert_rows_equal(actual, expected):
+    actual, expected = as_dict(actual), as_dict(expected)
+    assert actual.keys() == expected.keys()
+    for user_id, (name, encoding) in expected.items():
+        assert actual[user_id][0] == name
+        np.testing.assert_array_equal(actual[user_id][1], encoding)
+
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    rows = make_rows(5)
+    assert write_snapshot(path, rows) == 5
+    ids, names, encodings, tail = read_snapshot(path)
+    assert ids.tolist() == [1, 2, 3, 4, 5]
+    assert names == [name for _, name, _ in rows]
+    np.testing.assert_array_equal(encodings, np.stack([encoding for _, _, encoding in rows]))
+    assert tail == []
+
+
+def test_write_empty(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    assert write_snapshot(path, []) == 0
+    assert iter_snapshot_rows(path) == []
+    assert len(open_snapshot_gallery(path)) == 0
+
+
+def test_append_and_compact(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    rows = make_rows(3)
+    write_snapshot(path, rows)
+
+    updated = (2, 'renamed', np.full(ENCODING_DIM, 0.5, dtype=np.float32))
+    added = (10, 'new', np.full(ENCODING_DIM, -0.5, dtype=np.float32))
+    assert append_to_snapshot(path, *updated) == 1
+    assert append_to_snapshot(path, *added) == 2
+    expected = [rows[0], updated, rows[2], added]
+    assert_rows_equal(iter_snapshot_rows(path), expected)
+
+    assert compact_snapshot(path) == 4
+    assert pending_records(path) == 0
+    ids, _, _, tail = read_snapshot(path)
+    assert sorted(ids.tolist()) == [1, 2, 3, 10]
+    assert tail == []
+    assert_rows_equal(iter_snapshot_rows(path), expected)
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = str(tmp_path / 'gallery.snapshot')
+    rows = make_rows(2)
+    write_snapshot(path, rows)
+    append_to_snapshot(path, 3, 'new', np.zeros(ENCODING_DIM, dtype=np.float32))
+    with open(path, 'r+b') as f:
+        f.seek(0, 2)
+        f.truncate(f.tell() - 10)
+    assert pending_records(path) == 0
+    assert_rows_equal(iter_snapshot_rows(path), rows)
+
+
+@pytest.mark.parametrize('index', ['brute', 'int8', 'float16'])
+def test_open_snapshot_gallery(tmp_path, index):
+    path = str(tmp_path / 'gallery.snapshot')
+    rows = make_rows(20)
+    write_snapshot(path, rows)
+    added = (99, 'new', np.full(ENCODING_DIM, 0.5, dtype=np.float32))
+    append_to_snapshot(path, *added)
+
+    gallery = open_snapshot_gallery(path, version=1.0, index=index)
+    assert len(gallery) == 21
+    assert gallery.version == 1.0
+    assert gallery.match(rows[7][2], 0.4)[:2] == (8, 'ユーザー8')
+    assert gallery.match(added[2], 0.4)[:2] == (99, 'new')
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not-a-snapshot'
+    path.write_bytes(b'\0' * 128)
+    with pytest.raises(ValueError):
+        read_snapshot(str(path))
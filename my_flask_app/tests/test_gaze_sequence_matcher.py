@@ -0,0 +1,154 @@
+from gaze_recognition_utils import GazeSequenceMatcher
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_matcher(patterns, clock, **kwargs):
+    kwargs.setdefault('stable_frames', 2)
+    kwargs.setdefault('repeat_interval', 0.8)
+    kwargs.setdefault('timeout', 10.0)
+    return GazeSequenceMatcher(patterns, clock=clock, **kwargs)
+
+
+def feed(matcher, clock, directions, step=0.1):
+    status = None
+    for direction in directions:
+        clock.now += step
+        status = matcher.update(direction)
+    return status
+
+
+def test_stable_transitions_match_in_order():
+    clock = FakeClock()
+    matcher = make_matcher(['left', 'right', 'center', 'blink'], clock)
+    # 1フレームだけの方向は確定しない
+    feed(matcher, clock, ['left', 'right'])
+    assert matcher.match_count == 0
+    feed(matcher, clock, ['left', 'left'])
+    assert matcher.match_count == 1
+    feed(matcher, clock, ['right', 'right', 'center', 'center'])
+    assert matcher.match_count == 3
+    # まばたきは1フレームで確定する
+    assert feed(matcher, clock, ['blink']) == GazeSequenceMatcher.SUCCESS
+    assert matcher.status == GazeSequenceMatcher.SUCCESS
+    # 成功した後は状態が変わらない
+    assert feed(matcher, clock, ['left', 'left']) == GazeSequenceMatcher.SUCCESS
+
+
+def test_wrong_direction_restarts():
+    clock = FakeClock()
+    matcher = make_matcher(['left', 'right', 'center', 'center'], clock)
+    feed(matcher, clock, ['left', 'left', 'right', 'right'])
+    assert matcher.match_count == 2
+    feed(matcher, clock, ['left', 'left'])
+    # 1つ目のパターンと一致する方向なら、そこから数え直す
+    assert matcher.match_count == 1
+    feed(matcher, clock, ['center', 'center'])
+    assert matcher.match_count == 0
+
+
+def test_holding_a_direction_repeats_it():
+    clock = FakeClock()
+    matcher = make_matcher(['left', 'left', 'right', 'right'], clock)
+    feed(matcher, clock, ['left', 'left'])
+    assert matcher.match_count == 1
+    feed(matcher, clock, ['left'] * 5, step=0.1)
+    assert matcher.match_count == 1
+    feed(matcher, clock, ['left'] * 4, step=0.1)
+    assert matcher.match_count == 2
+
+
+def test_missing_face_is_ignored():
+    clock = FakeClock()
+    matcher = make_matcher(['left', 'right', 'center', 'blink'], clock)
+    feed(matcher, clock, ['left', None, 'left'])
+    assert matcher.match_count == 1
+
+
+def test_timeout():
+    clock = FakeClock()
+    matcher = make_matcher(['left', 'right', 'center', 'blink'], clock, timeout=5.0)
+    feed(matcher, clock, ['left', 'left'])
+    clock.now += 5.0
+    assert matcher.update('right') == GazeSequenceMatcher.TIMEOUT
+    assert matcher.status == GazeSequenceMatcher.TIMEOUT
+    assert matcher.update('right') == GazeSequenceMatcher.TIMEOUT
+
+
+def test_state_round_trip_keeps_progress_and_deadline():
+    clock = FakeClock()
+    patterns = ['left', 'right', 'center', 'blink']
+    matcher = make_matcher(patterns, clock, timeout=5.0)
+    feed(matcher, clock, ['left', 'left', 'right'])
+
+    clock.now += 1.0
+    restored = GazeSequenceMatcher.from_state(patterns, matcher.state(), clock=clock, stable_frames=2,
+                                              repeat_interval=0.8, timeout=5.0)
+    assert restored.state() == matcher.state()
+    assert feed(restored, clock, ['right']) == GazeSequenceMatcher.MATCHING
+    assert restored.match_count == 2
+    # 制限時間は復元した時点からではなく、最初に作った時点から数える
+    clock.now = matcher.started_at + 5.1
+    assert restored.update('center') == GazeSequenceMatcher.TIMEOUT
+
+
+def test_blink_in_the_middle_of_a_sequence():
+    # 30fps、3フレームで確定する設定で、目を閉じている間は方向が乱れる
+    clock = FakeClock()
+    matcher = make_matcher(['center', 'blink', 'left', 'right'], clock, stable_frames=3)
+    step = 1 / 30
+    feed(matcher, clock, ['center'] * 5, step)
+    assert matcher.match_count == 1
+    feed(matcher, clock, [None, 'right', 'right', 'blink'], step)
+    assert matcher.match_count == 2
+    # 目を開き直した後も同じ方向を見ているだけでは、次の入力にならない
+    feed(matcher, clock, ['center'] * 5, step)
+    assert matcher.match_count == 2
+    feed(matcher, clock, ['left'] * 3, step)
+    assert matcher.match_count == 3
+    assert feed(matcher, clock, ['right'] * 3, step) == GazeSequenceMatcher.SUCCESS
+
+
+def test_two_blinks_in_a_row():
+    clock = FakeClock()
+    matcher = make_matcher(['blink', 'blink', 'left', 'right'], clock, stable_frames=3)
+    step = 1 / 30
+    feed(matcher, clock, ['center'] * 5, step)
+    assert matcher.match_count == 0
+    feed(matcher, clock, ['blink'], step)
+    assert matcher.match_count == 1
+    feed(matcher, clock, ['center'] * 4 + ['blink'], step)
+    assert matcher.match_count == 2
+    feed(matcher, clock, ['left'] * 3, step)
+    assert matcher.match_count == 3
+    assert feed(matcher, clock, ['right'] * 3, step) == GazeSequenceMatcher.SUCCESS
+
+
+def test_second_blink_requires_eyes_to_reopen():
+    clock = FakeClock()
+    matcher = make_matcher(['blink', 'blink', 'left', 'right'], clock)
+    feed(matcher, clock, ['blink', 'blink'])
+    assert matcher.match_count == 1
+    # 顔が見つからないフレームは目が開いたことにならない
+    feed(matcher, clock, [None, 'blink'])
+    assert matcher.match_count == 1
+    feed(matcher, clock, ['center', 'blink'])
+    assert matcher.match_count == 2
+
+
+def test_blink_state_round_trip():
+    clock = FakeClock()
+    patterns = ['center', 'blink', 'left', 'right']
+    matcher = make_matcher(patterns, clock)
+    feed(matcher, clock, ['center', 'center', 'blink'])
+    restored = GazeSequenceMatcher.from_state(patterns, matcher.state(), clock=clock, stable_frames=2,
+                                              repeat_interval=0.8, timeout=10.0)
+    assert restored.state() == matcher.state()
+    feed(restored, clock, ['blink', 'center', 'center'])
+    assert restored.match_count == 2
@@ -0,0 +1,72 @@
+import io
+import json
+import numpy as np
+import pytest
+from conftest import add_user, log_in
+from face_gallery import FaceGallery, ENCODING_DIM
+
+
+@pytest.fixture
+def gallery(app_module, monkeypatch):
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(0.0, 0.1, (3, ENCODING_DIM)).astype(np.float32)
+    gallery = FaceGallery.from_arrays([1, 2, 3], ['alice', 'bob', 'carol'], encodings)
+    # DB やスナップショットを読まずに、このギャラリーで照合する
+    monkeypatch.setattr(app_module, 'get_face_gallery', lambda: gallery)
+    return gallery
+
+
+@pytest.fixture
+def logged_in(app_module, client, gallery):
+    log_in(client, add_user(app_module, 'operator'))
+    return client
+
+
+def post_identify(client, **body):
+    return client.post('/identify', data=json.dumps(body), content_type='application/json')
+
+
+def test_identify_encodings(logged_in, gallery):
+    probe = gallery.encodings[1].tolist()
+    response = post_identify(logged_in, encodings=[probe, [5.0] * ENCODING_DIM], k=2)
+    assert response.status_code == 200
+    faces = response.get_json()['faces']
+    assert len(faces) == 2
+    assert faces[0]['match']
+    assert faces[0]['candidates'][0]['name'] == 'bob'
+    assert len(faces[0]['candidates']) == 2
+    assert not faces[1]['match']
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'encodings': []},
+    {'encodings': [[0.0] * 127]},
+    {'encodings': [0.0] * ENCODING_DIM},
+    {'encodings': [[0.0] * ENCODING_DIM], 'k': 0},
+    {'encodings': [[0.0] * ENCODING_DIM], 'k': 1000},
+    {'encodings': [[0.0] * ENCODING_DIM], 'k': 'abc'},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': None},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': -0.1},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': float('nan')},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': float('inf')},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': [0.4, 0.4]},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': [0.4, None]},
+    {'encodings': [[0.0] * ENCODING_DIM], 'threshold': 'abc'},
+])
+def test_identify_rejects_invalid_json(logged_in, body):
+    response = post_identify(logged_in, **body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_identify_rejects_undecodable_image(logged_in):
+    response = logged_in.post('/identify', data={'image': (io.BytesIO(b'not an image'), 'face.jpg')},
+                              content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Could not decode image.'
+
+
+def test_identify_requires_login(client, gallery):
+    response = client.post('/identify', json={'encodings': [[0.0] * ENCODING_DIM]})
+    assert response.status_code in (302, 401)
@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import login_session
+from face_recognition_utils import render_face_overlay
+from frame_source import FrameSource
+from gaze_recognition_utils import GAZE_STABLE_FRAMES
+from login_session import LoginSession
+
+FPS = 10.0
+PATTERN = ('left', 'right', 'center', 'blink')
+
+
+class FakeGallery:
+    def __init__(self, size=1):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+class FakeFrameSource(FrameSource):
+    """count 枚の黒いフレームを返す。clock() は FPS で撮影した映像内の時刻。"""
+
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+        self.index = -1
+        self.released = False
+
+    def isOpened(self):
+        return True
+
+    def read(self, timeout=None):
+        if self.index + 1 >= self.count:
+            return False, None
+        self.index += 1
+        return True, np.zeros((60, 80, 3), dtype=np.uint8)
+
+    def release(self):
+        self.released = True
+
+    def clock(self):
+        return max(self.index, 0) / FPS
+
+
+class FakeFaceMeshPool:
+    def __init__(self):
+        self.busy = False
+        self.checkouts = 0
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        if self.busy:
+            raise TimeoutError('FaceMesh pool is busy')
+        self.checkouts += 1
+        yield 'face_mesh'
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    """
+    顔認証は recognized_from 枚目以降のフレームで name を返し、目線認証は directions の方向を順に返す。
+    """
+    fake = SimpleNamespace(name='alice', recognized_from=2, directions=[], pool=FakeFaceMeshPool(),
+                           face_meshes=[], face_boxes=[])
+
+    def recognize_face_in_frame(frame, gallery, overlay=None, rgb_frame=None):
+        assert rgb_frame is not None
+        fake.frame_index = getattr(fake, 'frame_index', -1) + 1
+        if fake.frame_index < fake.recognized_from:
+            return None
+        if overlay is not None:
+            overlay.append(((10, 70, 50, 20), fake.name))
+        return fake.name
+
+    def process_gaze_frame(frame, eye_open, face_mesh, image_rgb=None, face_box=None):
+        fake.face_meshes.append(face_mesh)
+        fake.face_boxes.append(face_box)
+        direction = fake.directions.pop(0) if fake.directions else None
+        return direction, eye_open, {'face_box': (0, 0, 80, 60)}
+
+    monkeypatch.setattr(login_session, 'recognize_face_in_frame', recognize_face_in_frame)
+    monkeypatch.setattr(login_session, 'process_gaze_frame', process_gaze_frame)
+    monkeypatch.setattr(login_session, 'face_mesh_pool', fake.pool)
+    return fake
+
+
+def gaze_frames(*directions):
+    return [direction for direction in directions for _ in range(1 if direction == 'blink' else GAZE_STABLE_FRAMES)]
+
+
+def make_session(user=None, frames=100, face_timeout=3.0, gaze_timeout=5.0, gallery=None):
+    user = user if user is not None else SimpleNamespace(username='alice', eye_pattern_1=PATTERN[0],
+                                                         eye_pattern_2=PATTERN[1], eye_pattern_3=PATTERN[2],
+                                                         eye_pattern_4=PATTERN[3])
+    source = FakeFrameSource(frames)
+    if gallery is None:
+        gallery = FakeGallery()
+    session = LoginSession(gallery, lambda name: user if name == user.username else None,
+                           source=source, face_timeout=face_timeout, gaze_timeout=gaze_timeout, headless=True)
+    return session, source, user
+
+
+def test_face_then_gaze_success(fake):
+    fake.directions = gaze_frames(*PATTERN)
+    session, source, user = make_session()
+
+    assert session.run() is user
+    assert session.stage == LoginSession.SUCCESS
+    assert session.failed_stage is None
+    # 顔認証は3枚目（映像内の 0.2 秒）で成功し、同じ入力元のフレームで目線認証を続ける
+    assert session.face_seconds == pytest.approx(2 / FPS)
+    assert session.frames == 3 + len(gaze_frames(*PATTERN))
+    assert session.time_to_decision == pytest.approx((session.frames - 1) / FPS)
+    # 目線認証の最初のフレームには顔認証で見つけた顔の位置を渡す
+    assert fake.face_boxes[0] == (10, 70, 50, 20)
+    assert fake.face_boxes[1] == (0, 0, 80, 60)
+    assert set(fake.face_meshes) == {'face_mesh'}
+    assert fake.pool.checkouts == 1
+    # 渡された入力元は閉じない
+    assert not source.released
+
+
+def test_unknown_face_times_out(fake):
+    fake.name = 'mallory'
+    session, _, _ = make_session(face_timeout=1.0)
+
+    assert session.run() is None
+    assert session.stage == LoginSession.FAILED
+    assert session.failed_stage == LoginSession.FACE
+    assert session.time_to_decision == pytest.approx(1.1)
+    assert fake.pool.checkouts == 0
+
+
+def test_gaze_times_out(fake):
+    fake.directions = gaze_frames('left', 'left')
+    session, _, _ = make_session(gaze_timeout=2.0)
+
+    assert session.run() is None
+    assert session.failed_stage == LoginSession.GAZE
+    assert session.face_seconds == pytest.approx(0.2)
+
+
+def test_wrong_gaze_pattern_does_not_succeed(fake):
+    fake.directions = gaze_frames('right', 'left', 'center', 'blink')
+    session, _, _ = make_session(gaze_timeout=2.0)
+
+    assert session.run() is None
+    assert session.failed_stage == LoginSession.GAZE
+
+
+def test_busy_face_mesh_pool(fake):
+    fake.pool.busy = True
+    session, _, _ = make_session()
+
+    assert session.run() is None
+    assert session.stage == LoginSession.FAILED
+    assert session.failed_stage == LoginSession.BUSY
+    assert session.user is not None
+
+
+def test_source_runs_out_of_frames(fake):
+    fake.recognized_from = 100
+    session, _, _ = make_session(frames=5)
+
+    assert session.run() is None
+    assert session.failed_stage == LoginSession.FACE
+    assert session.frames == 5
+
+
+def test_empty_gallery(fake):
+    session, _, _ = make_session(gallery=FakeGallery(0))
+
+    assert session.run() is None
+    assert session.failed_stage == LoginSession.FACE
+    assert session.frames == 0
+
+
+def test_process_returns_overlay_for_each_stage(fake):
+    fake.recognized_from = 0
+    session, _, _ = make_session()
+    frame = np.zeros((60, 80, 3), dtype=np.uint8)
+
+    render, args = session.process(frame, debug=True)
+    assert render is render_face_overlay
+    assert args == ([((10, 70, 50, 20), 'alice')],)
+    assert session.stage == LoginSession.GAZE
+
+    fake.directions = ['left']
+    render, args = session.process(frame, 'face_mesh', debug=True)
+    assert args == ({'face_box': (0, 0, 80, 60)},)
+    assert session.process(frame, 'face_mesh') is None
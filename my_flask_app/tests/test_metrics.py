@@ -0,0 +1,81 @@
+import pytest
+import metrics
+from metrics import Counter, Gauge, Histogram, StageTimer
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # テストで作る計測値をアプリの /metrics に出さない
+    monkeypatch.setattr(metrics, '_registry', [])
+
+
+def test_counter_render():
+    counter = Counter('test_total', 'Test counter.', ['pipeline'])
+    counter.inc(pipeline='face')
+    counter.inc(2, pipeline='face')
+    counter.inc(pipeline='gaze')
+    assert counter.render() == [
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        'test_total{pipeline="face"} 3',
+        'test_total{pipeline="gaze"} 1',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter('test_total', 'Test counter.', ['reason'])
+    counter.inc(reason='a "b"\\c\nd')
+    assert counter.render()[-1] == 'test_total{reason="a \\"b\\"\\\\c\\nd"} 1'
+
+
+def test_gauge_render_and_callback():
+    gauge = Gauge('test_in_use', 'Test gauge.')
+    gauge.set(0.5)
+    assert gauge.render()[-1] == 'test_in_use 0.5'
+
+    values = {('face',): 2}
+    callback_gauge = Gauge('test_busy', 'Callback gauge.', ['pool'], callback=lambda: values)
+    assert callback_gauge.render()[-1] == 'test_busy{pool="face"} 2'
+    values = {('face',): 5}
+    assert callback_gauge.render()[-1] == 'test_busy{pool="face"} 5'
+
+
+def test_histogram_render():
+    histogram = Histogram('test_seconds', 'Test histogram.', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, stage='detect')
+    assert histogram.render() == [
+        '# HELP test_seconds Test histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{stage="detect",le="0.1"} 2',
+        'test_seconds_bucket{stage="detect",le="1.0"} 3',
+        'test_seconds_bucket{stage="detect",le="+Inf"} 4',
+        'test_seconds_sum{stage="detect"} 3.65',
+        'test_seconds_count{stage="detect"} 4',
+    ]
+
+
+def test_stage_timer_records_histogram():
+    histogram = Histogram('test_stage_seconds', 'Stage histogram.', ['pipeline', 'stage'])
+    timer = StageTimer(histogram, 'face')
+    with timer.stage('encode'):
+        pass
+    with timer.stage('encode'):
+        pass
+    assert 'test_stage_seconds_count{pipeline="face",stage="encode"} 2' in histogram.render()
+
+
+def test_render_joins_registered_metrics():
+    Counter('first_total', 'First.').inc()
+    Gauge('second', 'Second.').set(4)
+    text = metrics.render()
+    assert text.endswith('\n')
+    assert text.index('first_total 1') < text.index('second 4')
+
+
+def test_metrics_endpoint(client, monkeypatch):
+    Counter('endpoint_total', 'Endpoint.').inc(7)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'endpoint_total 7' in response.get_data(as_text=True)
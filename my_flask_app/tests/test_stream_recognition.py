@@ -0,0 +1,52 @@
+import threading
+import cv2
+import numpy as np
+from face_gallery import FaceGallery
+from stream_recognition import StreamRecognitionServer
+from test_face_gallery import make_rows
+
+
+def write_frames(directory, count):
+    directory.mkdir()
+    for index in range(count):
+        cv2.imwrite(str(directory / f"{index:03d}.png"), np.full((48, 64, 3), index % 25 * 10, dtype=np.uint8))
+    return str(directory)
+
+
+def test_server_processes_every_frame_of_each_source(tmp_path):
+    gallery = FaceGallery()
+    gallery.load(make_rows(5))
+    sources = [write_frames(tmp_path / 'a', 6), write_frames(tmp_path / 'b', 4)]
+    results = {}
+    lock = threading.Lock()
+
+    def on_result(name, frame_index, faces):
+        with lock:
+            results.setdefault(name, []).append((frame_index, faces))
+
+    server = StreamRecognitionServer(gallery, sources, workers=1, max_in_flight=2, on_result=on_result)
+    stats = server.run()
+
+    assert stats['workers'] == 1
+    assert stats['frames_processed'] == 10
+    assert [stream['frames_processed'] for stream in stats['streams']] == [6, 4]
+    assert all(stream['errors'] == 0 for stream in stats['streams'])
+    # 合成したフレームには顔が写っていない
+    assert sorted(index for index, _ in results[sources[0]]) == list(range(6))
+    assert sorted(index for index, _ in results[sources[1]]) == list(range(4))
+    assert all(faces == [] for entries in results.values() for _, faces in entries)
+
+
+def test_server_stop_ends_run(tmp_path):
+    gallery = FaceGallery()
+    gallery.load(make_rows(3))
+    source = write_frames(tmp_path / 'frames', 50)
+    server = None
+
+    def on_result(name, frame_index, faces):
+        if frame_index == 0:
+            server.stop()
+
+    server = StreamRecognitionServer(gallery, [source], workers=1, max_in_flight=1, on_result=on_result)
+    stats = server.run()
+    assert 1 <= stats['frames_processed'] < 50
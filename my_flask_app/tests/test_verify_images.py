@@ -0,0 +1,70 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pytest
+from conftest import add_user, log_in
+from face_gallery import FaceGallery, ENCODING_DIM
+
+
+@pytest.fixture
+def logged_in(app_module, client, monkeypatch):
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(0.0, 0.1, (3, ENCODING_DIM)).astype(np.float32)
+    gallery = FaceGallery.from_arrays([1, 2, 3], ['alice', 'bob', 'carol'], encodings)
+    monkeypatch.setattr(app_module, 'get_face_gallery', lambda: gallery)
+    log_in(client, add_user(app_module, 'operator'))
+    return client
+
+
+@pytest.fixture
+def pool(app_module, monkeypatch):
+    # プロセスを起動せずに、同じプロセスのスレッドで照合する
+    pool = ThreadPoolExecutor(1)
+    monkeypatch.setattr(app_module, 'get_verification_pool', lambda: pool)
+    yield pool
+    pool.shutdown()
+
+
+def post_images(client, images, **form):
+    data = dict(form)
+    data['images'] = [(io.BytesIO(content), name) for name, content in images]
+    return client.post('/verify_images', data=data, content_type='multipart/form-data')
+
+
+def test_verify_images_requires_images(logged_in):
+    response = logged_in.post('/verify_images', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('form', [
+    {'k': '0'},
+    {'k': '1000'},
+    {'k': 'abc'},
+    {'threshold': '-1'},
+    {'threshold': 'nan'},
+    {'threshold': 'inf'},
+    {'threshold': 'abc'},
+])
+def test_verify_images_rejects_invalid_parameters(logged_in, form):
+    response = post_images(logged_in, [('a.jpg', b'not an image')], **form)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_verify_images_streams_results(logged_in, pool):
+    blank = cv2.imencode('.png', np.zeros((120, 160, 3), dtype=np.uint8))[1].tobytes()
+    response = post_images(logged_in, [('a.jpg', b'not an image'), ('b.png', blank)])
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    response.close()
+    outcomes = {result['image']: result['outcome'] for result in results}
+    assert outcomes == {'a.jpg': 'error', 'b.png': 'no_face'}
+
+
+def test_verify_images_requires_login(client):
+    response = post_images(client, [('a.jpg', b'not an image')])
+    assert response.status_code in (302, 401)
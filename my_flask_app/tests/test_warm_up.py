@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.mark.parametrize('debug, run_main, expected', [
+    (False, None, True),
+    # リローダーのファイルを監視するだけのプロセス
+    (True, None, False),
+    # リローダーがリクエストを受け付けるために起動した子プロセス
+    (True, 'true', True),
+])
+def test_should_warm_up(app_module, monkeypatch, debug, run_main, expected):
+    if run_main is None:
+        monkeypatch.delenv('WERKZEUG_RUN_MAIN', raising=False)
+    else:
+        monkeypatch.setenv('WERKZEUG_RUN_MAIN', run_main)
+    assert app_module.should_warm_up(debug) is expected